@@ -3,9 +3,13 @@
 import reflex as rx
 import reflex_chakra as rc
 
+from Cloud_Kinetics.api import api
+from Cloud_Kinetics.chat.persistence import flush_on_shutdown
+from Cloud_Kinetics.chat.state import State as ChatState
 from Cloud_Kinetics.components import chat, navbar
 from Cloud_Kinetics.components.chat import action_bar
 from Cloud_Kinetics.pages.upload_page import upload_page
+from Cloud_Kinetics.warmup import warm_up_on_start
 
 from rxconfig import config
 
@@ -26,9 +30,13 @@ def index() -> rx.Component:
         min_height="100vh",
         align_items="stretch",
         spacing="0",
+        # Resolves the chat user and loads their sessions in every identity mode
+        on_mount=ChatState.load_session,
     )
 
-app = rx.App()
+app = rx.App(api_transformer=api)
+app.register_lifespan_task(flush_on_shutdown)
+app.register_lifespan_task(warm_up_on_start)
 # app.add_page(index)
 app.add_page(index, route="/")
 app.add_page(upload_page, route="/upload")
\ No newline at end of file
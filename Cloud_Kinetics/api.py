@@ -0,0 +1,133 @@
+"""Plain HTTP endpoints served alongside the Reflex app."""
+import hmac
+import json
+import os
+import tempfile
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from Cloud_Kinetics.metrics import render_prometheus
+
+api = FastAPI()
+
+# Request bodies above this size spill from memory to a temporary file
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+@api.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> str:
+    """Prometheus text exposition of this process's metrics."""
+    return render_prometheus()
+
+
+@api.get("/ready")
+def ready() -> JSONResponse:
+    """200 once startup warm-up has finished (see warmup.py), 503 before; for ECS/ALB health checks."""
+    from Cloud_Kinetics.warmup import get_status
+
+    status = get_status()
+    return JSONResponse(status.as_dict(), status_code=200 if status.ready() else 503)
+
+
+def _has_token(request: Request, env_name: str) -> bool:
+    """True if the request carries ``Authorization: Bearer $<env_name>`` (and that token is set)."""
+    token = os.getenv(env_name)
+    return bool(token) and hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {token}")
+
+
+def _transfer_scope(request: Request) -> Optional[str]:
+    """The user_id a transfer request may touch; None means the whole table.
+
+    A bearer token matching ``CHAT_TRANSFER_TOKEN`` grants any ``user_id``
+    query parameter (or all users); everyone else is limited to their own
+    partition, identified by the ALB Cognito header. The header is only
+    trusted with ``CHAT_IDENTITY=alb``.
+    """
+    from Cloud_Kinetics.chat.identity import ALB_IDENTITY_HEADER, identity_mode
+
+    if _has_token(request, "CHAT_TRANSFER_TOKEN"):
+        return request.query_params.get("user_id") or None
+    sub = request.headers.get(ALB_IDENTITY_HEADER) if identity_mode() == "alb" else None
+    if not sub:
+        raise HTTPException(status_code=401, detail="Sign in or pass the transfer token")
+    return f"cognito#{sub}"
+
+
+def _chat_table_name() -> str:
+    return os.getenv("CHAT_TABLE_NAME", "ChatSession")
+
+
+@api.get("/chat/export")
+def chat_export(request: Request) -> StreamingResponse:
+    """Stream the caller's sessions (or any/all, with the transfer token) as NDJSON."""
+    from Cloud_Kinetics.aws import make_resource
+    from Cloud_Kinetics.chat.transfer import export_lines
+
+    user_id = _transfer_scope(request)
+    table = make_resource("dynamodb").Table(_chat_table_name())
+    return StreamingResponse(export_lines(table, user_id=user_id), media_type="application/x-ndjson")
+
+
+@api.post("/chat/import")
+async def chat_import(request: Request) -> dict:
+    """Load an NDJSON body; without the transfer token every session goes into the caller's partition."""
+    from Cloud_Kinetics.aws import make_resource
+    from Cloud_Kinetics.chat.transfer import import_lines
+
+    user_id = _transfer_scope(request)
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        return await run_in_threadpool(import_lines, make_resource("dynamodb"), _chat_table_name(), spool, user_id=user_id)
+
+
+@api.post("/chat/batch")
+async def chat_batch(request: Request) -> StreamingResponse:
+    """Answer an NDJSON body of questions (see chat/batch.py); results stream back as NDJSON as they complete."""
+    from Cloud_Kinetics.chat.batch import answer_lines
+
+    if not _has_token(request, "CHAT_BATCH_TOKEN"):
+        raise HTTPException(status_code=403, detail="CHAT_BATCH_TOKEN required")
+    # Read the whole body first: a client that sends everything before reading results must not deadlock
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+
+    async def results():
+        try:
+            async for result in answer_lines(spool):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            spool.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@api.get("/admin/profiling")
+def profiling_status(request: Request) -> dict:
+    """This process's profiling selection and the profiles it wrote recently."""
+    from Cloud_Kinetics import profiling
+
+    if not _has_token(request, "PROFILING_TOKEN"):
+        raise HTTPException(status_code=403, detail="PROFILING_TOKEN required")
+    return {"settings": profiling.get_settings().as_dict(), "recent": profiling.recent_profiles()}
+
+
+@api.put("/admin/profiling")
+async def profiling_configure(request: Request) -> dict:
+    """Replace the selection, e.g. ``{"users": ["cognito#..."], "expires_in_s": 600}``; ``{}`` turns it off."""
+    from Cloud_Kinetics import profiling
+
+    if not _has_token(request, "PROFILING_TOKEN"):
+        raise HTTPException(status_code=403, detail="PROFILING_TOKEN required")
+    body = await request.json()
+    allowed = {"events", "users", "sample_rate", "interval_ms", "output", "expires_in_s"}
+    unknown = set(body) - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {sorted(unknown)}")
+    return {"settings": profiling.configure(**body).as_dict()}
@@ -0,0 +1,58 @@
+import logging
+import os
+from typing import Any, Dict, List
+
+import boto3
+from dotenv import load_dotenv
+
+# Load .env before reading region/endpoint so CLI entry points match the app
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+aws_region = os.getenv('AWS_DEFAULT_REGION', 'ap-northeast-1')
+
+# Helper factories so all clients/resources consistently use LocalStack endpoint when set
+def make_client(service_name: str, region: str = None, **kwargs):
+    region = region or aws_region
+    endpoint = os.getenv('AWS_ENDPOINT_URL')
+    if endpoint:
+        return boto3.client(service_name, region_name=region, endpoint_url=endpoint, **kwargs)
+    return boto3.client(service_name, region_name=region, **kwargs)
+
+def make_resource(resource_name: str, region: str = None, **kwargs):
+    region = region or aws_region
+    endpoint = os.getenv('AWS_ENDPOINT_URL')
+    if endpoint:
+        return boto3.resource(resource_name, region_name=region, endpoint_url=endpoint, **kwargs)
+    return boto3.resource(resource_name, region_name=region, **kwargs)
+
+def list_objects(s3_client, bucket_name: str, prefix: str = "") -> List[Dict[str, Any]]:
+    """List objects (``Key``, ``ETag``, ``Size``, ...) under a prefix, paging through results.
+
+    Mirrors the app's lookup rules: try the prefix as given and as a folder, and
+    if neither matches fall back to every key that contains the prefix.
+    """
+    found: Dict[str, Dict[str, Any]] = {}
+    tried_prefixes = [prefix, prefix.rstrip('/') + '/'] if prefix else ['']
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for p in tried_prefixes:
+        try:
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=p):
+                for obj in page.get('Contents', []):
+                    k = obj.get('Key')
+                    if k and k not in found:
+                        found[k] = obj
+        except Exception as e:
+            logger.debug("list_objects_v2 failed for prefix '%s': %s", p, e)
+    if not found and prefix:
+        for page in paginator.paginate(Bucket=bucket_name):
+            for obj in page.get('Contents', []):
+                k = obj.get('Key')
+                if k and prefix in k:
+                    found[k] = obj
+    return list(found.values())
+
+def list_keys(s3_client, bucket_name: str, prefix: str = "") -> List[str]:
+    """List object keys under a prefix (see ``list_objects``)."""
+    return [obj['Key'] for obj in list_objects(s3_client, bucket_name, prefix)]
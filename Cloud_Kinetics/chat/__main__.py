@@ -0,0 +1,243 @@
+"""Command line entry point: ``python -m Cloud_Kinetics.chat <command>``."""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+
+def _report(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.chat.codec import report
+
+    rows = report(messages=args.messages, batch=args.batch)
+    for row in rows:
+        print(json.dumps(row))
+    return 0 if all(row["round_trip_ok"] for row in rows) else 1
+
+
+def _archive(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.aws import make_client, make_resource
+    from Cloud_Kinetics.chat.archive import archive_idle_sessions
+
+    if not args.bucket:
+        logging.error("No archive bucket given; pass --bucket or set CHAT_ARCHIVE_BUCKET")
+        return 2
+    table = make_resource("dynamodb").Table(args.table)
+    stats = archive_idle_sessions(table, make_client("s3"), args.bucket, args.prefix, args.idle_days, dry_run=args.dry_run)
+    print(json.dumps(stats))
+    return 0 if stats["failed"] == 0 else 1
+
+
+def _split_partition(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.aws import make_resource
+    from Cloud_Kinetics.chat.identity import split_shared_partition
+
+    mapping = {}
+    if args.mapping:
+        with open(args.mapping) as f:
+            mapping = json.load(f)
+    if not mapping and not args.assign_to:
+        logging.error("Nothing to do; pass --mapping and/or --assign-to")
+        return 2
+    table = make_resource("dynamodb").Table(args.table)
+    stats = split_shared_partition(
+        table, args.source, mapping, default_owner=args.assign_to, delete_source=args.delete_source, dry_run=args.dry_run
+    )
+    print(json.dumps(stats))
+    return 0
+
+
+def _search_backfill(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.aws import make_resource
+    from Cloud_Kinetics.chat.search import DynamoSearchIndex, backfill
+
+    if not args.search_table:
+        logging.error("No search table given; pass --search-table or set CHAT_SEARCH_TABLE")
+        return 2
+    dynamodb = make_resource("dynamodb")
+    stats = backfill(dynamodb.Table(args.table), DynamoSearchIndex(dynamodb.Table(args.search_table)), user_id=args.user)
+    print(json.dumps(stats))
+    return 0
+
+
+def _export(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.aws import make_client, make_resource
+    from Cloud_Kinetics.chat.transfer import export_lines
+
+    table = make_resource("dynamodb").Table(args.table)
+    s3_client = make_client("s3") if args.inline_archived else None
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for line in export_lines(table, user_id=args.user, s3_client=s3_client):
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def _import(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.aws import make_resource
+    from Cloud_Kinetics.chat.transfer import import_lines
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    try:
+        stats = import_lines(make_resource("dynamodb"), args.table, source, user_id=args.user, workers=args.workers)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(json.dumps(stats))
+    return 0 if stats["failed_items"] == 0 and stats["invalid_lines"] == 0 else 1
+
+
+def _transfer_bench(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.aws import make_resource
+    from Cloud_Kinetics.chat.transfer import benchmark
+
+    if not os.getenv("AWS_ENDPOINT_URL"):
+        logging.error("transfer-bench writes a large synthetic table; point AWS_ENDPOINT_URL at LocalStack or DynamoDB Local")
+        return 2
+    dynamodb = make_resource("dynamodb")
+    table = dynamodb.create_table(
+        TableName=args.table,
+        KeySchema=[{"AttributeName": "user_id", "KeyType": "HASH"}, {"AttributeName": "session_id", "KeyType": "RANGE"}],
+        AttributeDefinitions=[{"AttributeName": "user_id", "AttributeType": "S"}, {"AttributeName": "session_id", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    table.wait_until_exists()
+    try:
+        print(json.dumps(benchmark(dynamodb, table, args.messages, args.per_session, args.workers)))
+    finally:
+        table.delete()
+    return 0
+
+
+def _batch(args: argparse.Namespace) -> int:
+    import time
+
+    from Cloud_Kinetics.chat.batch import CONCURRENCY, answer_lines, run as run_batch
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    stats = {"results": 0, "errors": 0}
+    concurrency = args.concurrency or CONCURRENCY
+
+    async def run() -> None:
+        async for result in answer_lines(source, concurrency=concurrency, max_questions=args.max_questions):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            stats["results"] += 1
+            stats["errors"] += "error" in result
+
+    start = time.monotonic()
+    try:
+        run_batch(run(), concurrency)
+    finally:
+        for f in (source, out):
+            if f not in (sys.stdin, sys.stdout):
+                f.close()
+    seconds = time.monotonic() - start
+    stats.update(seconds=round(seconds, 3), questions_per_s=round(stats["results"] / seconds, 1) if seconds else 0.0)
+    logging.info("Batch finished: %s", json.dumps(stats))
+    return 0 if stats["errors"] == 0 else 1
+
+
+def _batch_bench(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.chat.batch import benchmark, run as run_batch
+
+    # Always against the stub: a benchmark must not send thousands of prompts to the real model
+    os.environ["BEDROCK_FAKE"] = "1"
+    sweep = [int(c) for c in args.concurrency.split(",")]
+    # Set the stub's rate and the admission queue explicitly, so the sweep measures the
+    # batch pipeline rather than the stub's default throttling (2 requests/s)
+    os.environ["BEDROCK_FAKE_RPS"] = str(args.rps)
+    os.environ["BEDROCK_FAKE_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["BEDROCK_MAX_RPS"] = os.environ["BEDROCK_BURST"] = str(args.rps)
+    os.environ["BEDROCK_MAX_CONCURRENCY"] = str(max(sweep))
+    for concurrency in sweep:
+        result = run_batch(benchmark(args.questions, concurrency), concurrency)
+        print(json.dumps({**result, "model_rps": args.rps, "model_latency_ms": args.latency_ms}))
+    return 0
+
+
+def main(argv=None) -> int:
+    load_dotenv()
+    from Cloud_Kinetics.chat.archive import archive_settings
+
+    parser = argparse.ArgumentParser(prog="python -m Cloud_Kinetics.chat")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    report = sub.add_parser("report", help="Compare item size and RCU/WCU per message codec on a synthetic history")
+    report.add_argument("--messages", type=int, default=200, help="Messages in the synthetic chat")
+    report.add_argument("--batch", type=int, default=1, help="Messages appended per write")
+    report.set_defaults(func=_report)
+
+    settings = archive_settings()
+    archive = sub.add_parser("archive", help="Move sessions idle longer than --idle-days to S3, leaving stub items")
+    archive.add_argument("--table", default=os.getenv("CHAT_TABLE_NAME", "ChatSession"))
+    archive.add_argument("--bucket", default=settings["bucket"])
+    archive.add_argument("--prefix", default=settings["prefix"])
+    archive.add_argument("--idle-days", type=float, default=settings["idle_days"])
+    archive.add_argument("--dry-run", action="store_true", help="Only list the sessions that would be archived")
+    archive.set_defaults(func=_archive)
+
+    split = sub.add_parser("split-partition", help="Move sessions from the old shared user_id onto per-user keys")
+    split.add_argument("--table", default=os.getenv("CHAT_TABLE_NAME", "ChatSession"))
+    split.add_argument("--source", default=os.getenv("AWS_USER_ARN", "arn:aws:iam::000000000000:root"),
+                       help="The shared user_id (the STS ARN the app used to write under)")
+    split.add_argument("--mapping", help="JSON file mapping session_id to its owner's user_id")
+    split.add_argument("--assign-to", help="Owner for sessions not in the mapping (e.g. cognito#<sub>)")
+    split.add_argument("--delete-source", action="store_true", help="Delete the shared items once copied")
+    split.add_argument("--dry-run", action="store_true")
+    split.set_defaults(func=_split_partition)
+
+    search = sub.add_parser("search-backfill", help="Index stored chat messages into the chat search table")
+    search.add_argument("--table", default=os.getenv("CHAT_TABLE_NAME", "ChatSession"))
+    search.add_argument("--search-table", default=os.getenv("CHAT_SEARCH_TABLE"))
+    search.add_argument("--user", help="Only this user_id (default: every user)")
+    search.set_defaults(func=_search_backfill)
+
+    export = sub.add_parser("export", help="Stream sessions as NDJSON (one session per line)")
+    export.add_argument("--table", default=os.getenv("CHAT_TABLE_NAME", "ChatSession"))
+    export.add_argument("--user", help="Only this user_id (default: the whole table)")
+    export.add_argument("--output", default="-", help="File to write (default: stdout)")
+    export.add_argument("--inline-archived", action="store_true", help="Read archived messages from S3 into the export")
+    export.set_defaults(func=_export)
+
+    load = sub.add_parser("import", help="Load NDJSON sessions with parallel BatchWriteItem")
+    load.add_argument("--table", default=os.getenv("CHAT_TABLE_NAME", "ChatSession"))
+    load.add_argument("--input", default="-", help="File to read (default: stdin)")
+    load.add_argument("--user", help="Import every session into this user_id")
+    load.add_argument("--workers", type=int, default=8)
+    load.set_defaults(func=_import)
+
+    bench = sub.add_parser("transfer-bench", help="Measure import/export throughput on a synthetic table (local endpoint only)")
+    bench.add_argument("--table", default="ChatSessionTransferBench", help="Scratch table, created and deleted")
+    bench.add_argument("--messages", type=int, default=1_000_000)
+    bench.add_argument("--per-session", type=int, default=100)
+    bench.add_argument("--workers", type=int, default=8)
+    bench.set_defaults(func=_transfer_bench)
+
+    batch = sub.add_parser("batch", help="Answer NDJSON questions (one per line), writing NDJSON results as they complete")
+    batch.add_argument("--input", default="-", help="File to read (default: stdin)")
+    batch.add_argument("--output", default="-", help="File to write (default: stdout)")
+    batch.add_argument("--concurrency", type=int, help="Questions in flight (default: BATCH_CONCURRENCY, or half of BEDROCK_MAX_CONCURRENCY)")
+    batch.add_argument("--max-questions", type=int, default=int(os.getenv("BATCH_MAX_QUESTIONS", "10000")))
+    batch.set_defaults(func=_batch)
+
+    batch_bench = sub.add_parser("batch-bench", help="Measure batch throughput in questions/s against the stub Bedrock client")
+    batch_bench.add_argument("--questions", type=int, default=2000)
+    batch_bench.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency values to sweep")
+    batch_bench.add_argument("--rps", type=float, default=1000, help="Requests/s the stub model accepts before throttling")
+    batch_bench.add_argument("--latency-ms", type=float, default=200, help="Stub model latency per call")
+    batch_bench.set_defaults(func=_batch_bench)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Cold-storage tier for idle chat sessions.
+
+Sessions that have not been written to for ``CHAT_ARCHIVE_IDLE_DAYS`` are
+moved to S3 as gzip-compressed NDJSON (one message per line). The DynamoDB
+item is replaced by a small stub that keeps the chat name and an ``archive``
+pointer, so ``load_session`` reads a few hundred bytes per cold chat instead
+of its full history. Opening an archived chat rehydrates it: the archived
+messages are prepended to the item again and the pointer is removed.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from botocore.exceptions import ClientError
+
+from Cloud_Kinetics.chat.codec import configured_codec, decode_messages, encode_messages
+
+logger = logging.getLogger(__name__)
+
+Message = Dict[str, str]
+
+_SESSION_TS = re.compile(r"#(\d{4}-\d{2}-\d{2}T[\d:.]+)Z?$")
+
+
+def utcnow_iso() -> str:
+    return f"{datetime.utcnow().isoformat()}Z"
+
+
+def last_activity(item: Dict[str, Any]) -> Optional[datetime]:
+    """When the session was last written; falls back to the session_id timestamp."""
+    value = item.get("updated_at")
+    if not value:
+        match = _SESSION_TS.search(item.get("session_id", ""))
+        value = match.group(1) if match else None
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.rstrip("Z"))
+    except ValueError:
+        return None
+
+
+def archive_key(prefix: str, user_id: str, session_id: str) -> str:
+    safe = re.sub(r"[^A-Za-z0-9._-]", "_", session_id)
+    return f"{prefix.strip('/')}/{user_id}/{safe}.ndjson.gz"
+
+
+def encode_ndjson(messages: List[Message]) -> bytes:
+    lines = "".join(json.dumps(m, ensure_ascii=False, separators=(",", ":")) + "\n" for m in messages)
+    return gzip.compress(lines.encode("utf-8"), compresslevel=9, mtime=0)
+
+
+def decode_ndjson(data: bytes) -> List[Message]:
+    return [json.loads(line) for line in gzip.decompress(data).decode("utf-8").splitlines() if line]
+
+
+def iter_idle_sessions(table, idle_days: float) -> Iterator[Dict[str, Any]]:
+    """Scan for hot sessions whose last activity is older than ``idle_days``."""
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+    kwargs: Dict[str, Any] = {
+        "FilterExpression": "attribute_not_exists(#archive)",
+        "ExpressionAttributeNames": {"#archive": "archive"},
+    }
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get("Items", []):
+            seen = last_activity(item)
+            if seen is not None and seen < cutoff:
+                yield item
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def archive_session(table, s3_client, bucket: str, prefix: str, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Move one session's messages to S3 and replace the item with a stub.
+
+    The stub is written conditionally on ``updated_at`` being unchanged, so a
+    session that received a message while it was being archived stays hot.
+    """
+    user_id, session_id = item["user_id"], item["session_id"]
+    messages = decode_messages(item)
+    key = archive_key(prefix, user_id, session_id)
+    body = encode_ndjson(messages)
+    s3_client.put_object(Bucket=bucket, Key=key, Body=body, ContentType="application/x-ndjson", ContentEncoding="gzip")
+    stub = {
+        "user_id": user_id,
+        "session_id": session_id,
+        "chat_name": item.get("chat_name", ""),
+        "updated_at": item.get("updated_at") or utcnow_iso(),
+        # The rolling summary is small and needed as soon as the chat is used again
+        **{k: item[k] for k in ("summary", "summary_turns") if k in item},
+        "archive": {"bucket": bucket, "key": key, "count": len(messages), "bytes": len(body), "archived_at": utcnow_iso()},
+    }
+    condition = "attribute_not_exists(updated_at)" if "updated_at" not in item else "updated_at = :seen"
+    kwargs: Dict[str, Any] = {"Item": stub, "ConditionExpression": condition}
+    if "updated_at" in item:
+        kwargs["ExpressionAttributeValues"] = {":seen": item["updated_at"]}
+    try:
+        table.put_item(**kwargs)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+            logger.info("Session '%s' changed while archiving; leaving it hot", session_id)
+            return None
+        raise
+    logger.info("Archived session '%s' (%s messages, %s bytes) to s3://%s/%s", session_id, len(messages), len(body), bucket, key)
+    return stub
+
+
+def archive_idle_sessions(table, s3_client, bucket: str, prefix: str, idle_days: float, dry_run: bool = False) -> Dict[str, int]:
+    stats = {"scanned_idle": 0, "archived": 0, "skipped": 0, "failed": 0}
+    for item in iter_idle_sessions(table, idle_days):
+        stats["scanned_idle"] += 1
+        if dry_run:
+            logger.info("Would archive session '%s' of user %s", item['session_id'], item['user_id'])
+            continue
+        try:
+            if archive_session(table, s3_client, bucket, prefix, item) is None:
+                stats["skipped"] += 1
+            else:
+                stats["archived"] += 1
+        except Exception as e:
+            stats["failed"] += 1
+            logger.error("Failed to archive session '%s': %s", item['session_id'], e)
+    return stats
+
+
+def is_archived(item: Dict[str, Any]) -> bool:
+    return "archive" in item
+
+
+def rehydrate_session(table, s3_client, item: Dict[str, Any]) -> List[Message]:
+    """Bring an archived session back into DynamoDB and return all its messages.
+
+    Archived messages are prepended to whatever was appended since archival,
+    using the same storage layout the write-behind writer uses. In the blob
+    layout the whole history is rewritten as blobs and any plain ``messages``
+    removed, so the item never holds both.
+    """
+    pointer = item["archive"]
+    archived = decode_ndjson(s3_client.get_object(Bucket=pointer["bucket"], Key=pointer["key"])["Body"].read())
+    recent = decode_messages(item)
+    codec = configured_codec()
+    key = {"user_id": item["user_id"], "session_id": item["session_id"]}
+    if codec == "none" and "message_blobs" not in item:
+        table.update_item(
+            Key=key,
+            UpdateExpression="SET messages = list_append(:archived, if_not_exists(messages, :empty)), updated_at = :now REMOVE #archive",
+            ConditionExpression="attribute_exists(#archive)",
+            ExpressionAttributeNames={"#archive": "archive"},
+            ExpressionAttributeValues={":archived": archived, ":empty": [], ":now": utcnow_iso()},
+        )
+    else:
+        history = archived + recent
+        condition = "attribute_exists(#archive) AND " + (
+            "attribute_not_exists(updated_at)" if "updated_at" not in item else "updated_at = :seen"
+        )
+        values = {":blobs": [encode_messages(history, "gzip" if codec == "none" else codec)] if history else [], ":now": utcnow_iso()}
+        if "updated_at" in item:
+            # Replaces the stored messages, so nothing may have been appended since they were read
+            values[":seen"] = item["updated_at"]
+        table.update_item(
+            Key=key,
+            UpdateExpression="SET message_blobs = :blobs, updated_at = :now REMOVE #archive, messages",
+            ConditionExpression=condition,
+            ExpressionAttributeNames={"#archive": "archive"},
+            ExpressionAttributeValues=values,
+        )
+    logger.info("Rehydrated session '%s' (%s messages) from s3://%s/%s", item['session_id'], len(archived), pointer['bucket'], pointer['key'])
+    return archived + recent
+
+
+def archive_settings() -> Dict[str, Any]:
+    # No fallback to S3_BUCKET_NAME: everything in the knowledge-base bucket can end up in other users' prompts
+    return {
+        "bucket": os.getenv("CHAT_ARCHIVE_BUCKET"),
+        "prefix": os.getenv("CHAT_ARCHIVE_PREFIX", "chat-archive"),
+        "idle_days": float(os.getenv("CHAT_ARCHIVE_IDLE_DAYS", "30")),
+    }
@@ -0,0 +1,214 @@
+"""Batch question answering over NDJSON, for offline evaluation and bulk workloads.
+
+Each input line is one question::
+
+    {"id": "q1", "question": "How do I scale an ECS service?", "context": "..."}
+
+``id`` defaults to the line number and ``context`` (earlier conversation) to
+none; a bare JSON string is accepted as the question. Results are NDJSON in
+completion order, not input order::
+
+    {"id": "q1", "question": ..., "answer": ..., "route": "fast", "model": ..., "seconds": 0.41, "shared": false}
+
+Lines that can't be parsed produce ``{"line": n, "error": ...}``.
+
+Retrieval work is shared across the batch: the question-independent
+knowledge base is loaded once instead of per question, repeated questions
+(same text and context) are answered once and the answer is fanned out
+(``"shared": true``), and passages of an external snapshot come through its
+range cache, so overlapping reads are fetched once.
+
+Model calls go through the same admission queue as interactive questions, so
+a batch stays within ``BEDROCK_MAX_RPS``. At most ``BATCH_CONCURRENCY``
+questions are in flight, which also bounds how many queue places a batch
+holds ahead of interactive users. It defaults to half of
+``BEDROCK_MAX_CONCURRENCY``, so a batch never takes every model slot. Input is
+read only as slots free up and results wait for the reader, so memory depends
+on the concurrency, not on the batch size. A batch whose reader goes away
+(a disconnected client) cancels every answer it started.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from Cloud_Kinetics import metrics
+
+logger = logging.getLogger(__name__)
+
+batch_questions = metrics.counter("batch_questions_total", "Batch questions by outcome")
+
+CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "0")) or max(1, int(os.getenv("BEDROCK_MAX_CONCURRENCY", "4")) // 2)
+MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "10000"))
+# Answers kept for repeated questions; duplicates further apart are answered again
+SHARED_ANSWERS = 4096
+
+Lines = Union[Iterable[Any], AsyncIterator[Any]]
+
+
+def parse_line(number: int, line: Union[str, bytes]) -> Dict[str, Any]:
+    """One input line as ``{"id", "question", "context"}``; ValueError if it has no question."""
+    record = json.loads(line)
+    if isinstance(record, str):
+        record = {"question": record}
+    if not isinstance(record, dict):
+        raise ValueError("expected an object or a string")
+    question = str(record.get("question") or "").strip()
+    if not question:
+        raise ValueError("no question")
+    return {"id": record.get("id", number), "question": question, "context": str(record.get("context") or "")}
+
+
+async def _numbered(lines: Lines) -> AsyncIterator[Tuple[int, Any]]:
+    number = 0
+    if hasattr(lines, "__aiter__"):
+        async for line in lines:
+            number += 1
+            yield number, line
+    else:
+        for line in lines:
+            number += 1
+            yield number, line
+
+
+async def answer_lines(
+    lines: Lines, concurrency: int = CONCURRENCY, max_questions: int = MAX_QUESTIONS
+) -> AsyncIterator[Dict[str, Any]]:
+    """Answer every question in ``lines``, yielding each result as soon as it is ready."""
+    from Cloud_Kinetics.chat.state import _retrieve, _route_question, _shared_retrieval, answer_question
+
+    shared = await asyncio.to_thread(_shared_retrieval)
+    slots = asyncio.Semaphore(concurrency)
+    results: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue(maxsize=concurrency)
+    answers: "OrderedDict[Tuple[str, str], asyncio.Future]" = OrderedDict()
+    running = set()
+    failure = []
+
+    async def answer(question: str, context: str) -> Dict[str, Any]:
+        retrieval = await asyncio.to_thread(_retrieve, question, shared)
+        plan = _route_question(question, context, retrieval)
+        text = await answer_question(question, context, plan, retrieval)
+        return {"answer": text, "route": plan.kind, "model": plan.model_id}
+
+    async def run(record: Dict[str, Any]) -> None:
+        start = time.monotonic()
+        key = (" ".join(record["question"].lower().split()), record["context"])
+        future = answers.get(key)
+        result: Dict[str, Any] = {"id": record["id"], "question": record["question"], "shared": future is not None}
+        try:
+            if future is None:
+                future = answers[key] = asyncio.ensure_future(answer(record["question"], record["context"]))
+                if len(answers) > SHARED_ANSWERS:
+                    answers.popitem(last=False)
+            else:
+                answers.move_to_end(key)
+            result.update(await asyncio.shield(future))
+            batch_questions.inc(outcome="shared" if result["shared"] else "answered")
+        except Exception as e:
+            logger.error("Batch question %s failed: %s", record["id"], e, exc_info=True)
+            result["error"] = str(e)
+            batch_questions.inc(outcome="error")
+        result["seconds"] = round(time.monotonic() - start, 3)
+        try:
+            await results.put(result)
+        finally:
+            slots.release()
+
+    async def produce() -> None:
+        count = 0
+        try:
+            async for number, line in _numbered(lines):
+                if not line.strip():
+                    continue
+                try:
+                    record = parse_line(number, line)
+                except ValueError as e:
+                    batch_questions.inc(outcome="invalid")
+                    await results.put({"line": number, "error": f"invalid line: {e}"})
+                    continue
+                count += 1
+                if count > max_questions:
+                    await results.put({"line": number, "error": f"batch limit of {max_questions} questions reached"})
+                    break
+                await slots.acquire()
+                task = asyncio.create_task(run(record))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            # Every slot back means every question has been answered
+            for _ in range(concurrency):
+                await slots.acquire()
+        except Exception as e:
+            failure.append(e)
+        finally:
+            await results.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            yield item
+        if failure:
+            raise failure[0]
+    finally:
+        producer.cancel()
+        for task in list(running):
+            task.cancel()
+        # Shared answers are shielded from their waiters; stop the model calls nobody will read
+        for future in answers.values():
+            future.cancel()
+
+
+def run(main: Awaitable[Any], concurrency: int = CONCURRENCY) -> Any:
+    """``asyncio.run`` for command-line batches.
+
+    Retrieval and model calls block a default-executor thread each; the
+    default pool (CPUs + 4 threads) would cap a batch well below
+    ``concurrency``. The app's shared loop keeps its own executor.
+    """
+    async def with_executor() -> Any:
+        pool = ThreadPoolExecutor(max_workers=concurrency + 4, thread_name_prefix="batch")
+        asyncio.get_running_loop().set_default_executor(pool)
+        return await main
+
+    return asyncio.run(with_executor())
+
+
+def synthetic_questions(count: int, repeat: float = 0.1, seed: int = 7) -> Iterator[str]:
+    """NDJSON questions; about ``repeat`` of them ask an earlier question again."""
+    rng = random.Random(seed)
+    services = ["ECS service", "S3 bucket", "DynamoDB table", "Bedrock model", "CloudFormation stack", "ALB listener"]
+    verbs = ["scale", "secure", "monitor", "troubleshoot", "tag", "back up", "migrate"]
+    asked = []
+    for i in range(count):
+        if asked and rng.random() < repeat:
+            question = rng.choice(asked)
+        else:
+            question = f"How do I {rng.choice(verbs)} the {rng.choice(services)} from step {i}?"
+            asked.append(question)
+        yield json.dumps({"id": i, "question": question}) + "\n"
+
+
+async def benchmark(count: int, concurrency: int = CONCURRENCY) -> Dict[str, Any]:
+    """Answer ``count`` synthetic questions and report throughput."""
+    start = time.monotonic()
+    first = None
+    outcomes = {"answered": 0, "shared": 0, "error": 0}
+    async for result in answer_lines(synthetic_questions(count), concurrency=concurrency, max_questions=count):
+        first = first or time.monotonic() - start
+        outcomes["error" if "error" in result else "shared" if result.get("shared") else "answered"] += 1
+    seconds = time.monotonic() - start
+    return {
+        "questions": count,
+        "concurrency": concurrency,
+        **outcomes,
+        "seconds": round(seconds, 3),
+        "first_result_s": round(first or 0.0, 3),
+        "questions_per_s": round(count / seconds, 1) if seconds else 0.0,
+    }
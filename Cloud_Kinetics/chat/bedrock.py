@@ -0,0 +1,343 @@
+"""Rate-limited access to Bedrock model invocations.
+
+Every model call goes through a per-process admission queue: a token bucket
+caps the request rate, a bounded pool caps concurrent calls, and anything over
+either limit waits in FIFO order instead of failing. A slot is held until the
+SDK call's worker thread finishes, even if the caller stopped waiting for it. Throttling responses that
+still get through are retried with full-jitter exponential backoff.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from Cloud_Kinetics import metrics
+from Cloud_Kinetics.aws import make_client
+from Cloud_Kinetics.chat.breaker import get_breaker
+
+logger = logging.getLogger(__name__)
+
+# Error codes that mean "slow down / try again" rather than a real failure
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+
+
+bedrock_calls = metrics.counter("bedrock_calls_total", "Bedrock invocations by outcome")
+bedrock_latency = metrics.histogram("bedrock_call_seconds", "Bedrock invocation latency")
+bedrock_queue_depth = metrics.gauge("bedrock_queue_depth", "Requests waiting for a Bedrock admission slot")
+bedrock_active = metrics.gauge("bedrock_active_calls", "Bedrock invocations in flight")
+
+
+class QueueFullError(Exception):
+    """Raised when the admission queue is already at its maximum length."""
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is short-circuiting model calls."""
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, up to ``burst`` stored."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self) -> float:
+        """Take a token if available. Returns 0, or the seconds until one is."""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class Ticket:
+    """A request's place in the admission queue."""
+
+    def __init__(self, queue: "AdmissionQueue"):
+        self._queue = queue
+        self.admitted = asyncio.Event()
+        self.released = False
+        self._calls = 0
+        self._freed = False
+
+    @property
+    def position(self) -> int:
+        """1-based queue position, or 0 once admitted."""
+        return self._queue.position(self)
+
+    async def wait_turn(self, poll_interval: float = 0.5, deadline: Optional[float] = None) -> AsyncIterator[int]:
+        """Yield the queue position each time it changes until admitted.
+
+        Raises asyncio.TimeoutError once the monotonic ``deadline`` passes,
+        checked on every poll so a queue that doesn't move still times out.
+        """
+        last = None
+        while not self.admitted.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                raise asyncio.TimeoutError("deadline passed while queued")
+            position = self.position
+            if position != last:
+                last = position
+                yield position
+            wait = poll_interval if deadline is None else max(0.0, min(poll_interval, deadline - time.monotonic()))
+            try:
+                await asyncio.wait_for(self.admitted.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run the blocking call ``fn`` on the queue's pool.
+
+        The slot is only given back once the thread has finished: cancelling
+        the await (a timeout) leaves the SDK call running, and it still counts
+        against the concurrency cap.
+        """
+        loop = asyncio.get_running_loop()
+        self._calls += 1
+        future = self._queue.executor.submit(fn, *args, **kwargs)
+
+        def finished(_) -> None:
+            try:
+                loop.call_soon_threadsafe(self._call_finished)
+            except RuntimeError:
+                pass  # loop already closed
+
+        future.add_done_callback(finished)
+        return await asyncio.wrap_future(future)
+
+    def _call_finished(self) -> None:
+        self._calls -= 1
+        self._free()
+
+    def _free(self) -> None:
+        if self.released and self._calls == 0 and not self._freed:
+            self._freed = True
+            self._queue.release(self)
+
+    def release(self) -> None:
+        self.released = True
+        self._free()
+
+
+class AdmissionQueue:
+    """FIFO admission control combining a token bucket and a concurrency cap."""
+
+    def __init__(self, rate: float, burst: float, max_concurrency: int, max_queue: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiting: Deque[Ticket] = deque()
+        # Admitted calls run here; it never needs more threads than admission slots
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="bedrock")
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiting)
+
+    def position(self, ticket: Ticket) -> int:
+        if ticket.admitted.is_set():
+            return 0
+        try:
+            return self._waiting.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def enqueue(self) -> Ticket:
+        if len(self._waiting) >= self.max_queue:
+            raise QueueFullError(f"Model admission queue is full ({self.max_queue} waiting)")
+        ticket = Ticket(self)
+        self._waiting.append(ticket)
+        self._pump()
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        if ticket.admitted.is_set():
+            self.active -= 1
+        else:
+            # Abandoned while still queued (e.g. the client went away)
+            try:
+                self._waiting.remove(ticket)
+            except ValueError:
+                pass
+        self._pump()
+
+    def _pump(self) -> None:
+        while self._waiting and self.active < self.max_concurrency:
+            wait = self.bucket.try_take()
+            if wait > 0:
+                self._schedule(wait)
+                break
+            ticket = self._waiting.popleft()
+            self.active += 1
+            ticket.admitted.set()
+        bedrock_queue_depth.set(len(self._waiting))
+        bedrock_active.set(self.active)
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is not None and not self._timer.cancelled():
+            return
+        loop = asyncio.get_running_loop()
+
+        def fire():
+            self._timer = None
+            self._pump()
+
+        self._timer = loop.call_later(delay, fire)
+
+
+_limiter: Optional[AdmissionQueue] = None
+
+
+def get_model_limiter() -> AdmissionQueue:
+    """Process-wide admission queue configured from BEDROCK_* env vars."""
+    global _limiter
+    if _limiter is None:
+        _limiter = AdmissionQueue(
+            rate=float(os.getenv("BEDROCK_MAX_RPS", "2")),
+            burst=float(os.getenv("BEDROCK_BURST", "4")),
+            max_concurrency=int(os.getenv("BEDROCK_MAX_CONCURRENCY", "4")),
+            max_queue=int(os.getenv("BEDROCK_MAX_QUEUE", "100")),
+        )
+    return _limiter
+
+
+_clients: Dict[str, object] = {}
+
+
+def get_bedrock_client(region: str = None):
+    """Cached bedrock-runtime client; a throttling fake when BEDROCK_FAKE=1."""
+    region = region or os.getenv('AWS_DEFAULT_REGION', 'ap-northeast-1')
+    if region not in _clients:
+        if os.getenv("BEDROCK_FAKE", "0") == "1":
+            from Cloud_Kinetics.chat.fake_bedrock import FakeBedrockClient
+
+            _clients[region] = FakeBedrockClient.from_env()
+        else:
+            # Retries are handled here with jitter, so keep the SDK from stacking its own
+            _clients[region] = make_client(
+                "bedrock-runtime",
+                region=region,
+                config=Config(
+                    retries={"mode": "standard", "max_attempts": 1},
+                    # Don't let abandoned calls hold worker threads past the question deadline
+                    read_timeout=float(os.getenv("BEDROCK_DEADLINE_S", "20")) + 5,
+                ),
+            )
+    return _clients[region]
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+    return False
+
+
+async def invoke_text(
+    prompt: str,
+    model_id: str = "anthropic.claude-v2",
+    max_tokens: int = 2000,
+    temperature: float = 0.7,
+    client=None,
+    ticket: Optional[Ticket] = None,
+) -> str:
+    """Invoke a text-completion model, retrying throttles with full-jitter backoff.
+
+    The blocking SDK call runs in a worker thread so the event loop keeps
+    serving other sessions while the model is generating; with an admission
+    ``ticket`` it runs on the queue's pool and holds the slot until it returns.
+    """
+    client = client or get_bedrock_client()
+    body = json.dumps({"prompt": prompt, "max_tokens_to_sample": max_tokens, "temperature": temperature})
+    attempts = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "5"))
+    base = float(os.getenv("BEDROCK_BACKOFF_BASE_S", "0.5"))
+    cap = float(os.getenv("BEDROCK_BACKOFF_CAP_S", "8"))
+    for attempt in range(attempts):
+        try:
+            response = await (ticket.run if ticket is not None else asyncio.to_thread)(
+                client.invoke_model,
+                modelId=model_id,
+                body=body,
+                contentType="application/json",
+                accept="application/json",
+            )
+            response_body = json.loads(response["body"].read())
+            return response_body.get("completion", "").strip()
+        except Exception as e:
+            if not _is_retryable(e) or attempt == attempts - 1:
+                raise
+            delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+            logger.warning("Bedrock throttled (%s); retry %s/%s in %.2fs", e, attempt + 1, attempts - 1, delay)
+            await asyncio.sleep(delay)
+    raise RuntimeError("unreachable")
+
+
+async def invoke_guarded(
+    prompt: str,
+    model_id: str = "anthropic.claude-v2",
+    max_tokens: int = 2000,
+    temperature: float = 0.7,
+    timeout: Optional[float] = None,
+    ticket: Optional[Ticket] = None,
+) -> str:
+    """``invoke_text`` behind the circuit breaker and an overall deadline.
+
+    Raises CircuitOpenError without calling the model while the breaker is
+    open, and asyncio.TimeoutError once ``timeout`` seconds have passed. A
+    timeout shorter than the breaker's latency SLO is the caller's budget
+    running out, not the model misbehaving, so it isn't recorded as a bad call.
+    """
+    breaker = get_breaker()
+    if not breaker.allow():
+        bedrock_calls.inc(outcome="short_circuit", model=model_id)
+        raise CircuitOpenError("Bedrock circuit breaker is open")
+    start = time.monotonic()
+    try:
+        answer = await asyncio.wait_for(invoke_text(prompt, model_id, max_tokens, temperature, ticket=ticket), timeout)
+    except asyncio.CancelledError:
+        # The caller went away; don't leave a half-open probe reserved
+        breaker.abandon()
+        raise
+    except asyncio.TimeoutError:
+        elapsed = time.monotonic() - start
+        bedrock_latency.observe(elapsed, model=model_id)
+        if elapsed > breaker.latency_slo_s:
+            breaker.record(False, elapsed)
+            bedrock_calls.inc(outcome="timeout", model=model_id)
+        else:
+            breaker.abandon()
+            bedrock_calls.inc(outcome="deadline", model=model_id)
+        raise
+    except Exception:
+        elapsed = time.monotonic() - start
+        breaker.record(False, elapsed)
+        bedrock_latency.observe(elapsed, model=model_id)
+        bedrock_calls.inc(outcome="error", model=model_id)
+        raise
+    elapsed = time.monotonic() - start
+    breaker.record(True, elapsed)
+    bedrock_latency.observe(elapsed, model=model_id)
+    bedrock_calls.inc(outcome="ok", model=model_id)
+    return answer
@@ -0,0 +1,118 @@
+"""Latency/error circuit breaker around model calls.
+
+The breaker watches a rolling window of recent calls. A call counts as bad if
+it failed or took longer than the latency SLO. When the bad fraction crosses
+the threshold the breaker opens and callers serve local-retrieval answers
+immediately. After a cool-down it goes half-open and lets a few probes
+through: a good probe closes it again, a bad one re-opens it.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional
+
+from Cloud_Kinetics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_state = metrics.gauge("bedrock_breaker_state", "Circuit breaker state (0=closed, 1=half_open, 2=open)")
+breaker_transitions = metrics.counter("bedrock_breaker_transitions_total", "Circuit breaker state transitions")
+breaker_rejections = metrics.counter("bedrock_breaker_rejections_total", "Calls short-circuited while the breaker was open")
+breaker_bad_ratio = metrics.gauge("bedrock_breaker_bad_ratio", "Fraction of failed or slow calls in the breaker window")
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str = "bedrock",
+        window: int = 20,
+        min_calls: int = 5,
+        bad_ratio: float = 0.5,
+        latency_slo_s: float = 10.0,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.bad_ratio = bad_ratio
+        self.latency_slo_s = latency_slo_s
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=window)  # True = bad call
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+        breaker_state.set(_STATE_VALUES[CLOSED], breaker=name)
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning("Circuit breaker '%s' %s -> %s", self.name, self.state, state)
+        self.state = state
+        breaker_state.set(_STATE_VALUES[state], breaker=self.name)
+        breaker_transitions.inc(breaker=self.name, to=state)
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state == CLOSED:
+            self._outcomes.clear()
+        self._probes_in_flight = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go to the model now (reserves a probe when half-open)."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            breaker_rejections.inc(breaker=self.name)
+            return False
+
+    def is_open(self) -> bool:
+        """True while calls should be short-circuited (open and still cooling down)."""
+        return self.state == OPEN and time.monotonic() - self._opened_at < self.open_seconds
+
+    def abandon(self) -> None:
+        """Give back a half-open probe slot for a call that never completed."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def record(self, success: bool, latency_s: float) -> None:
+        bad = (not success) or latency_s > self.latency_slo_s
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(OPEN if bad else CLOSED)
+                return
+            self._outcomes.append(bad)
+            ratio = sum(self._outcomes) / len(self._outcomes)
+            breaker_bad_ratio.set(ratio, breaker=self.name)
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls and ratio >= self.bad_ratio:
+                self._transition(OPEN)
+
+
+_breaker: Optional[CircuitBreaker] = None
+
+
+def get_breaker() -> CircuitBreaker:
+    """Process-wide breaker for Bedrock calls configured from BREAKER_* env vars."""
+    global _breaker
+    if _breaker is None:
+        _breaker = CircuitBreaker(
+            window=int(os.getenv("BREAKER_WINDOW", "20")),
+            min_calls=int(os.getenv("BREAKER_MIN_CALLS", "5")),
+            bad_ratio=float(os.getenv("BREAKER_BAD_RATIO", "0.5")),
+            latency_slo_s=float(os.getenv("BREAKER_LATENCY_SLO_S", "10")),
+            open_seconds=float(os.getenv("BREAKER_OPEN_SECONDS", "30")),
+        )
+    return _breaker
@@ -0,0 +1,115 @@
+"""Single-flight coalescing of identical in-flight questions.
+
+When several sessions ask the same question against the same knowledge base
+at the same time, only the first one loads the knowledge base and calls the
+model; the others join its flight and receive the same answer. Flights are
+per worker process and are forgotten as soon as they finish, so this never
+serves a stale answer - it only merges work that is happening concurrently.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from Cloud_Kinetics import metrics
+
+logger = logging.getLogger(__name__)
+
+flights_started = metrics.counter("question_flights_total", "Questions that started their own answer computation")
+flights_joined = metrics.counter("question_flights_coalesced_total", "Questions that joined an identical in-flight question")
+flights_in_progress = metrics.gauge("question_flights_in_progress", "Distinct questions currently being answered")
+
+
+def normalize_question(question: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation."""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+
+def question_key(question: str, kb_version: str, **params: Any) -> str:
+    """Coalescing key for a question, knowledge-base version and model parameters."""
+    payload = json.dumps([normalize_question(question), kb_version, params], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """One in-flight computation shared by every caller with the same key."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.waiters = 1
+        # Progress shared with followers so every session can show its queue position
+        self.queue_position = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def wait_done(self, poll_interval: float = 0.5) -> AsyncIterator[int]:
+        """Yield the shared queue position each time it changes until the result is ready."""
+        last = None
+        while not self.future.done():
+            if self.queue_position != last:
+                last = self.queue_position
+                yield last
+            await asyncio.wait([self.future], timeout=poll_interval)
+
+
+class SingleFlight:
+    def __init__(self, name: str = "questions"):
+        self.name = name
+        self._flights: Dict[str, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def join(self, key: str, factory: Callable[[Flight], Awaitable[Any]]) -> Tuple[Flight, bool]:
+        """Join the flight for ``key``, starting it with ``factory`` if there is none.
+
+        Returns the flight and whether this caller started it. The work runs in
+        its own task, so a leader that disconnects doesn't cancel the followers.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.waiters += 1
+            flights_joined.inc(group=self.name)
+            logger.debug("Joined in-flight question %s (%s waiting)", key[:12], flight.waiters)
+            return flight, False
+        flight = Flight(key)
+        self._flights[key] = flight
+        flights_started.inc(group=self.name)
+        flights_in_progress.set(len(self._flights), group=self.name)
+        flight.task = asyncio.ensure_future(self._run(flight, factory))
+        return flight, True
+
+    async def do(self, key: str, factory: Callable[[Flight], Awaitable[Any]]) -> Any:
+        """Run ``factory`` once per concurrent ``key`` and return its result to every caller."""
+        flight, _ = self.join(key, factory)
+        return await asyncio.shield(flight.future)
+
+    async def _run(self, flight: Flight, factory: Callable[[Flight], Awaitable[Any]]) -> None:
+        try:
+            result = await factory(flight)
+        except asyncio.CancelledError:
+            flight.future.cancel()
+            raise
+        except Exception as e:
+            flight.future.set_exception(e)
+            # Followers re-raise it; don't also log "exception was never retrieved"
+            flight.future.exception()
+        else:
+            flight.future.set_result(result)
+        finally:
+            self._flights.pop(flight.key, None)
+            flights_in_progress.set(len(self._flights), group=self.name)
+
+
+_question_flights: Optional[SingleFlight] = None
+
+
+def get_question_flights() -> SingleFlight:
+    """Process-wide coalescer for chat questions."""
+    global _question_flights
+    if _question_flights is None:
+        _question_flights = SingleFlight("questions")
+    return _question_flights
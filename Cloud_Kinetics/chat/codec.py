@@ -0,0 +1,198 @@
+"""Storage codec for chat messages in the ``ChatSession`` table.
+
+Legacy items keep messages as a plain ``messages`` list of
+``{"question", "answer"}`` maps. With ``CHAT_MESSAGE_CODEC`` set to ``gzip`` or
+``zstd``, each flushed batch of messages is instead stored as one compressed
+binary element of ``message_blobs``. Every blob starts with a small header
+(magic, format version, codec id) so it can be decoded regardless of the
+current setting. Once an item has ``message_blobs`` they hold its whole
+history: the first blob write folds any plain ``messages`` into a leading blob
+and removes the attribute (``fold_legacy_messages``). A stale ``messages`` left
+next to blobs is ignored. Writers that append plain messages check that the
+item has no blobs yet and write a blob otherwise, so turning the codec off
+again doesn't hide new messages.
+"""
+import gzip
+import json
+import logging
+import math
+import os
+import random
+import struct
+from typing import Any, Dict, Iterable, List
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+Message = Dict[str, str]
+
+BLOB_MAGIC = b"CKM"
+BLOB_VERSION = 1
+CODEC_IDS = {"gzip": 1, "zstd": 2}
+_HEADER = struct.Struct("<3sBB")
+
+
+def configured_codec() -> str:
+    """The codec new writes should use: ``none``, ``gzip`` or ``zstd``."""
+    codec = os.getenv("CHAT_MESSAGE_CODEC", "none").lower()
+    if codec == "zstd" and zstandard is None:
+        logger.warning("CHAT_MESSAGE_CODEC=zstd but the zstandard package is not installed; using gzip")
+        return "gzip"
+    if codec not in ("none", *CODEC_IDS):
+        logger.warning("Unknown CHAT_MESSAGE_CODEC '%s'; storing messages uncompressed", codec)
+        return "none"
+    return codec
+
+
+def encode_messages(messages: List[Message], codec: str) -> bytes:
+    """Compress a batch of messages into one versioned blob."""
+    raw = json.dumps([{"question": m["question"], "answer": m["answer"]} for m in messages],
+                     separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if codec == "zstd":
+        body = zstandard.ZstdCompressor(level=10).compress(raw)
+    else:
+        codec = "gzip"
+        body = gzip.compress(raw, compresslevel=9, mtime=0)
+    return _HEADER.pack(BLOB_MAGIC, BLOB_VERSION, CODEC_IDS[codec]) + body
+
+
+def decode_blob(blob: Any) -> List[Message]:
+    data = bytes(getattr(blob, "value", blob))  # boto3 returns Binary wrappers
+    magic, version, codec_id = _HEADER.unpack_from(data, 0)
+    if magic != BLOB_MAGIC or version > BLOB_VERSION:
+        raise ValueError(f"Unsupported message blob (magic={magic!r}, version={version})")
+    body = data[_HEADER.size:]
+    if codec_id == CODEC_IDS["zstd"]:
+        if zstandard is None:
+            raise RuntimeError("Message blob is zstd-compressed but zstandard is not installed")
+        raw = zstandard.ZstdDecompressor().decompress(body)
+    else:
+        raw = gzip.decompress(body)
+    return json.loads(raw.decode("utf-8"))
+
+
+def decode_messages(item: Dict[str, Any]) -> List[Message]:
+    """All messages of a ChatSession item; ``message_blobs`` win over a leftover ``messages`` list."""
+    if "message_blobs" not in item:
+        return [{"question": m["question"], "answer": m["answer"]} for m in item.get("messages", [])]
+    messages: List[Message] = []
+    for blob in item["message_blobs"]:
+        try:
+            messages.extend(decode_blob(blob))
+        except Exception as e:
+            logger.error("Skipping undecodable message blob in session '%s': %s", item.get('session_id'), e)
+    return messages
+
+
+def fold_legacy_messages(table, key: Dict[str, str], codec: str) -> None:
+    """Move an item's plain ``messages`` into a blob ahead of its other blobs and remove the attribute."""
+    item = table.get_item(Key=key, ConsistentRead=True).get("Item") or {}
+    if "messages" not in item:
+        return
+    legacy = [{"question": m["question"], "answer": m["answer"]} for m in item["messages"]]
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression="SET message_blobs = list_append(:legacy, if_not_exists(message_blobs, :empty)) REMOVE messages",
+            # Unchanged since it was read, so no message appended meanwhile is lost
+            ConditionExpression="size(messages) = :n",
+            ExpressionAttributeValues={
+                ":legacy": [encode_messages(legacy, codec)] if legacy else [],
+                ":empty": [],
+                ":n": len(item["messages"]),
+            },
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+            raise
+
+
+# --- size / capacity report ---------------------------------------------------
+
+def _value_size(value: Any) -> int:
+    """Approximate DynamoDB attribute value size in bytes."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float)):
+        return 1 + math.ceil(len(str(value)) / 2)
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode("utf-8")) + _value_size(v) + 1 for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(_value_size(v) + 1 for v in value)
+    raise TypeError(f"Unsupported attribute type {type(value)}")
+
+
+def item_size(item: Dict[str, Any]) -> int:
+    return sum(len(k.encode("utf-8")) + _value_size(v) for k, v in item.items())
+
+
+def _synthetic_history(n: int, seed: int = 7) -> List[Message]:
+    rng = random.Random(seed)
+    topics = ["ECS service", "S3 bucket policy", "DynamoDB capacity", "Bedrock model access", "CloudFormation stack"]
+    filler = (
+        "Based on the knowledge base, the recommended approach is to review the configuration, "
+        "confirm the IAM permissions, and check the relevant CloudWatch logs for errors. "
+    )
+    history = []
+    for i in range(n):
+        topic = rng.choice(topics)
+        question = f"How do I troubleshoot the {topic} issue we saw in step {i}?"
+        answer = (
+            f"To troubleshoot the {topic}: " + filler * rng.randint(2, 8)
+            + f"File: docs/{topic.lower().replace(' ', '-')}.md\n" + "- item\n" * rng.randint(3, 12)
+        )
+        history.append({"question": question, "answer": answer})
+    return history
+
+
+def report(messages: int = 200, batch: int = 1, codecs: Iterable[str] = ("none", "gzip", "zstd")) -> List[Dict[str, Any]]:
+    """Item bytes and capacity units for appending a synthetic history, per codec.
+
+    Appends ``batch`` messages per write, as the write-behind queue does, and
+    charges each write for the full item size after the update (DynamoDB bills
+    ``update_item`` on the larger of the before/after item). ``round_trip_ok``
+    records whether the item decodes back to the messages written.
+    """
+    history = _synthetic_history(messages)
+    rows = []
+    for codec in codecs:
+        if codec == "zstd" and zstandard is None:
+            continue
+        item: Dict[str, Any] = {"user_id": "user-123", "session_id": "Session#2024-01-01T00:00:00Z", "chat_name": "Intros"}
+        wcu = 0
+        for start in range(0, len(history), batch):
+            chunk = history[start:start + batch]
+            if codec == "none":
+                item.setdefault("messages", []).extend(chunk)
+            else:
+                item.setdefault("message_blobs", []).append(encode_messages(chunk, codec))
+            wcu += math.ceil(item_size(item) / 1024)
+        size = item_size(item)
+        if size > 400 * 1024:
+            logger.warning("%s: item would exceed DynamoDB's 400 KB limit (%s bytes)", codec, size)
+        round_trip = decode_messages(item) == history
+        if not round_trip:
+            logger.error("%s: decoded messages differ from the ones written", codec)
+        rows.append({
+            "codec": codec,
+            "messages": len(history),
+            "round_trip_ok": round_trip,
+            "item_bytes": size,
+            "load_rcu": math.ceil(size / 4096) / 2,  # eventually consistent read
+            "append_wcu_total": wcu,
+        })
+    base = rows[0]
+    for row in rows:
+        row["bytes_saved_pct"] = round(100 * (1 - row["item_bytes"] / base["item_bytes"]), 1)
+        row["wcu_saved_pct"] = round(100 * (1 - row["append_wcu_total"] / base["append_wcu_total"]), 1)
+    return rows
@@ -0,0 +1,68 @@
+"""A stand-in for the bedrock-runtime client for local load testing.
+
+It accepts the same ``invoke_model`` call, answers after a fixed latency and
+raises a real ``ThrottlingException`` when called faster than ``max_rps``, so the
+limiter and retry logic can be exercised without AWS. Enable it in the app
+with ``BEDROCK_FAKE=1``; ``BEDROCK_FAKE_MODEL_LATENCY_MS="model=ms,..."`` gives
+individual model ids their own latency for routing experiments.
+"""
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from botocore.exceptions import ClientError
+
+
+class FakeBedrockClient:
+    def __init__(
+        self,
+        max_rps: float = 2.0,
+        latency_s: float = 0.2,
+        completion: str = "(fake) answer",
+        model_latency_s: Optional[Dict[str, float]] = None,
+    ):
+        self.max_rps = max_rps
+        self.latency_s = latency_s
+        self.completion = completion
+        # Per-model latency overrides, to stand in for several models of different speed
+        self.model_latency_s = model_latency_s or {}
+        self.calls = 0
+        self.calls_by_model: Dict[str, int] = {}
+        self.throttled = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "FakeBedrockClient":
+        model_latency_s = {}
+        for pair in filter(None, os.getenv("BEDROCK_FAKE_MODEL_LATENCY_MS", "").split(",")):
+            model, _, ms = pair.partition("=")
+            model_latency_s[model.strip()] = float(ms) / 1000
+        return cls(
+            max_rps=float(os.getenv("BEDROCK_FAKE_RPS", "2")),
+            latency_s=float(os.getenv("BEDROCK_FAKE_LATENCY_MS", "200")) / 1000,
+            model_latency_s=model_latency_s,
+        )
+
+    def invoke_model(self, modelId: str, body: str, contentType: str = "application/json", accept: str = "application/json"):
+        now = time.monotonic()
+        with self._lock:
+            self.calls += 1
+            self.calls_by_model[modelId] = self.calls_by_model.get(modelId, 0) + 1
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.max_rps:
+                self.throttled += 1
+                raise ClientError(
+                    {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}},
+                    "InvokeModel",
+                )
+            self._recent.append(now)
+        time.sleep(self.model_latency_s.get(modelId, self.latency_s))
+        payload = json.loads(body)
+        completion = f"{self.completion} [{modelId}, {len(payload.get('prompt', ''))} prompt chars]"
+        return {"body": io.BytesIO(json.dumps({"completion": completion}).encode("utf-8"))}
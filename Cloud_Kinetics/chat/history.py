@@ -0,0 +1,134 @@
+"""Server-side chat history, kept out of the serialized ``rx.State``.
+
+State only carries chat names and the visible window of the current chat;
+full message lists live here, keyed by user and chat. With ``REDIS_URL`` set
+the history is stored in Redis lists so every backend task sees the same data,
+otherwise it stays in process memory.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Message = Dict[str, str]
+
+
+class InMemoryHistoryStore:
+    """Per-process history store, used when no Redis is configured."""
+
+    def __init__(self):
+        self._chats: Dict[Tuple[str, str], List[Message]] = {}
+        self._lock = threading.Lock()
+
+    def length(self, user_id: str, chat: str) -> int:
+        return len(self._chats.get((user_id, chat), []))
+
+    def window(self, user_id: str, chat: str, start: int, end: int) -> List[Message]:
+        return [dict(m) for m in self._chats.get((user_id, chat), [])[start:end]]
+
+    def append(self, user_id: str, chat: str, message: Message) -> int:
+        with self._lock:
+            messages = self._chats.setdefault((user_id, chat), [])
+            messages.append(dict(message))
+            return len(messages) - 1
+
+    def set(self, user_id: str, chat: str, position: int, message: Message) -> None:
+        """Overwrite the message at ``position``; appended if the chat no longer reaches it."""
+        with self._lock:
+            messages = self._chats.setdefault((user_id, chat), [])
+            if position < len(messages):
+                messages[position] = dict(message)
+            else:
+                messages.append(dict(message))
+
+    def replace(self, user_id: str, chat: str, messages: List[Message]) -> None:
+        with self._lock:
+            self._chats[(user_id, chat)] = [dict(m) for m in messages]
+
+    def delete(self, user_id: str, chat: str) -> None:
+        with self._lock:
+            self._chats.pop((user_id, chat), None)
+
+
+class RedisHistoryStore:
+    """History store backed by one Redis list per chat."""
+
+    def __init__(self, url: str, ttl_seconds: int = 60 * 60 * 24):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._ttl = ttl_seconds
+
+    @staticmethod
+    def _key(user_id: str, chat: str) -> str:
+        return f"chat-history:{user_id}:{chat}"
+
+    def length(self, user_id: str, chat: str) -> int:
+        return int(self._redis.llen(self._key(user_id, chat)))
+
+    def window(self, user_id: str, chat: str, start: int, end: int) -> List[Message]:
+        if end <= start:
+            return []
+        raw = self._redis.lrange(self._key(user_id, chat), start, end - 1)
+        return [json.loads(r) for r in raw]
+
+    def append(self, user_id: str, chat: str, message: Message) -> int:
+        key = self._key(user_id, chat)
+        pipe = self._redis.pipeline()
+        pipe.rpush(key, json.dumps(message))
+        pipe.expire(key, self._ttl)
+        length, _ = pipe.execute()
+        return int(length) - 1
+
+    def set(self, user_id: str, chat: str, position: int, message: Message) -> None:
+        """Overwrite the message at ``position`` and refresh the TTL.
+
+        The list may have expired or been lost in a Redis restart while the
+        answer was computed; then the message is appended instead, so the
+        answer isn't dropped.
+        """
+        import redis
+
+        key = self._key(user_id, chat)
+        pipe = self._redis.pipeline()
+        pipe.lset(key, position, json.dumps(message))
+        pipe.expire(key, self._ttl)
+        try:
+            pipe.execute()
+        except redis.ResponseError as e:
+            logger.warning("History of chat '%s' no longer has message %s (%s); appending", chat, position, e)
+            self.append(user_id, chat, message)
+
+    def replace(self, user_id: str, chat: str, messages: List[Message]) -> None:
+        key = self._key(user_id, chat)
+        pipe = self._redis.pipeline()
+        pipe.delete(key)
+        if messages:
+            pipe.rpush(key, *[json.dumps(m) for m in messages])
+            pipe.expire(key, self._ttl)
+        pipe.execute()
+
+    def delete(self, user_id: str, chat: str) -> None:
+        self._redis.delete(self._key(user_id, chat))
+
+
+_store: Optional[object] = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """Process-wide history store; Redis when REDIS_URL is set."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                url = os.getenv("REDIS_URL")
+                if url:
+                    _store = RedisHistoryStore(url, ttl_seconds=int(os.getenv("CHAT_HISTORY_TTL_S", str(60 * 60 * 24))))
+                    logger.info("Using Redis chat history store")
+                else:
+                    _store = InMemoryHistoryStore()
+    return _store
@@ -0,0 +1,115 @@
+"""Per-user identity for chat sessions.
+
+``ChatSession`` is partitioned by ``user_id``, so every browser session
+needs its own id or all traffic lands on one partition key. The id comes from:
+
+* ``alb`` - the Cognito ``sub`` that an ALB ``authenticate-cognito`` listener
+  rule puts in the ``x-amzn-oidc-identity`` header (the ALB overwrites any
+  client-supplied value). A request without the header is refused. Only use
+  this mode when the tasks can't be reached except through that listener:
+  anyone who can connect directly can send the header themselves;
+* ``local`` - a random id kept in the browser's local storage, a stand-in for
+  development without Cognito;
+* ``auto`` (default) - the browser id; the ALB header is ignored, since nothing
+  guarantees it came from the ALB;
+* ``shared`` - the old behaviour: one process-wide id from STS.
+
+Select with ``CHAT_IDENTITY``. ``split_shared_partition`` moves sessions out
+of the old shared partition onto per-user keys.
+"""
+import logging
+import os
+import uuid
+from typing import Any, Dict, Mapping, Optional
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+ALB_IDENTITY_HEADER = "x-amzn-oidc-identity"
+MODES = ("auto", "alb", "local", "shared")
+
+
+class IdentityError(Exception):
+    """Raised when CHAT_IDENTITY=alb and the request carries no ALB identity."""
+
+
+def identity_mode() -> str:
+    mode = os.getenv("CHAT_IDENTITY", "auto").lower()
+    if mode not in MODES:
+        logger.warning("Unknown CHAT_IDENTITY '%s'; using 'auto'", mode)
+        return "auto"
+    return mode
+
+
+def new_browser_id() -> str:
+    return uuid.uuid4().hex
+
+
+def resolve_user_id(headers: Mapping[str, str], browser_id: str, shared_id: str) -> Optional[str]:
+    """Partition key for the connected user, or None until the browser has an id.
+
+    Raises IdentityError in ``alb`` mode when the header is missing, rather
+    than falling back to an id the client chooses.
+    """
+    mode = identity_mode()
+    if mode == "shared":
+        return shared_id
+    if mode == "alb":
+        sub = headers.get(ALB_IDENTITY_HEADER)
+        if not sub:
+            raise IdentityError(f"CHAT_IDENTITY=alb but no {ALB_IDENTITY_HEADER} header; is the ALB authenticate rule in place?")
+        return f"cognito#{sub}"
+    if browser_id:
+        return f"local#{browser_id}"
+    return None
+
+
+def split_shared_partition(
+    table,
+    source_user_id: str,
+    mapping: Dict[str, str],
+    default_owner: Optional[str] = None,
+    delete_source: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """Copy sessions stored under ``source_user_id`` onto their owners' keys.
+
+    ``mapping`` assigns session ids to owners; anything unmapped goes to
+    ``default_owner`` or is left in place. Copies are conditional on the target
+    not existing, so the migration can be re-run safely. The source items are
+    deleted only with ``delete_source``.
+    """
+    stats = {"seen": 0, "copied": 0, "already_present": 0, "unassigned": 0, "deleted": 0}
+    kwargs: Dict[str, Any] = {
+        "KeyConditionExpression": "user_id = :uid",
+        "ExpressionAttributeValues": {":uid": source_user_id},
+    }
+    while True:
+        response = table.query(**kwargs)
+        for item in response.get("Items", []):
+            stats["seen"] += 1
+            session_id = item["session_id"]
+            owner = mapping.get(session_id, default_owner)
+            if not owner:
+                stats["unassigned"] += 1
+                continue
+            if dry_run:
+                logger.info("Would move session '%s' to %s", session_id, owner)
+                continue
+            try:
+                table.put_item(
+                    Item=dict(item, user_id=owner),
+                    ConditionExpression="attribute_not_exists(session_id)",
+                )
+                stats["copied"] += 1
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+                stats["already_present"] += 1
+            if delete_source:
+                table.delete_item(Key={"user_id": source_user_id, "session_id": session_id})
+                stats["deleted"] += 1
+        if "LastEvaluatedKey" not in response:
+            return stats
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
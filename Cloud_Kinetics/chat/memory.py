@@ -0,0 +1,79 @@
+"""Bounded multi-turn context: a rolling summary plus the last K turns.
+
+The prompt for a follow-up question carries the chat's summary and its most
+recent ``CHAT_CONTEXT_TURNS`` turns, each clipped, so prompt size stays
+bounded however long the chat gets. When turns slide out of the recent
+window they are folded into the summary, either extractively (default) or by
+asking the model to rewrite it (``CHAT_SUMMARY_MODE=model``). The summary and
+the number of turns it covers are persisted with the session.
+"""
+import logging
+import os
+import re
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+Message = Dict[str, str]
+
+CONTEXT_TURNS = int(os.getenv("CHAT_CONTEXT_TURNS", "4"))
+MAX_SUMMARY_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "2000"))
+MAX_TURN_CHARS = int(os.getenv("CHAT_CONTEXT_TURN_MAX_CHARS", "1200"))
+
+
+def summary_mode() -> str:
+    return os.getenv("CHAT_SUMMARY_MODE", "extractive").lower()
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[: limit - 3].rstrip() + "..."
+
+
+def _first_sentence(text: str) -> str:
+    match = re.search(r"(.+?[.!?])(\s|$)", " ".join(text.split()))
+    return match.group(1) if match else text
+
+
+def format_context(summary: str, recent: List[Message]) -> str:
+    """Conversation context for the prompt; empty for the first turn of a chat."""
+    parts = []
+    if summary:
+        parts.append(f"Summary of the earlier conversation:\n{summary}")
+    turns = [
+        f"User: {_clip(m['question'], MAX_TURN_CHARS // 3)}\nAssistant: {_clip(m['answer'], MAX_TURN_CHARS)}"
+        for m in recent
+        if m.get("question") and m.get("answer")
+    ]
+    if turns:
+        parts.append("Most recent turns:\n" + "\n\n".join(turns))
+    return "\n\n".join(parts)
+
+
+def fold_extractive(summary: str, turns: List[Message]) -> str:
+    """Append one line per folded turn, dropping the oldest lines past the cap."""
+    lines = summary.splitlines() if summary else []
+    for m in turns:
+        if not m.get("question"):
+            continue
+        lines.append(f"- Q: {_clip(m['question'], 160)} A: {_clip(_first_sentence(m.get('answer', '')), 240)}")
+    while lines and len("\n".join(lines)) > MAX_SUMMARY_CHARS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def summary_prompt(summary: str, turns: List[Message]) -> str:
+    transcript = "\n\n".join(
+        f"User: {_clip(m['question'], 500)}\nAssistant: {_clip(m.get('answer', ''), 1500)}" for m in turns if m.get("question")
+    )
+    return (
+        "Human: Update the running summary of a support conversation with the new turns below. "
+        f"Keep facts, decisions and open questions; stay under {MAX_SUMMARY_CHARS // 6} words. "
+        "Reply with the summary only.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}\n\nAssistant:"
+    )
+
+
+def turns_to_fold(summary_turns: int, total_turns: int) -> range:
+    """Positions that have left the recent window but aren't in the summary yet."""
+    return range(summary_turns, max(summary_turns, total_turns - CONTEXT_TURNS))
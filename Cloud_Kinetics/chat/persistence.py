@@ -0,0 +1,319 @@
+"""Write-behind persistence of chat messages to DynamoDB.
+
+Event handlers hand answered messages to a per-process queue and return
+immediately; a background thread flushes them to the ``ChatSession`` table.
+All messages pending for a session go out in one ``update_item`` that
+appends them to the item's ``messages`` list, so a burst of questions costs
+one write per session instead of a read and a full rewrite per message. The
+session's rolling summary (see chat/memory.py) rides along in the same write.
+Sessions are flushed by a single worker, which keeps each session's writes
+in order. Failed writes are retried with exponential backoff, and whatever
+is still queued is flushed when the app shuts down.
+"""
+import asyncio
+import atexit
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from Cloud_Kinetics import metrics
+from Cloud_Kinetics.aws import make_resource
+from botocore.exceptions import ClientError
+
+from Cloud_Kinetics.chat.codec import configured_codec, encode_messages, fold_legacy_messages
+
+logger = logging.getLogger(__name__)
+
+SessionKey = Tuple[str, str]
+
+persist_queue_depth = metrics.gauge("chat_persist_queue_depth", "Chat messages waiting to be written to DynamoDB")
+persist_flush_seconds = metrics.histogram("chat_persist_flush_seconds", "Latency of one session's DynamoDB append")
+persist_writes = metrics.counter("chat_persist_writes_total", "DynamoDB session appends by outcome")
+persist_dropped = metrics.counter("chat_persist_dropped_messages_total", "Messages dropped after exhausting retries")
+
+
+class _Pending:
+    def __init__(self, chat_name: str):
+        self.chat_name = chat_name
+        self.messages: List[Dict[str, str]] = []
+        # Latest (summary text, turns covered) for the session, if it changed
+        self.summary: Optional[Tuple[str, int]] = None
+        self.attempts = 0
+        self.retry_at = 0.0
+
+
+class WriteBehindWriter:
+    def __init__(
+        self,
+        table,
+        flush_interval_s: float = 0.5,
+        max_batch: int = 25,
+        max_attempts: int = 8,
+        backoff_base_s: float = 0.5,
+        backoff_cap_s: float = 30.0,
+        codec: str = "none",
+    ):
+        self.table = table
+        self.codec = codec
+        self.flush_interval_s = flush_interval_s
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.backoff_base_s = backoff_base_s
+        self.backoff_cap_s = backoff_cap_s
+        self._pending: "OrderedDict[SessionKey, _Pending]" = OrderedDict()
+        self._in_flight: Dict[SessionKey, _Pending] = {}
+        # Deleted sessions; session ids are never reused, so late writes for them are dropped
+        self._discarded: Set[SessionKey] = set()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def depth(self) -> int:
+        with self._cond:
+            return self._depth()
+
+    def _depth(self) -> int:
+        queued = sum(len(p.messages) for p in self._pending.values())
+        return queued + sum(len(p.messages) for p in self._in_flight.values())
+
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _pending_for(self, user_id: str, session_id: str, chat_name: str) -> _Pending:
+        pending = self._pending.get((user_id, session_id))
+        if pending is None:
+            pending = self._pending[(user_id, session_id)] = _Pending(chat_name)
+        pending.chat_name = chat_name
+        return pending
+
+    def enqueue(self, user_id: str, session_id: str, chat_name: str, message: Dict[str, str]) -> None:
+        """Queue one message for the session; returns without touching DynamoDB."""
+        self.start()
+        with self._cond:
+            if (user_id, session_id) in self._discarded:
+                logger.debug("Dropping message for deleted session '%s'", session_id)
+                return
+            self._pending_for(user_id, session_id, chat_name).messages.append(dict(message))
+            persist_queue_depth.set(self._depth())
+            self._cond.notify()
+
+    def set_summary(self, user_id: str, session_id: str, chat_name: str, summary: str, turns: int) -> None:
+        """Queue the session's rolling summary; only the latest one is written."""
+        self.start()
+        with self._cond:
+            if (user_id, session_id) in self._discarded:
+                return
+            self._pending_for(user_id, session_id, chat_name).summary = (summary, turns)
+            self._cond.notify()
+
+    def pending_messages(self, user_id: str, session_id: str) -> List[Dict[str, str]]:
+        """Messages accepted for the session but not yet written, oldest first."""
+        key = (user_id, session_id)
+        with self._cond:
+            out = []
+            for source in (self._in_flight, self._pending):
+                if key in source:
+                    out.extend(dict(m) for m in source[key].messages)
+            return out
+
+    def discard(self, user_id: str, session_id: str, timeout: float = 5.0) -> None:
+        """Forget everything queued for a session that is being deleted.
+
+        Waits (up to ``timeout``) for a write of the session that is already
+        in flight, so the caller's delete lands after it; its retries and
+        anything enqueued for the session later are dropped, so the deleted
+        item is not recreated.
+        """
+        key = (user_id, session_id)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._discarded.add(key)
+            self._pending.pop(key, None)
+            while key in self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("Write for deleted session '%s' still in flight after %.1fs", session_id, timeout)
+                    break
+                self._cond.wait(min(remaining, 0.1))
+            persist_queue_depth.set(self._depth())
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until everything queued so far is written (or ``timeout`` passes)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            for pending in self._pending.values():
+                pending.retry_at = 0.0
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None:
+                    return False
+                self._cond.wait(min(remaining, 0.1))
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        if self._thread is None:
+            return
+        if not self.flush(timeout):
+            logger.error("Shutting down with %s chat messages not written to DynamoDB", self.depth)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout=1.0)
+
+    def _take_ready(self) -> List[Tuple[SessionKey, _Pending]]:
+        now = time.monotonic()
+        ready = []
+        for key in list(self._pending):
+            if len(ready) >= self.max_batch:
+                break
+            if self._pending[key].retry_at <= now:
+                ready.append((key, self._pending.pop(key)))
+        for key, pending in ready:
+            self._in_flight[key] = pending
+        return ready
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping and not self._pending:
+                    self._cond.wait()
+                if self._stopping and not self._pending:
+                    return
+                batch = self._take_ready()
+                if not batch:
+                    self._cond.wait(self.flush_interval_s)
+                    continue
+            for key, pending in batch:
+                self._write(key, pending)
+            with self._cond:
+                persist_queue_depth.set(self._depth())
+                self._cond.notify_all()
+            # Let a burst of messages accumulate into fewer writes
+            time.sleep(self.flush_interval_s)
+
+    def _update(self, key: SessionKey, pending: _Pending, codec: str) -> None:
+        user_id, session_id = key
+        assignments = ["chat_name = :name", "updated_at = :now"]
+        values = {":name": pending.chat_name, ":now": f"{datetime.utcnow().isoformat()}Z"}
+        kwargs = {}
+        if pending.messages:
+            if codec == "none":
+                attribute, new = "messages", pending.messages
+                # Plain messages next to blobs would be ignored by decode_messages
+                kwargs["ConditionExpression"] = "attribute_not_exists(message_blobs)"
+            else:
+                # One compressed blob per flushed batch (see chat/codec.py)
+                attribute, new = "message_blobs", [encode_messages(pending.messages, codec)]
+                kwargs["ConditionExpression"] = "attribute_not_exists(messages)"
+            assignments.append(f"{attribute} = list_append(if_not_exists({attribute}, :empty), :new)")
+            values.update({":empty": [], ":new": new})
+        if pending.summary is not None:
+            assignments.append("summary = :summary, summary_turns = :summary_turns")
+            values.update({":summary": pending.summary[0], ":summary_turns": pending.summary[1]})
+        self.table.update_item(
+            Key={"user_id": user_id, "session_id": session_id},
+            UpdateExpression="SET " + ", ".join(assignments),
+            ExpressionAttributeValues=values,
+            **kwargs,
+        )
+
+    def _write(self, key: SessionKey, pending: _Pending) -> None:
+        user_id, session_id = key
+        with self._cond:
+            if key in self._discarded:
+                self._in_flight.pop(key, None)
+                self._cond.notify_all()
+                return
+        start = time.monotonic()
+        try:
+            try:
+                self._update(key, pending, self.codec)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+                if self.codec == "none":
+                    # The item already keeps its history in blobs; stay in that layout
+                    self._update(key, pending, "gzip")
+                else:
+                    fold_legacy_messages(self.table, {"user_id": user_id, "session_id": session_id}, self.codec)
+                    self._update(key, pending, self.codec)
+        except Exception as e:
+            persist_flush_seconds.observe(time.monotonic() - start)
+            self._retry(key, pending, e)
+            return
+        persist_flush_seconds.observe(time.monotonic() - start)
+        persist_writes.inc(outcome="ok")
+        logger.debug("Appended %s message(s) to session '%s' in DynamoDB", len(pending.messages), session_id)
+        with self._cond:
+            self._in_flight.pop(key, None)
+            self._cond.notify_all()
+
+    def _retry(self, key: SessionKey, pending: _Pending, error: Exception) -> None:
+        pending.attempts += 1
+        with self._cond:
+            self._in_flight.pop(key, None)
+            self._cond.notify_all()
+            if key in self._discarded:
+                logger.debug("Not retrying the write for deleted session '%s'", key[1])
+                return
+            if pending.attempts >= self.max_attempts:
+                persist_writes.inc(outcome="dropped")
+                persist_dropped.inc(len(pending.messages))
+                logger.error(
+                    "Giving up on %s message(s) for session '%s' after %s attempts: %s",
+                    len(pending.messages), key[1], pending.attempts, error,
+                )
+                return
+            persist_writes.inc(outcome="retry")
+            delay = min(self.backoff_cap_s, self.backoff_base_s * (2 ** (pending.attempts - 1)))
+            logger.warning("DynamoDB append for session '%s' failed (%s); retrying in %.1fs", key[1], error, delay)
+            # Keep the session's order: the failed messages go before anything queued since
+            newer = self._pending.pop(key, None)
+            if newer is not None:
+                pending.messages.extend(newer.messages)
+                pending.chat_name = newer.chat_name
+                pending.summary = newer.summary or pending.summary
+            pending.retry_at = time.monotonic() + delay
+            self._pending[key] = pending
+            self._pending.move_to_end(key, last=False)
+
+
+_writer: Optional[WriteBehindWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_chat_writer() -> WriteBehindWriter:
+    """Process-wide write-behind writer for the chat session table."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                table = make_resource("dynamodb").Table(os.getenv("CHAT_TABLE_NAME", "ChatSession"))
+                _writer = WriteBehindWriter(
+                    table,
+                    flush_interval_s=float(os.getenv("CHAT_PERSIST_FLUSH_INTERVAL_S", "0.5")),
+                    max_batch=int(os.getenv("CHAT_PERSIST_MAX_BATCH", "25")),
+                    max_attempts=int(os.getenv("CHAT_PERSIST_MAX_ATTEMPTS", "8")),
+                    codec=configured_codec(),
+                )
+    return _writer
+
+
+@contextlib.asynccontextmanager
+async def flush_on_shutdown():
+    """Lifespan task: write out queued chat messages before the server exits."""
+    yield
+    if _writer is not None:
+        await asyncio.to_thread(_writer.close)
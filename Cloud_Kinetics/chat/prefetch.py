@@ -0,0 +1,184 @@
+"""Speculative retrieval while the user is still typing.
+
+The question input sends its text (debounced in the browser) to
+``State.prefetch_question``, which calls ``Prefetcher.prefetch``. That starts
+the retrieval stage of answering (routing signals, passages and the knowledge
+base text) on a small thread pool and keeps the result for the session. On
+submit, ``take`` hands it to ``process_question``:
+
+* ``hit`` / ``joined`` - the submitted question has the same terms as the last
+  prefetch, so its finished (or still running) retrieval is used as is;
+* ``refined`` - the terms changed; the question-independent knowledge base is
+  reused and the rest is recomputed (against an already warm range cache);
+* ``miss`` / ``stale`` / ``changed`` - nothing usable: no prefetch, the index
+  snapshot changed since, or the terms changed and nothing was reusable.
+
+Each session has at most one prefetch; a newer one cancels the older. Starts
+are also limited to ``PREFETCH_MAX_PER_MIN`` per session, so fast typists and
+scripted clients can't turn keystrokes into retrieval load. Results expire
+after ``PREFETCH_TTL_S``. All of this is off unless ``RETRIEVAL_PREFETCH=1``.
+
+Outcomes are counted in ``retrieval_prefetch_total``. ``retrieval_prefetch_saved_seconds``
+is the retrieval time that submits didn't have to wait for.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from Cloud_Kinetics import metrics
+from Cloud_Kinetics.index.text import tokenize
+
+logger = logging.getLogger(__name__)
+
+prefetch_total = metrics.counter("retrieval_prefetch_total", "Speculative retrievals by outcome")
+prefetch_saved = metrics.histogram("retrieval_prefetch_saved_seconds", "Retrieval time taken off the submit path")
+
+DEBOUNCE_MS = int(os.getenv("PREFETCH_DEBOUNCE_MS", "350"))
+MIN_CHARS = int(os.getenv("PREFETCH_MIN_CHARS", "12"))
+MAX_PER_MIN = int(os.getenv("PREFETCH_MAX_PER_MIN", "20"))
+TTL_S = float(os.getenv("PREFETCH_TTL_S", "60"))
+WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+MAX_SESSIONS = 10000
+
+Terms = Tuple[str, ...]
+
+
+def prefetch_enabled() -> bool:
+    return os.getenv("RETRIEVAL_PREFETCH", "0") == "1"
+
+
+def query_terms(text: str) -> Terms:
+    """What decides whether two versions of a question retrieve the same thing."""
+    return tuple(sorted(set(tokenize(text))))
+
+
+class _Entry:
+    def __init__(self, terms: Terms, task: "asyncio.Future[Dict[str, Any]]", snapshot_id: Any):
+        self.terms = terms
+        self.task = task
+        self.snapshot_id = snapshot_id
+        self.created = time.monotonic()
+
+
+class Prefetcher:
+    """Per-session speculative retrieval; all methods run on the event loop.
+
+    ``retrieve(question)`` is the blocking retrieval function. Its result must
+    be a dict; a ``knowledge_base`` key marks the part that doesn't depend on
+    the question. ``snapshot_id()`` identifies the index the result came from.
+    """
+
+    def __init__(
+        self,
+        retrieve: Callable[[str], Dict[str, Any]],
+        snapshot_id: Callable[[], Any],
+        max_per_min: int = MAX_PER_MIN,
+        ttl_s: float = TTL_S,
+        workers: int = WORKERS,
+    ):
+        self.retrieve = retrieve
+        self.snapshot_id = snapshot_id
+        self.max_per_min = max_per_min
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._starts: "OrderedDict[str, Deque[float]]" = OrderedDict()
+        # Own pool: queued prefetches can really be cancelled and never crowd out the default executor
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="retrieval-prefetch")
+
+    def _allow(self, session: str) -> bool:
+        now = time.monotonic()
+        starts = self._starts.setdefault(session, deque())
+        self._starts.move_to_end(session)
+        while starts and now - starts[0] > 60.0:
+            starts.popleft()
+        if len(starts) >= self.max_per_min:
+            return False
+        starts.append(now)
+        if len(self._starts) > MAX_SESSIONS:
+            self._starts.popitem(last=False)
+        return True
+
+    def _timed(self, text: str) -> Dict[str, Any]:
+        start = time.monotonic()
+        result = self.retrieve(text)
+        result["retrieval_s"] = time.monotonic() - start
+        return result
+
+    def _drop(self, session: str, outcome: str) -> None:
+        entry = self._entries.pop(session, None)
+        if entry is not None and not entry.task.done():
+            entry.task.cancel()
+            prefetch_total.inc(outcome=outcome)
+
+    async def prefetch(self, session: str, text: str) -> bool:
+        """Start retrieval for a partial question; False if skipped."""
+        text = text.strip()
+        terms = query_terms(text)
+        if len(text) < MIN_CHARS or not terms:
+            return False
+        entry = self._entries.get(session)
+        if entry is not None and entry.terms == terms and time.monotonic() - entry.created < self.ttl_s:
+            return False  # same terms as the prefetch already running or done
+        if not self._allow(session):
+            prefetch_total.inc(outcome="rate_limited")
+            return False
+        self._drop(session, "superseded")
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(self._pool, self._timed, text)
+        # A prefetch nobody takes must not log "exception was never retrieved"
+        task.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._entries[session] = _Entry(terms, task, self.snapshot_id())
+        if len(self._entries) > MAX_SESSIONS:
+            _, oldest = self._entries.popitem(last=False)
+            oldest.task.cancel()
+        prefetch_total.inc(outcome="started")
+        return True
+
+    async def take(self, session: str, question: str) -> Optional[Dict[str, Any]]:
+        """The session's prefetched retrieval as far as it applies to ``question``, or None."""
+        submitted = time.monotonic()
+        entry = self._entries.pop(session, None)
+        if entry is None:
+            prefetch_total.inc(outcome="miss")
+            return None
+        if time.monotonic() - entry.created > self.ttl_s or entry.snapshot_id != self.snapshot_id():
+            entry.task.cancel()
+            prefetch_total.inc(outcome="stale")
+            return None
+        if entry.terms == query_terms(question):
+            outcome = "hit" if entry.task.done() else "joined"
+            try:
+                result = await asyncio.shield(entry.task)
+            except Exception as e:
+                logger.warning("Prefetched retrieval failed; retrieving again: %s", e)
+                prefetch_total.inc(outcome="failed")
+                return None
+            prefetch_total.inc(outcome=outcome)
+            # A joined prefetch only saved the part that ran before submit
+            prefetch_saved.observe(min(result["retrieval_s"], submitted - entry.created))
+            return result
+        if not entry.task.done():
+            entry.task.cancel()
+            prefetch_total.inc(outcome="cancelled")
+            return None
+        if entry.task.cancelled() or entry.task.exception() is not None:
+            prefetch_total.inc(outcome="failed")
+            return None
+        result = entry.task.result()
+        if "knowledge_base" not in result:
+            prefetch_total.inc(outcome="changed")
+            return None
+        prefetch_total.inc(outcome="refined")
+        return {"knowledge_base": result["knowledge_base"]}
+
+    def forget(self, session: str) -> None:
+        self._drop(session, "cancelled")
+
+    def clear(self) -> None:
+        """Drop every prefetch, e.g. after the knowledge base changed."""
+        for session in list(self._entries):
+            self._drop(session, "cancelled")
@@ -0,0 +1,156 @@
+"""Per-question model routing.
+
+Chooses how to answer each question from three signals: how long/involved
+the question is, how confidently BM25 retrieval over the index snapshot
+matched it, and how much of the latency budget is left after the expected
+queue wait. The outcome is one of:
+
+* ``direct`` - a single retrieved passage clearly answers a short lookup, so
+  it is returned without calling a model;
+* ``fast`` - a cheaper, quicker model with a small token limit;
+* ``strong`` - the full model for complex or poorly grounded questions.
+
+The token limit is only lowered when the budget can't fit it at the model's
+generation speed, measured from recent answers (``record_generation``). Until a
+model has answered, its limit is left alone.
+
+Every decision is logged with its reason and counted on ``/metrics``.
+"""
+import logging
+import os
+import re
+import threading
+from math import log
+from typing import Any, Dict, Optional
+
+from Cloud_Kinetics import metrics
+from Cloud_Kinetics.index.text import tokenize
+
+logger = logging.getLogger(__name__)
+
+routes_total = metrics.counter("model_routes_total", "Routing decisions by route and model")
+
+FAST_MODEL = os.getenv("ROUTER_FAST_MODEL", "anthropic.claude-instant-v1")
+STRONG_MODEL = os.getenv("ROUTER_STRONG_MODEL", "anthropic.claude-v2")
+FAST_MAX_TOKENS = int(os.getenv("ROUTER_FAST_MAX_TOKENS", "500"))
+STRONG_MAX_TOKENS = int(os.getenv("ROUTER_STRONG_MAX_TOKENS", "2000"))
+# Fixed generation speed for the budget cap; unset means measure it per model
+TOKENS_PER_SECOND = float(os.getenv("ROUTER_TOKENS_PER_SECOND", "0")) or None
+# Answers shorter than this say more about request overhead than generation speed
+MIN_MEASURED_TOKENS = 100
+CHARS_PER_TOKEN = 4
+# Below this much remaining budget the strong model isn't worth trying
+STRONG_MIN_BUDGET_S = float(os.getenv("ROUTER_STRONG_MIN_BUDGET_S", "8"))
+BM25_K1 = 1.2
+COMPLEX_WORDS = int(os.getenv("ROUTER_COMPLEX_WORDS", "25"))
+# Thresholds on BM25 confidence: the top score as a fraction of the best possible score
+CONFIDENT_SCORE = float(os.getenv("ROUTER_CONFIDENT_SCORE", "0.35"))
+DIRECT_SCORE = float(os.getenv("ROUTER_DIRECT_SCORE", "0.5"))
+DIRECT_MAX_WORDS = int(os.getenv("ROUTER_DIRECT_MAX_WORDS", "12"))
+
+_COMPLEX_CUES = re.compile(
+    r"\b(why|explain|compare|difference|differences|versus|vs|design|trade-?offs?|step by step|troubleshoot|plan)\b"
+)
+
+
+def routing_enabled() -> bool:
+    return os.getenv("ROUTER_ENABLED", "1") == "1"
+
+
+# Smoothed tokens/second per model, from completed answers
+_throughput: Dict[str, float] = {}
+_throughput_lock = threading.Lock()
+
+
+def record_generation(model_id: str, answer_chars: int, seconds: float) -> None:
+    """Fold one answer's generation speed into the model's estimate."""
+    tokens = answer_chars / CHARS_PER_TOKEN
+    if tokens < MIN_MEASURED_TOKENS or seconds <= 0:
+        return
+    with _throughput_lock:
+        previous = _throughput.get(model_id)
+        rate = tokens / seconds
+        _throughput[model_id] = rate if previous is None else 0.8 * previous + 0.2 * rate
+
+
+def tokens_per_second(model_id: str) -> Optional[float]:
+    return TOKENS_PER_SECOND or _throughput.get(model_id)
+
+
+class Route:
+    def __init__(self, kind: str, model_id: Optional[str], max_tokens: int, reason: str, chunk_id: int = -1):
+        self.kind = kind
+        self.model_id = model_id
+        self.max_tokens = max_tokens
+        self.reason = reason
+        self.chunk_id = chunk_id
+
+    def __repr__(self) -> str:
+        return f"Route({self.kind}, {self.model_id}, max_tokens={self.max_tokens}, {self.reason})"
+
+
+def retrieval_signals(snapshot, question: str) -> Optional[Dict[str, Any]]:
+    """Top BM25 scores and query-term coverage of the best chunk, if there is a snapshot."""
+    if snapshot is None or not snapshot.docs:
+        return None
+    tokens = tokenize(question)
+    hits = snapshot.bm25(tokens, 2, k1=BM25_K1)
+    n = snapshot.n_chunks
+    # Best score BM25 could give these terms (tf saturated), so confidence is comparable across corpora
+    ceiling, known = 0.0, set()
+    for term in set(tokens):
+        df = len(snapshot.postings(term)[0])
+        if df:
+            known.add(term)
+            ceiling += log(1 + (n - df + 0.5) / (df + 0.5)) * (BM25_K1 + 1)
+    if not hits or not known:
+        return {"top": 0.0, "second": 0.0, "confidence": 0.0, "coverage": 0.0, "chunk_id": -1}
+    top, chunk_id = hits[0]
+    second = hits[1][0] if len(hits) > 1 else 0.0
+    chunk_terms = set(tokenize(snapshot.chunk_text(chunk_id)))
+    return {
+        "top": top,
+        "second": second,
+        "confidence": top / ceiling if ceiling else 0.0,
+        "coverage": len(known & chunk_terms) / len(known),
+        "chunk_id": chunk_id,
+    }
+
+
+def route(question: str, signals: Optional[Dict[str, Any]], budget_s: float, follow_up: bool = False) -> Route:
+    """Pick direct/fast/strong for a question given retrieval signals and the remaining latency budget.
+
+    Follow-ups are never answered directly: a passage can't resolve references
+    to earlier turns.
+    """
+    words = len(question.split())
+    complex_question = words > COMPLEX_WORDS or bool(_COMPLEX_CUES.search(question.lower()))
+    confident = signals is not None and signals["confidence"] >= CONFIDENT_SCORE and signals["coverage"] >= 0.6
+
+    if (
+        signals is not None
+        and not follow_up
+        and not complex_question
+        and words <= DIRECT_MAX_WORDS
+        and signals["coverage"] >= 1.0
+        and signals["confidence"] >= DIRECT_SCORE
+        and signals["top"] >= 1.3 * signals["second"]
+    ):
+        decision = Route("direct", None, 0, f"passage covers all terms (confidence={signals['confidence']:.2f})", signals["chunk_id"])
+    elif budget_s < STRONG_MIN_BUDGET_S:
+        decision = Route("fast", FAST_MODEL, FAST_MAX_TOKENS, f"latency budget {budget_s:.1f}s")
+    elif complex_question:
+        decision = Route("strong", STRONG_MODEL, STRONG_MAX_TOKENS, f"complex question ({words} words)")
+    elif not confident:
+        decision = Route("strong", STRONG_MODEL, STRONG_MAX_TOKENS, "weak retrieval match" if signals else "no index snapshot")
+    else:
+        decision = Route("fast", FAST_MODEL, FAST_MAX_TOKENS, f"confident retrieval (confidence={signals['confidence']:.2f})")
+
+    rate = tokens_per_second(decision.model_id) if decision.model_id else None
+    if rate and budget_s * rate < decision.max_tokens:
+        # Don't ask for more tokens than can be generated inside the budget
+        decision.max_tokens = max(100, int(budget_s * rate))
+        decision.reason += f", max_tokens capped at {rate:.0f} tokens/s"
+    routes_total.inc(route=decision.kind, model=decision.model_id or "none")
+    logger.info("Routed question (%s words) to %s: %s", words, decision.kind, decision.reason)
+    return decision
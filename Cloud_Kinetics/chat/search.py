@@ -0,0 +1,315 @@
+"""Full-text search over a user's stored questions and answers.
+
+A per-user inverted index maps terms to the messages (session id + position)
+that contain them and ranks hits with BM25. It is updated incrementally as
+messages are persisted, so searching never loads whole chats. With
+``CHAT_SEARCH_TABLE`` set the index lives in DynamoDB; otherwise it is kept in
+process memory and rebuilt from the history loaded by ``load_session``.
+
+DynamoDB layout (partition key ``user_id``, sort key ``sk``)::
+
+    t#<term>#<session_id>#<position>   posting: tf, dl
+    m#<session_id>#<position>          message: terms, dl, snippet
+    stats                              messages, tokens (for BM25 averages)
+"""
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from math import log
+from typing import Any, Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from Cloud_Kinetics.index.text import tokenize
+
+logger = logging.getLogger(__name__)
+
+Message = Dict[str, str]
+Hit = Dict[str, Any]
+
+MAX_QUERY_TERMS = 8
+# Postings read per query term; very common terms add little to the ranking
+MAX_POSTINGS_PER_TERM = int(os.getenv("CHAT_SEARCH_MAX_POSTINGS", "2000"))
+SNIPPET_CHARS = 160
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def message_terms(message: Message) -> Counter:
+    # Questions are short and carry the intent, so their terms count double
+    counts = Counter(tokenize(message.get("answer", "")))
+    for term in tokenize(message.get("question", "")):
+        counts[term] += 2
+    return counts
+
+
+def snippet(message: Message) -> str:
+    text = " ".join(message.get("question", "").split())
+    return text if len(text) <= SNIPPET_CHARS else text[:SNIPPET_CHARS - 3].rstrip() + "..."
+
+
+def _bm25(tf: int, dl: int, df: int, n: int, avgdl: float) -> float:
+    idf = log(1 + (n - df + 0.5) / (df + 0.5))
+    return idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / max(avgdl, 1.0)))
+
+
+def _query_terms(query: str) -> List[str]:
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+class InMemorySearchIndex:
+    """Per-process index, used when no search table is configured."""
+
+    rebuild_on_load = True
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, Dict[Tuple[str, int], int]]] = defaultdict(lambda: defaultdict(dict))
+        self._docs: Dict[str, Dict[Tuple[str, int], Tuple[int, str]]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def add(self, user_id: str, session_id: str, position: int, message: Message) -> None:
+        counts = message_terms(message)
+        if not counts:
+            return
+        key = (session_id, position)
+        with self._lock:
+            self._remove(user_id, key)
+            for term, tf in counts.items():
+                self._postings[user_id][term][key] = tf
+            self._docs[user_id][key] = (sum(counts.values()), snippet(message))
+
+    def _remove(self, user_id: str, key: Tuple[str, int]) -> None:
+        if key not in self._docs[user_id]:
+            return
+        del self._docs[user_id][key]
+        for postings in self._postings[user_id].values():
+            postings.pop(key, None)
+
+    def replace_session(self, user_id: str, session_id: str, messages: List[Message]) -> None:
+        self.delete_session(user_id, session_id)
+        for position, message in enumerate(messages):
+            self.add(user_id, session_id, position, message)
+
+    def delete_session(self, user_id: str, session_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._docs[user_id] if k[0] == session_id]:
+                self._remove(user_id, key)
+
+    def delete_user(self, user_id: str) -> None:
+        with self._lock:
+            self._postings.pop(user_id, None)
+            self._docs.pop(user_id, None)
+
+    def search(self, user_id: str, query: str, k: int = 10) -> List[Hit]:
+        with self._lock:
+            docs = self._docs.get(user_id, {})
+            n = len(docs)
+            if not n:
+                return []
+            avgdl = sum(dl for dl, _ in docs.values()) / n
+            scores: Dict[Tuple[str, int], float] = defaultdict(float)
+            for term in _query_terms(query):
+                postings = self._postings[user_id].get(term, {})
+                for key, tf in postings.items():
+                    scores[key] += _bm25(tf, docs[key][0], len(postings), n, avgdl)
+            best = sorted(scores.items(), key=lambda kv: -kv[1])[:k]
+            return [
+                {"session_id": sid, "position": pos, "score": score, "snippet": docs[(sid, pos)][1]}
+                for (sid, pos), score in best
+            ]
+
+
+class DynamoSearchIndex:
+    """Index stored in a DynamoDB table shared by every backend task."""
+
+    rebuild_on_load = False
+
+    def __init__(self, table):
+        self.table = table
+
+    @staticmethod
+    def _message_sk(session_id: str, position: int) -> str:
+        return f"m#{session_id}#{position:06d}"
+
+    @staticmethod
+    def _posting_sk(term: str, session_id: str, position: int) -> str:
+        return f"t#{term}#{session_id}#{position:06d}"
+
+    def add(self, user_id: str, session_id: str, position: int, message: Message) -> None:
+        counts = message_terms(message)
+        if not counts:
+            return
+        dl = sum(counts.values())
+        try:
+            # Claiming the message item first makes re-indexing (backfills, retries) a no-op
+            self.table.put_item(
+                Item={
+                    "user_id": user_id,
+                    "sk": self._message_sk(session_id, position),
+                    "terms": sorted(counts),
+                    "dl": dl,
+                    "snippet": snippet(message),
+                },
+                ConditionExpression="attribute_not_exists(sk)",
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return
+            raise
+        with self.table.batch_writer() as batch:
+            for term, tf in counts.items():
+                batch.put_item(Item={"user_id": user_id, "sk": self._posting_sk(term, session_id, position), "tf": tf, "dl": dl})
+        self._add_stats(user_id, 1, dl)
+
+    def _add_stats(self, user_id: str, messages: int, tokens: int) -> None:
+        self.table.update_item(
+            Key={"user_id": user_id, "sk": "stats"},
+            UpdateExpression="ADD messages :m, tokens :t",
+            ExpressionAttributeValues={":m": messages, ":t": tokens},
+        )
+
+    def _query_all(self, user_id: str, prefix: Optional[str], limit: Optional[int] = None, **kwargs) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        request: Dict[str, Any] = {
+            "KeyConditionExpression": "user_id = :uid",
+            "ExpressionAttributeValues": {":uid": user_id},
+            **kwargs,
+        }
+        if prefix:
+            request["KeyConditionExpression"] += " AND begins_with(sk, :prefix)"
+            request["ExpressionAttributeValues"][":prefix"] = prefix
+        while True:
+            response = self.table.query(**request)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response or (limit is not None and len(items) >= limit):
+                return items[:limit] if limit is not None else items
+            request["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def replace_session(self, user_id: str, session_id: str, messages: List[Message]) -> None:
+        self.delete_session(user_id, session_id)
+        for position, message in enumerate(messages):
+            self.add(user_id, session_id, position, message)
+
+    def delete_session(self, user_id: str, session_id: str) -> None:
+        removed, tokens = 0, 0
+        with self.table.batch_writer() as batch:
+            for item in self._query_all(user_id, f"m#{session_id}#"):
+                position = int(item["sk"].rsplit("#", 1)[1])
+                for term in item.get("terms", []):
+                    batch.delete_item(Key={"user_id": user_id, "sk": self._posting_sk(term, session_id, position)})
+                batch.delete_item(Key={"user_id": user_id, "sk": item["sk"]})
+                removed += 1
+                tokens += int(item.get("dl", 0))
+        if removed:
+            self._add_stats(user_id, -removed, -tokens)
+
+    def delete_user(self, user_id: str) -> None:
+        with self.table.batch_writer() as batch:
+            for item in self._query_all(user_id, None, ProjectionExpression="sk"):
+                batch.delete_item(Key={"user_id": user_id, "sk": item["sk"]})
+
+    def search(self, user_id: str, query: str, k: int = 10) -> List[Hit]:
+        stats = self.table.get_item(Key={"user_id": user_id, "sk": "stats"}).get("Item") or {}
+        n = int(stats.get("messages", 0))
+        if n <= 0:
+            return []
+        avgdl = int(stats.get("tokens", 0)) / n
+        scores: Dict[Tuple[str, int], float] = defaultdict(float)
+        for term in _query_terms(query):
+            postings = self._query_all(
+                user_id, f"t#{term}#", limit=MAX_POSTINGS_PER_TERM, ProjectionExpression="sk, tf, dl"
+            )
+            for item in postings:
+                _, _, rest = item["sk"].split("#", 2)
+                session_id, position = rest.rsplit("#", 1)
+                scores[(session_id, int(position))] += _bm25(int(item["tf"]), int(item["dl"]), len(postings), n, avgdl)
+        hits = []
+        for (session_id, position), score in sorted(scores.items(), key=lambda kv: -kv[1])[:k]:
+            item = self.table.get_item(Key={"user_id": user_id, "sk": self._message_sk(session_id, position)}).get("Item") or {}
+            hits.append({"session_id": session_id, "position": position, "score": score, "snippet": item.get("snippet", "")})
+        return hits
+
+
+_index: Optional[object] = None
+_index_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-search")
+
+
+def get_chat_search():
+    """Process-wide search index; DynamoDB when CHAT_SEARCH_TABLE is set."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                table_name = os.getenv("CHAT_SEARCH_TABLE")
+                if table_name:
+                    from Cloud_Kinetics.aws import make_resource
+
+                    _index = DynamoSearchIndex(make_resource('dynamodb').Table(table_name))
+                    logger.info("Using DynamoDB chat search index '%s'", table_name)
+                else:
+                    _index = InMemorySearchIndex()
+    return _index
+
+
+def index_message_later(user_id: str, session_id: str, position: int, message: Message) -> None:
+    """Index a persisted message off the event loop; failures are logged, not raised."""
+
+    def run():
+        try:
+            get_chat_search().add(user_id, session_id, position, message)
+        except Exception as e:
+            logger.error("Failed to index message %s#%s for search: %s", session_id, position, e)
+
+    _executor.submit(run)
+
+
+def index_session_later(user_id: str, session_id: str, messages: List[Message]) -> None:
+    """(Re)index a whole session in the background, e.g. after rehydrating it from the archive."""
+
+    def run():
+        try:
+            search_index = get_chat_search()
+            for position, message in enumerate(messages):
+                search_index.add(user_id, session_id, position, message)
+        except Exception as e:
+            logger.error("Failed to index session %s for search: %s", session_id, e)
+
+    _executor.submit(run)
+
+
+def forget_session_later(user_id: str, session_id: str) -> None:
+    def run():
+        try:
+            get_chat_search().delete_session(user_id, session_id)
+        except Exception as e:
+            logger.error("Failed to remove session %s from search: %s", session_id, e)
+
+    _executor.submit(run)
+
+
+def backfill(chat_table, search_index, user_id: Optional[str] = None) -> Dict[str, int]:
+    """Index every stored session (of one user, or the whole table)."""
+    from Cloud_Kinetics.chat.codec import decode_messages
+
+    stats = {"sessions": 0, "messages": 0, "archived_skipped": 0}
+    kwargs: Dict[str, Any] = {}
+    if user_id:
+        kwargs = {"KeyConditionExpression": "user_id = :uid", "ExpressionAttributeValues": {":uid": user_id}}
+    while True:
+        response = chat_table.query(**kwargs) if user_id else chat_table.scan(**kwargs)
+        for item in response.get("Items", []):
+            if "archive" in item:
+                # Indexed when the chat is rehydrated
+                stats["archived_skipped"] += 1
+                continue
+            messages = decode_messages(item)
+            for position, message in enumerate(messages):
+                search_index.add(item["user_id"], item["session_id"], position, message)
+            stats["sessions"] += 1
+            stats["messages"] += len(messages)
+        if "LastEvaluatedKey" not in response:
+            return stats
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
@@ -1,28 +1,61 @@
+import asyncio
+import hashlib
 import os
+import time
 import reflex as rx
 import boto3
 import logging
 import json
+import numpy as np
 from datetime import datetime
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
 from dotenv import load_dotenv
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from Cloud_Kinetics.aws import aws_region, make_client, make_resource
+from Cloud_Kinetics.chat.archive import is_archived, rehydrate_session
+from Cloud_Kinetics.chat.bedrock import CircuitOpenError, QueueFullError, get_model_limiter, invoke_guarded
+from Cloud_Kinetics.chat.breaker import get_breaker
+from Cloud_Kinetics.chat.coalesce import Flight, get_question_flights, question_key
+from Cloud_Kinetics.chat.codec import decode_messages
+from Cloud_Kinetics.chat.history import get_history_store
+from Cloud_Kinetics.chat.identity import IdentityError, new_browser_id, resolve_user_id
+from Cloud_Kinetics.chat.memory import (
+    CONTEXT_TURNS,
+    MAX_SUMMARY_CHARS,
+    fold_extractive,
+    format_context,
+    summary_mode,
+    summary_prompt,
+    turns_to_fold,
+)
+from Cloud_Kinetics.chat.persistence import get_chat_writer
+from Cloud_Kinetics.chat.prefetch import Prefetcher, prefetch_enabled
+from Cloud_Kinetics.chat.routing import Route, record_generation, retrieval_signals, route, routing_enabled
+from Cloud_Kinetics.chat.search import forget_session_later, get_chat_search, index_message_later, index_session_later
 from Cloud_Kinetics.chat.upload_to_s3 import upload_to_s3
+from Cloud_Kinetics.chat.uploads import hash_upload, is_corpus_key, store_upload
+from Cloud_Kinetics.index.ann import IVFInt8Index
+from Cloud_Kinetics.index.embed import DEFAULT_DIM, LazyEmbeddings, hash_embed, hash_embed_many
+from Cloud_Kinetics.index.facets import FacetIndex, build_facet_index
+from Cloud_Kinetics.index.minhash import dedupe_documents
+from Cloud_Kinetics.index.snapshot import Snapshot, current_snapshot
+from Cloud_Kinetics.index.text import chunk_text, tokenize as _tokenize
+from Cloud_Kinetics.logging_config import configure_logging, sampled
+from Cloud_Kinetics.profiling import profiled
 from fastapi import UploadFile
-import re
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+configure_logging()
 logger = logging.getLogger(__name__)
 
 logger.debug("Starting state.py execution")
 if not load_dotenv():
     logger.error("Failed to load .env file - ensure it exists in the project root")
 else:
-    logger.debug(f"Environment variables loaded: AWS_REGION={os.getenv('AWS_DEFAULT_REGION')}")
+    logger.debug("Environment variables loaded: AWS_REGION=%s", os.getenv('AWS_DEFAULT_REGION'))
 
 """
 Initialize boto3 using environment variables when available, and fall back to
@@ -34,7 +67,6 @@ containers that can't reach AWS immediately.
 aws_access_key = os.getenv('AWS_ACCESS_KEY_ID') or 'test'
 aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY') or 'test'
 aws_session_token = os.getenv('AWS_SESSION_TOKEN') or None
-aws_region = os.getenv('AWS_DEFAULT_REGION', 'ap-northeast-1')
 aws_endpoint = os.getenv('AWS_ENDPOINT_URL')  # e.g. http://host.docker.internal:4566
 
 # Configure a default session
@@ -55,31 +87,246 @@ else:
 chat_table_name = os.getenv('CHAT_TABLE_NAME', 'ChatSession')
 chat_table = dynamodb.Table(chat_table_name)
 
-# Helper factories so all clients/resources consistently use LocalStack endpoint when set
-def make_client(service_name: str, region: str = None, **kwargs):
-    region = region or aws_region
-    endpoint = os.getenv('AWS_ENDPOINT_URL')
-    if endpoint:
-        return boto3.client(service_name, region_name=region, endpoint_url=endpoint, **kwargs)
-    return boto3.client(service_name, region_name=region, **kwargs)
-
-def make_resource(resource_name: str, region: str = None, **kwargs):
-    region = region or aws_region
-    endpoint = os.getenv('AWS_ENDPOINT_URL')
-    if endpoint:
-        return boto3.resource(resource_name, region_name=region, endpoint_url=endpoint, **kwargs)
-    return boto3.resource(resource_name, region_name=region, **kwargs)
-
-
 # Simple in-memory cache of S3 documents to avoid re-reading on every question.
 # Key: bucket/key -> content string
 _s3_doc_cache: Dict[str, str] = {}
 
-def _tokenize(text: str) -> List[str]:
-    # Lowercase, remove non-word characters, split on whitespace
-    tokens = re.findall(r"\w+", text.lower())
-    # Remove very short tokens
-    return [t for t in tokens if len(t) > 2]
+# Dense chunk index over the cached corpus, used instead of scoring every full
+# document when RETRIEVAL_ANN=1. Rebuilt whenever the set of cached keys changes.
+_ann_state: Dict[str, Any] = {"keys": None, "index": None, "chunks": []}
+
+def _ann_enabled() -> bool:
+    return os.getenv("RETRIEVAL_ANN", "0") == "1"
+
+def _chunk_text(chunk: Tuple[str, int, int]) -> str:
+    cache_key, start, end = chunk
+    return _s3_doc_cache.get(cache_key, "")[start:end]
+
+def _get_ann_index(cache_keys: List[str]):
+    keys = tuple(sorted(cache_keys))
+    if _ann_state["keys"] == keys:
+        return _ann_state["index"], _ann_state["chunks"]
+    chunks = []
+    for cache_key in keys:
+        for start, end in chunk_text(_s3_doc_cache.get(cache_key, "")):
+            chunks.append((cache_key, start, end))
+    index = None
+    if chunks:
+        index = IVFInt8Index(
+            DEFAULT_DIM,
+            nlist=int(os.getenv("ANN_NLIST", "256")),
+            nprobe=int(os.getenv("ANN_NPROBE", "16")),
+            rerank=int(os.getenv("ANN_RERANK", "64")),
+        )
+        index.build(hash_embed_many([_chunk_text(c) for c in chunks]))
+        logger.info("Built ANN index over %s chunks (%s bytes)", len(chunks), index.memory_bytes())
+    _ann_state.update(keys=keys, index=index, chunks=chunks)
+    return index, chunks
+
+def _dense_search(
+    question: str, cache_keys: List[str], k: int = 3, only: Optional[Set[str]] = None
+) -> List[Tuple[float, Tuple[str, int, int]]]:
+    """Best chunks by embedding similarity; restricted to the ``only`` documents (facet matches) if given."""
+    index, chunks = _get_ann_index(cache_keys)
+    if index is None:
+        return []
+    query = hash_embed(question)
+    if only is not None:
+        # Facet matches are few: score their chunks exactly instead of hoping the ANN probe reaches them
+        chunks = [c for c in chunks if c[0] in only]
+        if not chunks:
+            return []
+        scores = hash_embed_many([_chunk_text(c) for c in chunks]) @ query
+        top = np.argsort(-scores)[:k]
+        return [(float(scores[i]), chunks[int(i)]) for i in top]
+    scores, ids = index.search(query, k, vectors=LazyEmbeddings(lambda i: _chunk_text(chunks[i])))
+    return [(float(s), chunks[int(i)]) for s, i in zip(scores, ids)]
+
+# Near-duplicate collapse of the cached corpus for local retrieval, recomputed
+# when the set of cached keys changes (like the ANN index above).
+_dedupe_state: Dict[str, Any] = {"keys": None, "kept": []}
+
+def _distinct_documents(bucket_name: str, keys: List[str], modified: Dict[str, Any]) -> List[str]:
+    cache_keys = tuple(sorted(f"{bucket_name}/{k}" for k in keys))
+    if _dedupe_state["keys"] != cache_keys:
+        kept, aliases = dedupe_documents(
+            [(k, _s3_doc_cache.get(f"{bucket_name}/{k}", "")) for k in keys], modified
+        )
+        if aliases:
+            logger.info("Collapsed %s near-duplicate documents for local retrieval", sum(len(v) for v in aliases.values()))
+        _dedupe_state.update(keys=cache_keys, kept=[k for k, _ in kept])
+    return _dedupe_state["kept"]
+
+# Date/path facets of the distinct cached documents, so filters resolve by lookup
+# instead of scanning every text (rebuilt when the document set changes).
+_facet_state: Dict[str, Any] = {"keys": None, "index": None}
+
+def _get_facet_index(bucket_name: str, keys: List[str]) -> FacetIndex:
+    cache_keys = tuple(f"{bucket_name}/{k}" for k in keys)
+    if _facet_state["keys"] != cache_keys:
+        index = build_facet_index((k, _s3_doc_cache.get(c, "")) for k, c in zip(keys, cache_keys))
+        logger.info("Built facet index over %s documents: %s", len(keys), index.stats())
+        _facet_state.update(keys=cache_keys, index=index)
+    return _facet_state["index"]
+
+def _list_corpus(s3_client, bucket_name: str, prefix: str) -> Tuple[List[str], Dict[str, Any]]:
+    """Knowledge-base keys (and their LastModified) for local retrieval."""
+    # Build candidate key list by trying prefix variants and then a filtered full list
+    candidate_keys: List[str] = []
+    modified: Dict[str, Any] = {}
+    tried_prefixes = [p for p in ([prefix, prefix.rstrip('/') + '/'] if prefix else ['']) if p]
+    for p in tried_prefixes:
+        try:
+            resp = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=p)
+        except Exception as e:
+            logger.debug("list_objects_v2 failed for prefix '%s': %s", p, e)
+            continue
+        for obj in resp.get('Contents', []):
+            k = obj.get('Key')
+            if k and k not in candidate_keys:
+                candidate_keys.append(k)
+                modified[k] = obj.get('LastModified')
+
+    if not candidate_keys:
+        # Fallback: list all and include keys that contain the prefix as substring
+        resp = s3_client.list_objects_v2(Bucket=bucket_name)
+        for obj in resp.get('Contents', []):
+            k = obj.get('Key')
+            if k and (not prefix or prefix in k) and k not in candidate_keys:
+                candidate_keys.append(k)
+                modified[k] = obj.get('LastModified')
+    return [k for k in candidate_keys if is_corpus_key(k)], modified
+
+def _cache_documents(s3_client, bucket_name: str, keys: List[str]) -> None:
+    for key in keys:
+        cache_key = f"{bucket_name}/{key}"
+        if cache_key not in _s3_doc_cache:
+            try:
+                file_response = s3_client.get_object(Bucket=bucket_name, Key=key)
+                content = file_response['Body'].read().decode('utf-8', errors='replace')
+                _s3_doc_cache[cache_key] = content
+            except Exception as e:
+                logger.error("Error fetching %s from S3 for local retrieval: %s", key, e)
+                _s3_doc_cache[cache_key] = ""
+
+def warm_corpus() -> Dict[str, int]:
+    """Fill the S3 document cache and derived indexes ahead of the first question.
+
+    Does nothing when an index snapshot is loaded, since retrieval then never
+    touches the cache.
+    """
+    bucket_name = os.getenv("S3_BUCKET_NAME")
+    if not bucket_name or current_snapshot() is not None:
+        return {"documents": 0}
+    s3_client = make_client('s3', region=os.getenv('AWS_DEFAULT_REGION', aws_region))
+    keys, modified = _list_corpus(s3_client, bucket_name, os.getenv("S3_OBJECT_NAME", ""))
+    _cache_documents(s3_client, bucket_name, keys)
+    kept = _distinct_documents(bucket_name, keys, modified)
+    _get_facet_index(bucket_name, kept)
+    if _ann_enabled():
+        _get_ann_index([f"{bucket_name}/{k}" for k in kept])
+    return {"documents": len(keys), "distinct": len(kept)}
+
+def _load_knowledge_base() -> str:
+    """Text of every knowledge-base document under the S3 prefix (or in the mapped snapshot)."""
+    # Build S3 client honoring endpoint (prefer helper so endpoint handling is consistent)
+    s3_client = make_client('s3', region=os.getenv('AWS_DEFAULT_REGION', aws_region))
+    bucket_name = os.getenv("S3_BUCKET_NAME")
+    prefix = os.getenv("S3_OBJECT_NAME", "")
+
+    if not bucket_name:
+        logger.error("S3_BUCKET_NAME not set in environment variables.")
+        return "No S3 bucket configured."
+
+    if not prefix:
+        logger.debug("S3_OBJECT_NAME not set; fetching from bucket root.")
+
+    snapshot = current_snapshot()
+    if snapshot is not None and snapshot.docs:
+        # The mapped snapshot already holds every document's text
+        return "\n\n".join(
+            f"File: {doc['key']}{_alias_note(doc.get('aliases'))}\n{snapshot.doc_text(i)}"
+            for i, doc in enumerate(snapshot.docs)
+        )
+
+    knowledge_base = []
+    tried_prefixes = []
+    # Try several prefix variants to handle nested folder keys
+    if prefix:
+        tried_prefixes = [prefix, prefix.rstrip('/') + '/']
+    else:
+        tried_prefixes = ['']
+
+    found_keys = []
+    modified: Dict[str, Any] = {}
+    try:
+        for p in tried_prefixes:
+            if p in found_keys:
+                continue
+            try:
+                resp = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=p)
+            except Exception as e:
+                logger.debug("list_objects_v2 failed for prefix '%s': %s", p, e)
+                continue
+            contents = resp.get('Contents', [])
+            for obj in contents:
+                k = obj.get('Key')
+                if k and k not in found_keys:
+                    found_keys.append(k)
+                    modified[k] = obj.get('LastModified')
+
+        # As a fallback, if no keys found for the prefixes, list all and filter contains
+        if not found_keys:
+            resp = s3_client.list_objects_v2(Bucket=bucket_name)
+            for obj in resp.get('Contents', []):
+                k = obj.get('Key')
+                if k and (not prefix or prefix in k):
+                    found_keys.append(k)
+                    modified[k] = obj.get('LastModified')
+
+        found_keys = [k for k in found_keys if is_corpus_key(k)]
+        if not found_keys:
+            return f"No files found under '{prefix}' in S3 bucket {bucket_name}."
+
+        # Shares the document cache with local retrieval (filled at startup by warm_corpus)
+        _cache_documents(s3_client, bucket_name, found_keys)
+        documents = [(key, _s3_doc_cache[f"{bucket_name}/{key}"]) for key in found_keys if _s3_doc_cache.get(f"{bucket_name}/{key}")]
+        # Revised copies of a document would otherwise all be pasted into the prompt
+        documents, aliases = dedupe_documents(documents, modified)
+        for key, content in documents:
+            knowledge_base.append(f"File: {key}{_alias_note(aliases.get(key))}\n{content}")
+    except Exception as e:
+        logger.error("Error accessing S3 bucket %s with prefix %s: %s", bucket_name, prefix, e)
+        return "Error accessing S3 bucket."
+
+    return "\n\n".join(knowledge_base) if knowledge_base else "No knowledge base available."
+
+def _alias_note(aliases: Optional[List[str]]) -> str:
+    return f" (also stored as: {', '.join(aliases)})" if aliases else ""
+
+def _snapshot_passages(snapshot: Snapshot, question: str, max_chars: int, k: int = 3) -> List[str]:
+    """Top passages for a question, fetched together (one coalesced read when the text is external)."""
+    # Dates and file names in the question narrow the search to the documents that have them
+    docs = snapshot.facets.match(question) if snapshot.facets is not None else None
+    hits = snapshot.bm25(_tokenize(question), k, docs=docs) if docs is not None else []
+    if not hits:
+        if _ann_enabled() and snapshot.ann is not None:
+            hits = snapshot.dense_search(question, k)
+        else:
+            hits = snapshot.bm25(_tokenize(question), k)
+    chunk_ids = [chunk_id for _, chunk_id in hits]
+    return [
+        f"File: {snapshot.chunk_key(chunk_id)}\n{text.strip()[:max_chars]}"
+        for chunk_id, text in zip(chunk_ids, snapshot.chunk_texts(chunk_ids))
+    ]
+
+def _snapshot_snippet(snapshot: Snapshot, question: str, max_chars: int, k: int = 3) -> str:
+    """Answer retrieval straight from the mapped index snapshot (no S3 reads)."""
+    excerpts = _snapshot_passages(snapshot, question, max_chars, k)
+    if not excerpts:
+        keys = [d["key"] for d in snapshot.docs[:10]]
+        return f"(Local mock) Bedrock is disabled in this environment. Found files: {', '.join(keys)}"
+    return "\n\n---\n\n".join(excerpts)
 
 def _score_document(question_tokens: List[str], doc_tokens: List[str]) -> float:
     if not question_tokens or not doc_tokens:
@@ -91,7 +338,97 @@ def _score_document(question_tokens: List[str], doc_tokens: List[str]) -> float:
     from math import log
     return len(overlap) / (log(len(doc_tokens) + 2))
 
+def _find_relevant_snippet(question: str, max_chars: int = 800) -> str:
+    """Find the most relevant S3 document for the question and return an excerpt.
+
+    This is a cheap local fallback when Bedrock is disabled. It lists objects in
+    the configured S3 bucket, caches their contents in memory, scores them by
+    simple token overlap with the question, and returns a small excerpt from
+    the best matching document.
+    """
+    bucket_name = os.getenv("S3_BUCKET_NAME")
+    prefix = os.getenv("S3_OBJECT_NAME", "")
+    if not bucket_name:
+        logger.error("S3_BUCKET_NAME not set in environment variables.")
+        return "No S3 bucket configured."
+
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        try:
+            return _snapshot_snippet(snapshot, question, max_chars)
+        except Exception as e:
+            logger.error("Snapshot retrieval failed, falling back to S3: %s", e)
+
+    # Use the consistent client factory (respects AWS_ENDPOINT_URL)
+    s3_client = make_client('s3', region=os.getenv('AWS_DEFAULT_REGION', aws_region))
+
+    try:
+        candidate_keys, modified = _list_corpus(s3_client, bucket_name, prefix)
+        if not candidate_keys:
+            return f"(Local mock) Bedrock is disabled in this environment. No relevant files found in bucket {bucket_name}."
+
+        _cache_documents(s3_client, bucket_name, candidate_keys)
+
+        # Score only the newest copy of each group of near-identical documents
+        candidate_keys = _distinct_documents(bucket_name, candidate_keys, modified)
+
+        # Dates and file names in the question resolve through the facet index; only matching documents are searched
+        matched = _get_facet_index(bucket_name, candidate_keys).match(question)
+        all_keys = candidate_keys
+        if matched is not None:
+            candidate_keys = [candidate_keys[i] for i in sorted(matched)]
+
+        if _ann_enabled():
+            only = {f"{bucket_name}/{k}" for k in candidate_keys} if matched is not None else None
+            hits = _dense_search(question, [f"{bucket_name}/{k}" for k in all_keys], only=only)
+            if hits:
+                excerpts = []
+                for _, chunk in hits:
+                    excerpts.append(f"File: {chunk[0][len(bucket_name) + 1:]}\n{_chunk_text(chunk).strip()[:max_chars]}")
+                return "\n\n---\n\n".join(excerpts)
+
+        question_tokens = _tokenize(question)
+        scored = []
+        for key in candidate_keys:
+            cache_key = f"{bucket_name}/{key}"
+            doc_tokens = _tokenize(_s3_doc_cache.get(cache_key, ""))
+            scored.append((_score_document(question_tokens, doc_tokens), key))
+
+        # Sort descending
+        scored.sort(key=lambda x: x[0], reverse=True)
+
+        best_score, best_key = scored[0]
+
+        # If best score is very small, return top-3 summaries instead of a single tiny match
+        if best_score < 0.05:
+            top_n = [k for s, k in scored[:3] if s > 0]
+            if not top_n:
+                # No substantive overlap; return a short bucket listing
+                return f"(Local mock) Bedrock is disabled in this environment. Found files: {', '.join(candidate_keys[:10])}"
+            excerpts = []
+            for k in top_n:
+                text = _s3_doc_cache.get(f"{bucket_name}/{k}", "").strip()[:max_chars]
+                excerpts.append(f"File: {k}\n{text}")
+            return "\n\n---\n\n".join(excerpts)
+
+        # Return an excerpt from the best document
+        excerpt_text = _s3_doc_cache.get(f"{bucket_name}/{best_key}", "").strip()
+        excerpt_text = excerpt_text[:max_chars]
+        return f"File: {best_key}\n{excerpt_text}"
+
+    except Exception as e:
+        logger.error("Error during local S3 retrieval: %s", e)
+        return "Error accessing S3 during local retrieval."
+
 # Determine whether Bedrock calls should be allowed in this environment.
+def _kb_version() -> str:
+    """Identifies the knowledge base a prompt would be built from."""
+    snapshot = current_snapshot()
+    if snapshot is not None and snapshot.docs:
+        return f"snapshot:{os.path.basename(snapshot.path)}:{snapshot.version}"
+    return f"s3:{os.getenv('S3_BUCKET_NAME')}/{os.getenv('S3_OBJECT_NAME', '')}"
+
+
 def bedrock_allowed() -> bool:
     """Return False when running against LocalStack or when DISABLE_BEDROCK=1 is set."""
     # Explicit disable takes highest precedence
@@ -119,14 +456,14 @@ try:
 
     identity = sts_client.get_caller_identity()
     aws_user_id = identity.get('Arn', f"arn:aws:iam::000000000000:root")
-    logger.debug(f"Fetched AWS identity: {identity}")
+    logger.debug("Fetched AWS identity: %s", identity)
     logger.debug("Successfully initialized boto3 with static credentials")
 except ClientError as e:
-    logger.error(f"Failed to initialize boto3 with static credentials: {e}", exc_info=True)
+    logger.error("Failed to initialize boto3 with static credentials: %s", e, exc_info=True)
     # Fallback identity for LocalStack / dev environments
     aws_user_id = os.getenv('AWS_USER_ARN', f"arn:aws:iam::000000000000:root")
 except Exception as e:
-    logger.error(f"Unexpected error while initializing boto3/STS: {e}", exc_info=True)
+    logger.error("Unexpected error while initializing boto3/STS: %s", e, exc_info=True)
     aws_user_id = os.getenv('AWS_USER_ARN', f"arn:aws:iam::000000000000:root")
 
 # def create_chat_session_table():
@@ -157,16 +494,217 @@ class QA(rx.Base):
     question: str
     answer: str
 
-DEFAULT_CHATS = {
-    "Intros": [],
-}
+class SearchHit(rx.Base):
+    """A chat history search result."""
+    chat_name: str
+    session_id: str
+    position: int
+    snippet: str
+
+# Bound on the upload list kept in State (it's shipped to the browser and the state store)
+MAX_UPLOADED_FILES_IN_STATE = 20
+# Upload progress fires many times per second; log only every n-th update
+UPLOAD_PROGRESS_LOG_EVERY = int(os.getenv("UPLOAD_PROGRESS_LOG_EVERY", "20"))
+
+DEFAULT_CHAT = "Intros"
+
+# Chat history search results shown in the sidebar
+SEARCH_RESULTS = int(os.getenv("CHAT_SEARCH_RESULTS", "10"))
+# Messages shown before a search hit when opening a chat at it
+SEARCH_CONTEXT_BEFORE = 2
+
+# Number of most recent messages of the current chat kept in State. The full
+# history lives in the server-side store (see chat/history.py), so the payload
+# sent to the browser and the state store stays constant as chats grow.
+HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+# Older messages are fetched a page at a time when the user scrolls up, up to a
+# hard cap on how many are rendered at once.
+HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "20"))
+MAX_RENDERED_MESSAGES = int(os.getenv("CHAT_MAX_RENDERED_MESSAGES", "100"))
+# Distance from the top of the chat (px) at which the previous page is loaded
+LOAD_OLDER_THRESHOLD_PX = 200
+# Passages sent as the knowledge base when the snapshot's text is an external artifact
+KB_PASSAGES = int(os.getenv("KB_PASSAGES", "6"))
+KB_PASSAGE_CHARS = int(os.getenv("KB_PASSAGE_CHARS", "1500"))
+# Per-question budget (queue wait + model call) before answering from local retrieval
+BEDROCK_DEADLINE_S = float(os.getenv("BEDROCK_DEADLINE_S", "20"))
+MODEL_ID = "anthropic.claude-v2"
+MAX_TOKENS = 2000
+
+
+def _signals(question: str) -> Optional[Dict[str, Any]]:
+    try:
+        return retrieval_signals(current_snapshot(), question)
+    except Exception as e:
+        logger.warning("Retrieval signals unavailable for routing: %s", e)
+        return None
+
+
+def _route_question(question: str, context: str = "", retrieval: Optional[Dict[str, Any]] = None) -> Route:
+    """Model/token choice for a question; the fixed default model when routing is off."""
+    if not routing_enabled():
+        return Route("strong", MODEL_ID, MAX_TOKENS, "routing disabled")
+    limiter = get_model_limiter()
+    # Expected wait in the admission queue comes out of the latency budget
+    budget = BEDROCK_DEADLINE_S - limiter.depth / max(limiter.bucket.rate, 1e-6)
+    signals = retrieval["signals"] if retrieval and "signals" in retrieval else _signals(question)
+    return route(question, signals, budget, follow_up=bool(context))
+
+
+def _shared_retrieval() -> Dict[str, Any]:
+    """The question-independent part of ``_retrieve``: the knowledge base text, unless passages are used."""
+    snapshot = current_snapshot()
+    if (snapshot is None or not snapshot.text_is_external) and bedrock_allowed():
+        return {"knowledge_base": _load_knowledge_base()}
+    return {}
+
+
+def _retrieve(question: str, shared: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """The retrieval stage of answering ``question`` (blocking); what the prefetcher runs ahead of submit.
+
+    ``signals`` feed routing; ``passages`` (external snapshot text) or
+    ``knowledge_base`` (everything else) go into the prompt. A batch passes
+    the ``_shared_retrieval()`` it loaded once as ``shared``.
+    """
+    retrieval = dict(_shared_retrieval() if shared is None else shared)
+    if routing_enabled():
+        retrieval["signals"] = _signals(question)
+    snapshot = current_snapshot()
+    if snapshot is not None and snapshot.text_is_external:
+        retrieval["passages"] = _snapshot_passages(snapshot, question, KB_PASSAGE_CHARS, KB_PASSAGES)
+    return retrieval
+
+
+_prefetcher = Prefetcher(_retrieve, _kb_version)
+
+
+async def _local_answer(question: str) -> str:
+    """Answer from local retrieval when the model is slow, failing or switched off by the breaker."""
+    try:
+        snippet = await asyncio.to_thread(_find_relevant_snippet, question)
+    except Exception as e:
+        logger.error("Local fallback retrieval failed: %s", e)
+        return "Sorry, I encountered an error while processing your request."
+    return (
+        "(Local answer) The model is unavailable right now. "
+        f"Here's the most relevant excerpt I found:\n{snippet}"
+    ).strip()
+
+
+async def answer_question(
+    question: str,
+    context: str = "",
+    plan: Optional[Route] = None,
+    retrieval: Optional[Dict[str, Any]] = None,
+    on_queue: Callable[[int], None] = lambda position: None,
+) -> str:
+    """Build the prompt and get an answer: a direct passage, the model, or local retrieval.
+
+    ``retrieval`` is what was already retrieved for this question (see
+    ``_retrieve``); ``on_queue`` is told the admission queue position while waiting.
+    """
+    plan = plan or _route_question(question, context, retrieval)
+    if plan.kind == "direct":
+        snapshot = current_snapshot()
+        if snapshot is not None and plan.chunk_id >= 0:
+            return f"From {snapshot.chunk_key(plan.chunk_id)}:\n{snapshot.chunk_text(plan.chunk_id).strip()[:1500]}"
+
+    retrieval = retrieval or {}
+    snapshot = current_snapshot()
+    if snapshot is not None and snapshot.text_is_external:
+        # The corpus is too big to paste whole; send the retrieved passages, read by byte range
+        passages = retrieval.get("passages")
+        if passages is None:
+            passages = _snapshot_passages(snapshot, question, KB_PASSAGE_CHARS, KB_PASSAGES)
+        knowledge_base = "\n\n".join(passages) if passages else "No knowledge base available."
+    elif "knowledge_base" in retrieval:
+        knowledge_base = retrieval["knowledge_base"]
+    else:
+        knowledge_base = await asyncio.to_thread(_load_knowledge_base)
+    conversation = f"Here is the conversation so far:\n{context}\n\n" if context else ""
+    prompt = (
+        "You are a helpful assistant. Use the following information as your knowledge base "
+        "to answer the question. If the information below is insufficient, say so and do not "
+        "rely on pretrained data.\n\n"
+        "Human: Here is the knowledge base:\n"
+        f"{knowledge_base}\n\n"
+        f"{conversation}"
+        f"Now, please answer this question: {question}\n\n"
+        "Assistant:"
+    )
+
+    # Call Bedrock (or LocalStack stub) using helper so endpoint is honored
+    if not bedrock_allowed():
+        logger.info("Bedrock disabled or running against LocalStack — using local mock response")
+        # Use a simple local retrieval to return the most relevant excerpt
+        snippet = await asyncio.to_thread(_find_relevant_snippet, question)
+        return (
+            "(Local mock) Bedrock is disabled in this environment. "
+            f"Here's the most relevant excerpt I found:\n{snippet}"
+        ).strip()
+
+    ticket = None
+    # One deadline covers both the queue wait and the model call
+    deadline = time.monotonic() + BEDROCK_DEADLINE_S
+    try:
+        if get_breaker().is_open():
+            raise CircuitOpenError("Bedrock circuit breaker is open")
+        # Wait for an admission slot; show the queue position instead of failing under bursts
+        ticket = get_model_limiter().enqueue()
+        async for queue_position in ticket.wait_turn(deadline=deadline):
+            on_queue(queue_position)
+        on_queue(0)
+        if time.monotonic() >= deadline:
+            # Admitted too late to call the model; that's queueing, not a model failure for the breaker
+            raise asyncio.TimeoutError("deadline passed while queued")
+        model_id = plan.model_id or MODEL_ID
+        start = time.monotonic()
+        answer = await invoke_guarded(
+            prompt, model_id=model_id, max_tokens=plan.max_tokens or MAX_TOKENS,
+            timeout=max(0.1, deadline - time.monotonic()),
+            ticket=ticket,
+        )
+        record_generation(model_id, len(answer), time.monotonic() - start)
+        logger.info("Received answer from Bedrock: %s...", answer[:50])
+        return answer
+    except QueueFullError as e:
+        logger.warning("Bedrock admission queue full: %s", e)
+        return "The assistant is very busy right now. Please try again in a moment."
+    except (CircuitOpenError, asyncio.TimeoutError) as e:
+        logger.warning("Bedrock unavailable (%s: %s); answering from local retrieval", type(e).__name__, e)
+        return await _local_answer(question)
+    except Exception as e:
+        logger.error("Error calling Bedrock/Runtime: %s", e, exc_info=True)
+        return await _local_answer(question)
+    finally:
+        on_queue(0)
+        if ticket is not None:
+            ticket.release()
+
+
+def _question_key(question: str, context: str, plan: Route) -> str:
+    # Follow-ups only coalesce with requests that carry the same conversation context
+    context_digest = hashlib.sha1(context.encode("utf-8")).hexdigest() if context else ""
+    return question_key(
+        question,
+        _kb_version(),
+        route=plan.kind,
+        model=plan.model_id,
+        max_tokens=plan.max_tokens,
+        bedrock=bedrock_allowed(),
+        context=context_digest,
+    )
 
 class State(rx.State):
     """The app state."""
-    chats: Dict[str, List[QA]] = DEFAULT_CHATS
-    current_chat: str = "Intros"
+    chat_names: List[str] = [DEFAULT_CHAT]
+    messages: List[QA] = []
+    window_start: int = 0
+    message_count: int = 0
+    current_chat: str = DEFAULT_CHAT
     question: str = ""
     processing: bool = False
+    queue_position: int = 0
     new_chat_name: str = ""
     uploaded_files: List[str] = []
     upload_error: str = ""
@@ -174,25 +712,118 @@ class State(rx.State):
     progress: int = 0
     total_bytes: int = 0
     user_id: str = aws_user_id
+    # Random per-browser id used as the user identity when there is no Cognito login
+    browser_id: str = rx.LocalStorage("", name="ck_browser_id")
     session_ids: Dict[str, str] = {}
+    # Chats whose history lives in the S3 archive until they are opened
+    archived_chats: List[str] = []
+    # Rolling conversation summary per chat: {"text": str, "turns": int}; backend only
+    _summaries: Dict[str, Dict[str, Any]] = {}
+    search_query: str = ""
+    search_hits: List[SearchHit] = []
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **{k: v for k, v in kwargs.items() if k != 'parent_state'})
-        self.load_session()
+        # Sessions are loaded on mount of the chat page (load_session), where the
+        # connection headers and browser id needed to resolve the user are available
+
+    def _resolve_user(self):
+        """Set user_id from the ALB/Cognito headers or the browser's local id; empty if refused."""
+        headers = {k.lower(): v for k, v in self.router.headers.raw_headers.items()}
+        try:
+            user_id = resolve_user_id(headers, self.browser_id, aws_user_id)
+        except IdentityError as e:
+            logger.warning("Refusing chat session: %s", e)
+            self.user_id = ""
+            return
+        if user_id is None:
+            self.browser_id = new_browser_id()
+            user_id = resolve_user_id(headers, self.browser_id, aws_user_id)
+        if user_id != self.user_id:
+            logger.info("Resolved chat user %s", user_id)
+            self.user_id = user_id
+
+    def _load_window(self):
+        """Load the newest HISTORY_WINDOW messages of the current chat into State."""
+        store = get_history_store()
+        total = store.length(self.user_id, self.current_chat)
+        self.message_count = total
+        self.window_start = max(0, total - HISTORY_WINDOW)
+        self.messages = [QA(**m) for m in store.window(self.user_id, self.current_chat, self.window_start, total)]
+
+    def _load_window_at(self, position: int):
+        """Load a window of the current chat starting just before ``position``."""
+        store = get_history_store()
+        total = store.length(self.user_id, self.current_chat)
+        self.message_count = total
+        self.window_start = max(0, min(position - SEARCH_CONTEXT_BEFORE, total - HISTORY_WINDOW))
+        end = min(total, self.window_start + HISTORY_WINDOW)
+        self.messages = [QA(**m) for m in store.window(self.user_id, self.current_chat, self.window_start, end)]
+
+    def _append_visible(self, qa: QA):
+        """Append to the visible window, dropping the oldest message when it is full."""
+        if self.window_start + len(self.messages) < self.message_count:
+            # The user scrolled back through history; jump to the latest page first
+            self._load_window()
+        self.message_count += 1
+        self.messages.append(qa)
+        overflow = len(self.messages) - HISTORY_WINDOW
+        if overflow > 0:
+            self.messages = self.messages[overflow:]
+            self.window_start += overflow
+
+    def _reset_to_default_chat(self):
+        self.chat_names = [DEFAULT_CHAT]
+        self.current_chat = DEFAULT_CHAT
+        self.messages = []
+        self.window_start = 0
+        self.message_count = 0
+        get_history_store().replace(self.user_id, DEFAULT_CHAT, [])
+
+    @rx.var
+    def has_older(self) -> bool:
+        return self.window_start > 0
+
+    @rx.var
+    def at_latest(self) -> bool:
+        return self.window_start + len(self.messages) >= self.message_count
+
+    def load_older(self):
+        """Prepend the previous page of the current chat to the rendered window."""
+        if self.window_start <= 0:
+            return
+        start = max(0, self.window_start - HISTORY_PAGE_SIZE)
+        older = get_history_store().window(self.user_id, self.current_chat, start, self.window_start)
+        messages = [QA(**m) for m in older] + list(self.messages)
+        # Keep the DOM bounded: drop the newest messages beyond the cap
+        self.messages = messages[:MAX_RENDERED_MESSAGES]
+        self.window_start = start
+        logger.debug("Loaded %s older messages for '%s' from %s", len(older), self.current_chat, start)
+
+    def on_chat_scroll(self, scroll_top: int):
+        if scroll_top is not None and scroll_top <= LOAD_OLDER_THRESHOLD_PX:
+            self.load_older()
+
+    def jump_to_latest(self):
+        self._load_window()
 
     def create_chat(self):
-        logger.debug(f"Attempting to create chat with name: {self.new_chat_name}")
+        logger.debug("Attempting to create chat with name: %s", self.new_chat_name)
         if not self.new_chat_name.strip():
             logger.warning("New chat name is empty")
             return
         chat_name = self.new_chat_name.strip()
-        if chat_name in self.chats:
-            logger.warning(f"Chat '{chat_name}' already exists")
+        if chat_name in self.chat_names:
+            logger.warning("Chat '%s' already exists", chat_name)
             return
-        self.chats[chat_name] = []
+        self.chat_names.append(chat_name)
+        get_history_store().replace(self.user_id, chat_name, [])
         self.current_chat = chat_name
+        self.messages = []
+        self.window_start = 0
+        self.message_count = 0
         self.new_chat_name = ""
-        logger.info(f"Created new chat in state: {chat_name}")
+        logger.info("Created new chat in state: %s", chat_name)
 
         session_id = f"Session#{datetime.utcnow().isoformat()}Z"
         item = {
@@ -204,42 +835,47 @@ class State(rx.State):
         try:
             chat_table.put_item(Item=item)
             self.session_ids[chat_name] = session_id # Store session_id for new chat
-            logger.info(f"Saved new chat '{chat_name}' to DynamoDB with session_id: {session_id}")
+            logger.info("Saved new chat '%s' to DynamoDB with session_id: %s", chat_name, session_id)
         except Exception as e:
-            logger.error(f"Failed to save chat to DynamoDB: {str(e)}", exc_info=True)
+            logger.error("Failed to save chat to DynamoDB: %s", str(e), exc_info=True)
             raise
 
     def delete_chat(self):
-        logger.debug(f"Attempting to delete chat: {self.current_chat}")
-        if self.current_chat not in self.chats:
-            logger.warning(f"Attempted to delete non-existent chat: {self.current_chat}")
+        logger.debug("Attempting to delete chat: %s", self.current_chat)
+        if self.current_chat not in self.chat_names:
+            logger.warning("Attempted to delete non-existent chat: %s", self.current_chat)
             return
 
-        chat_titles = list(self.chats.keys())
-        current_index = chat_titles.index(self.current_chat)
+        current_index = self.chat_names.index(self.current_chat)
 
         try:
             response = chat_table.query(
                 KeyConditionExpression="user_id = :uid AND begins_with(session_id, :sid)",
                 ExpressionAttributeValues={":uid": self.user_id, ":sid": self.current_chat}
             )
-            logger.debug(f"Query response for deletion: {response}")
+            logger.debug("Deletion query matched %d items", len(response.get("Items", [])))
             for item in response.get("Items", []):
                 if item["chat_name"] == self.current_chat:
+                    get_chat_writer().discard(self.user_id, item["session_id"])
+                    forget_session_later(self.user_id, item["session_id"])
+                    if is_archived(item):
+                        make_client('s3').delete_object(Bucket=item["archive"]["bucket"], Key=item["archive"]["key"])
                     chat_table.delete_item(
                         Key={"user_id": self.user_id, "session_id": item["session_id"]}
                     )
-                    logger.info(f"Deleted chat '{self.current_chat}' from DynamoDB")
+                    logger.info("Deleted chat '%s' from DynamoDB", self.current_chat)
                     break
         except Exception as e:
-            logger.error(f"Failed to delete chat from DynamoDB: {str(e)}", exc_info=True)
+            logger.error("Failed to delete chat from DynamoDB: %s", str(e), exc_info=True)
 
-        del self.chats[self.current_chat]
-        logger.info(f"Deleted chat from state: {self.current_chat}")
+        get_history_store().delete(self.user_id, self.current_chat)
+        self._summaries.pop(self.current_chat, None)
+        self.search_hits = [h for h in self.search_hits if h.chat_name != self.current_chat]
+        self.chat_names = [c for c in self.chat_names if c != self.current_chat]
+        logger.info("Deleted chat from state: %s", self.current_chat)
 
-        if not self.chats:
-            self.chats = DEFAULT_CHATS.copy()
-            self.current_chat = "Intros"
+        if not self.chat_names:
+            self._reset_to_default_chat()
             logger.info("No chats remain, created new default 'Intros'")
             session_id = f"Intros#{datetime.utcnow().isoformat()}Z"
             try:
@@ -253,22 +889,19 @@ class State(rx.State):
                 )
                 logger.info("Saved default 'Intros' to DynamoDB")
             except Exception as e:
-                logger.error(f"Failed to save default 'Intros' to DynamoDB: {str(e)}", exc_info=True)
+                logger.error("Failed to save default 'Intros' to DynamoDB: %s", str(e), exc_info=True)
         else:
-            remaining_chats = list(self.chats.keys())
-            new_index = min(current_index, len(remaining_chats) - 1) if current_index < len(remaining_chats) else 0
-            self.current_chat = remaining_chats[new_index]
-            logger.info(f"Switched to chat: {self.current_chat}")
-
-        self.chats = self.chats
+            new_index = min(current_index, len(self.chat_names) - 1)
+            self.current_chat = self.chat_names[new_index]
+            self._load_window()
+            logger.info("Switched to chat: %s", self.current_chat)
 
     def set_chat(self, chat_name: str):
-        logger.debug(f"Attempting to set chat to: {chat_name}")
-        if chat_name not in self.chats:
-            logger.warning(f"Chat '{chat_name}' does not exist")
-            if not self.chats:
-                self.chats = DEFAULT_CHATS.copy()
-                self.current_chat = "Intros"
+        logger.debug("Attempting to set chat to: %s", chat_name)
+        if chat_name not in self.chat_names:
+            logger.warning("Chat '%s' does not exist", chat_name)
+            if not self.chat_names:
+                self._reset_to_default_chat()
                 logger.info("Chat history empty, created new default 'Intros'")
                 session_id = f"Intros#{datetime.utcnow().isoformat()}Z"
                 try:
@@ -282,25 +915,50 @@ class State(rx.State):
                     )
                     logger.info("Saved default 'Intros' to DynamoDB")
                 except Exception as e:
-                    logger.error(f"Failed to save default 'Intros' to DynamoDB: {str(e)}", exc_info=True)
+                    logger.error("Failed to save default 'Intros' to DynamoDB: %s", str(e), exc_info=True)
             else:
-                self.current_chat = list(self.chats.keys())[0]
-                logger.info(f"Chat '{chat_name}' deleted or invalid, switched to: {self.current_chat}")
-            self.chats = self.chats
+                self.current_chat = self.chat_names[0]
+                self._load_window()
+                logger.info("Chat '%s' deleted or invalid, switched to: %s", chat_name, self.current_chat)
             return
         self.current_chat = chat_name
-        logger.info(f"Switched to chat: {chat_name}")
+        if chat_name in self.archived_chats:
+            self._rehydrate_chat(chat_name)
+        self._load_window()
+        logger.info("Switched to chat: %s", chat_name)
+
+    def _rehydrate_chat(self, chat_name: str):
+        """Load an archived chat's history back from S3 into DynamoDB and the history store."""
+        session_id = self.session_ids.get(chat_name)
+        try:
+            item = chat_table.get_item(Key={"user_id": self.user_id, "session_id": session_id}).get("Item")
+            if item and is_archived(item):
+                messages = rehydrate_session(chat_table, make_client('s3'), item)
+                messages += get_chat_writer().pending_messages(self.user_id, session_id)
+                get_history_store().replace(self.user_id, chat_name, messages)
+                index_session_later(self.user_id, session_id, messages)
+        except Exception as e:
+            logger.error("Failed to rehydrate archived chat '%s': %s", chat_name, e, exc_info=True)
+            return
+        self.archived_chats = [c for c in self.archived_chats if c != chat_name]
 
     def reset_session(self):
         logger.debug("Attempting to reset session")
-        self.chats = DEFAULT_CHATS.copy()
-        self.current_chat = "Intros"
+        store = get_history_store()
+        for chat_name in self.chat_names:
+            store.delete(self.user_id, chat_name)
+        self._reset_to_default_chat()
+        self._summaries = {}
+        self.search_hits = []
         self.processing = False
         logger.info("Session reset to default state in memory")
         try:
-            response = chat_table.scan(FilterExpression="user_id = :uid", ExpressionAttributeValues={":uid": self.user_id})
-            logger.debug(f"Scan response for reset: {response}")
+            # Only this user's partition, rather than scanning the whole table
+            response = chat_table.query(KeyConditionExpression="user_id = :uid", ExpressionAttributeValues={":uid": self.user_id})
+            logger.debug("Reset query matched %d items", len(response.get("Items", [])))
+            get_chat_search().delete_user(self.user_id)
             for item in response.get("Items", []):
+                get_chat_writer().discard(self.user_id, item["session_id"])
                 chat_table.delete_item(Key={"user_id": self.user_id, "session_id": item["session_id"]})
             session_id = f"Intros#{datetime.utcnow().isoformat()}Z"
             chat_table.put_item(
@@ -311,110 +969,197 @@ class State(rx.State):
                     "chat_history": [],
                 }
             )
-            logger.info(f"Reset DynamoDB session for user {self.user_id}")
+            logger.info("Reset DynamoDB session for user %s", self.user_id)
         except Exception as e:
-            logger.error(f"Failed to reset DynamoDB session: {str(e)}", exc_info=True)
-        self.chats = self.chats
+            logger.error("Failed to reset DynamoDB session: %s", str(e), exc_info=True)
 
     @rx.var(cache=True)
     def chat_titles(self) -> List[str]:
-        titles = list(self.chats.keys())
-        logger.debug(f"Chat titles retrieved: {titles}")
+        titles = list(self.chat_names)
+        logger.debug("Chat titles retrieved: %s", titles)
         return titles
 
+    async def _local_fallback_answer(self, question: str) -> str:
+        return await _local_answer(question)
+
+    def _conversation_context(self, position: int) -> str:
+        """Rolling summary plus the last CONTEXT_TURNS turns before ``position``."""
+        summary = self._summaries.get(self.current_chat, {})
+        start = max(int(summary.get("turns", 0)), position - CONTEXT_TURNS)
+        recent = get_history_store().window(self.user_id, self.current_chat, start, position)
+        return format_context(summary.get("text", ""), recent)
+
+    async def _summarize(self, summary: str, turns: List[Dict[str, str]]) -> str:
+        if summary_mode() == "model" and bedrock_allowed() and not get_breaker().is_open():
+            # Fold all but the newest few turns extractively so the model prompt stays small
+            summary = fold_extractive(summary, turns[:-8])
+            ticket = None
+            try:
+                deadline = time.monotonic() + BEDROCK_DEADLINE_S
+                ticket = get_model_limiter().enqueue()
+                async for _ in ticket.wait_turn(deadline=deadline):
+                    pass
+                if time.monotonic() >= deadline:
+                    raise asyncio.TimeoutError("deadline passed while queued")
+                text = await invoke_guarded(
+                    summary_prompt(summary, turns[-8:]), model_id=MODEL_ID, max_tokens=400,
+                    timeout=deadline - time.monotonic(), ticket=ticket,
+                )
+                if text:
+                    return text[:MAX_SUMMARY_CHARS]
+            except Exception as e:
+                logger.warning("Model summary failed (%s); folding turns extractively", e)
+            finally:
+                if ticket is not None:
+                    ticket.release()
+            return fold_extractive(summary, turns[-8:])
+        return fold_extractive(summary, turns)
+
+    @rx.event(background=True)
+    async def update_summary(self, chat_name: str, session_id: str, total_turns: int):
+        """Fold turns that left the recent window into the chat's rolling summary.
+
+        A background event, so a model summary doesn't hold the state lock while
+        the user keeps chatting; state is only locked to read and store it.
+        """
+        async with self:
+            user_id = self.user_id
+            summary = dict(self._summaries.get(chat_name, {"text": "", "turns": 0}))
+        to_fold = turns_to_fold(int(summary.get("turns", 0)), total_turns)
+        if not to_fold:
+            return
+        turns = get_history_store().window(user_id, chat_name, to_fold.start, to_fold.stop)
+        text = await self._summarize(summary.get("text", ""), turns)
+        async with self:
+            if int(self._summaries.get(chat_name, {}).get("turns", 0)) >= to_fold.stop:
+                # A later update already folded these turns
+                return
+            self._summaries[chat_name] = {"text": text, "turns": to_fold.stop}
+        get_chat_writer().set_summary(user_id, session_id, chat_name, text, to_fold.stop)
+        logger.debug("Summary for '%s' now covers %s turns (%s chars)", chat_name, to_fold.stop, len(text))
+
+    async def _compute_answer(
+        self, question: str, flight: Flight, context: str, plan: Route, retrieval: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Answer once per coalesced question, showing the queue position to every waiter."""
+        return await answer_question(
+            question, context, plan, retrieval, on_queue=lambda position: setattr(flight, "queue_position", position)
+        )
+
+    @profiled
     async def process_question(self, form_data: Dict[str, Any]):
         """Process a submitted question: call Bedrock (or mock), store result in DynamoDB, update state."""
-        logger.debug(f"Processing question: {form_data}")
+        logger.debug("Processing question (%d chars)", len(form_data.get("question", "")))
         question = form_data.get("question", "").strip()
         if not question:
             logger.warning("Question is empty, skipping processing")
             return
+        if not self.user_id:
+            logger.warning("No chat identity for this connection, skipping question")
+            return
 
         qa = QA(question=question, answer="")
-        self.chats.setdefault(self.current_chat, []).append(qa)
+        self._append_visible(qa)
+        position = get_history_store().append(self.user_id, self.current_chat, qa.dict())
         self.processing = True
-        logger.info(f"Added question to chat '{self.current_chat}': {question}")
+        logger.info("Added question to chat '%s': %s", self.current_chat, question)
         yield
 
-        knowledge_base = await self.get_knowledge_base()
-        prompt = (
-            "You are a helpful assistant. Use the following information as your knowledge base "
-            "to answer the question. If the information below is insufficient, say so and do not "
-            "rely on pretrained data.\n\n"
-            "Human: Here is the knowledge base:\n"
-            f"{knowledge_base}\n\n"
-            f"Now, please answer this question: {question}\n\n"
-            "Assistant:"
+        context = self._conversation_context(position)
+        # Retrieval that already ran while the question was typed
+        retrieval = await _prefetcher.take(self.router.session.client_token, question) if prefetch_enabled() else None
+        plan = _route_question(question, context, retrieval)
+        # Identical questions asked concurrently (any user or chat) share one answer
+        flight, leader = get_question_flights().join(
+            _question_key(question, context, plan), lambda f: self._compute_answer(question, f, context, plan, retrieval)
         )
-
-        # Call Bedrock (or LocalStack stub) using helper so endpoint is honored
-        if not bedrock_allowed():
-            logger.info("Bedrock disabled or running against LocalStack — using local mock response")
-            # Use a simple local retrieval to return the most relevant excerpt
-            snippet = await self.find_relevant_snippet(question)
-            answer = (
-                "(Local mock) Bedrock is disabled in this environment. "
-                f"Here's the most relevant excerpt I found:\n{snippet}"
-            ).strip()
-        else:
-            try:
-                client = make_client("bedrock-runtime", region=os.getenv('AWS_DEFAULT_REGION', 'ap-northeast-1'))
-                model_id = "anthropic.claude-v2"
-                body = json.dumps({"prompt": prompt, "max_tokens_to_sample": 2000, "temperature": 0.7})
-
-                response = client.invoke_model(
-                    modelId=model_id,
-                    body=body,
-                    contentType="application/json",
-                    accept="application/json"
-                )
-                response_body = json.loads(response["body"].read())
-                answer = response_body.get("completion", "").strip()
-                logger.info(f"Received answer from Bedrock: {answer[:50]}...")
-            except Exception as e:
-                logger.error(f"Error calling Bedrock/Runtime: {e}", exc_info=True)
-                answer = "Sorry, I encountered an error while processing your request."
+        if not leader:
+            logger.info("Question coalesced with an in-flight request (%s waiting)", flight.waiters)
+        async for queue_position in flight.wait_done():
+            self.queue_position = queue_position
+            yield
+        self.queue_position = 0
+        try:
+            answer = flight.future.result()
+        except Exception as e:
+            logger.error("Error answering question: %s", e, exc_info=True)
+            answer = "Sorry, I encountered an error while processing your request."
 
         # Update the QA and persist to DynamoDB
-        self.chats[self.current_chat][-1].answer = answer
+        qa = QA(question=question, answer=answer)
+        try:
+            get_history_store().set(self.user_id, self.current_chat, position, qa.dict())
+        except Exception as e:
+            logger.error("Failed to store the answer in the chat history: %s", e, exc_info=True)
+        if self.messages:
+            self.messages[-1] = qa
         self.processing = False
-        logger.info(f"Updated chat '{self.current_chat}' with answer")
+        logger.info("Updated chat '%s' with answer", self.current_chat)
 
         session_id = self.session_ids.get(self.current_chat)
         if not session_id:
             session_id = f"Session#{datetime.utcnow().isoformat()}Z"
             self.session_ids[self.current_chat] = session_id
 
+        # Written to DynamoDB in the background so the handler doesn't wait on it
+        get_chat_writer().enqueue(
+            self.user_id, session_id, self.current_chat, {"question": qa.question, "answer": qa.answer}
+        )
+        logger.info("Queued message for session '%s'", session_id)
+        index_message_later(self.user_id, session_id, position, {"question": qa.question, "answer": qa.answer})
+        # Summarizing may call the model; don't hold the state lock for it
+        yield State.update_summary(self.current_chat, session_id, position + 1)
+
+    @rx.event(background=True)
+    async def prefetch_question(self, text: str):
+        """Debounced ``on_change`` of the question input: start retrieval before the question is sent."""
+        if prefetch_enabled():
+            await _prefetcher.prefetch(self.router.session.client_token, text)
+
+    def search_chats(self, form_data: Dict[str, Any]):
+        """Rank this user's stored messages against the query."""
+        self.search_query = form_data.get("query", "").strip()
+        if not self.search_query:
+            self.search_hits = []
+            return
+        chat_for = {session_id: name for name, session_id in self.session_ids.items()}
         try:
-            existing_item = {}
-            try:
-                resp = chat_table.get_item(Key={"user_id": self.user_id, "session_id": session_id})
-                existing_item = resp.get("Item", {})
-            except Exception:
-                logger.debug("No existing session found; will create a new one")
-
-            existing_messages = existing_item.get("messages", [])
-            existing_messages.append({"question": qa.question, "answer": qa.answer})
-
-            chat_table.put_item(
-                Item={
-                    "user_id": self.user_id,
-                    "session_id": session_id,
-                    "chat_name": self.current_chat,
-                    "messages": existing_messages,
-                }
-            )
-            logger.info(f"Appended message to session '{session_id}' in DynamoDB")
+            hits = get_chat_search().search(self.user_id, self.search_query, SEARCH_RESULTS)
         except Exception as e:
-            logger.error(f"Failed to update session in DynamoDB: {str(e)}", exc_info=True)
-            # Don't raise — keep the UI responsive even if DB write fails
-
-        self.chats = self.chats
-        yield
+            logger.error("Chat search failed: %s", e, exc_info=True)
+            hits = []
+        self.search_hits = [
+            SearchHit(chat_name=chat_for[h["session_id"]], session_id=h["session_id"], position=h["position"], snippet=h["snippet"])
+            for h in hits
+            if h["session_id"] in chat_for
+        ]
+        logger.info("Chat search '%s' returned %s hits", self.search_query, len(self.search_hits))
+
+    def clear_search(self):
+        self.search_query = ""
+        self.search_hits = []
+
+    def open_search_hit(self, chat_name: str, position: int):
+        """Switch to the chat of a search hit and show the window around that message."""
+        if chat_name not in self.chat_names:
+            logger.warning("Search hit for unknown chat '%s'", chat_name)
+            return
+        self.current_chat = chat_name
+        if chat_name in self.archived_chats:
+            self._rehydrate_chat(chat_name)
+        self._load_window_at(position)
+        logger.info("Opened chat '%s' at message %s from search", chat_name, position)
 
+    @profiled
     def load_session(self):
         """Load chat sessions from DynamoDB for the current user."""
-        logger.debug(f"Loading sessions for user: {self.user_id}")
+        self._resolve_user()
+        if not self.user_id:
+            self.chat_names = []
+            self.messages = []
+            return
+        logger.debug("Loading sessions for user: %s", self.user_id)
+        store = get_history_store()
         try:
             # Query DynamoDB for all items with the user's ID
             response = chat_table.query(
@@ -422,7 +1167,7 @@ class State(rx.State):
                 ExpressionAttributeValues={":uid": self.user_id}
             )
             items = response.get("Items", [])
-            logger.debug(f"DynamoDB query response: {items}")
+            logger.debug("DynamoDB query returned %d session items", len(items))
 
             if not items:
                 # No sessions found, initialize with default "Intros" chat
@@ -430,272 +1175,98 @@ class State(rx.State):
                 if not bedrock_allowed():
                     logger.debug("Bedrock disabled in this environment; skipping bedrock client init during load_session")
                 session_id = f"Session#{datetime.utcnow().isoformat()}Z"
-                self.chats["Intros"] = [QA(question="", answer="")]
-                self.session_ids["Intros"] = session_id
-                logger.info(f"Created default 'Intros' session for user {self.user_id}")
+                self.chat_names = [DEFAULT_CHAT]
+                self.current_chat = DEFAULT_CHAT
+                # Nothing is stored until the first question: store positions must match persisted ones
+                store.replace(self.user_id, DEFAULT_CHAT, [])
+                self.session_ids[DEFAULT_CHAT] = session_id
+                logger.info("Created default 'Intros' session for user %s", self.user_id)
             else:
-                # Load existing sessions
-                self.chats = {}
-                self.session_ids = {}
-                for item in items:
-                    chat_name = item["chat_name"]
-                    session_id = item["session_id"]
-                    messages = item.get("messages", [])
-                    # Avoid duplicate chat names by appending session_id if needed
-                    unique_chat_name = chat_name if chat_name not in self.chats else f"{chat_name}_{session_id}"
-                    self.chats[unique_chat_name] = [QA(question=m["question"], answer=m["answer"]) for m in messages]
-                    self.session_ids[unique_chat_name] = session_id
-                self.chats = {}
+                # Load existing sessions into the server-side store; State keeps only names
+                chat_names = []
                 self.session_ids = {}
+                self.archived_chats = []
+                self._summaries = {}
+                writer = get_chat_writer()
+                search_index = get_chat_search()
                 for item in items:
                     chat_name = item["chat_name"]
                     session_id = item["session_id"]
-                    messages = item.get("messages", [])
+                    # Include messages accepted but not yet flushed by the write-behind queue
+                    messages = decode_messages(item) + writer.pending_messages(self.user_id, session_id)
                     # Avoid duplicate chat names by appending session_id if needed
-                    unique_chat_name = chat_name if chat_name not in self.chats else f"{chat_name}_{session_id}"
-                    self.chats[unique_chat_name] = [QA(question=m["question"], answer=m["answer"]) for m in messages]
+                    unique_chat_name = chat_name if chat_name not in chat_names else f"{chat_name}_{session_id}"
+                    store.replace(self.user_id, unique_chat_name, [{"question": m["question"], "answer": m["answer"]} for m in messages])
+                    chat_names.append(unique_chat_name)
                     self.session_ids[unique_chat_name] = session_id
-                    logger.debug(f"Loaded chat '{unique_chat_name}' with {len(messages)} messages")
-                self.current_chat = list(self.chats.keys())[0]  # Set to first chat
-                logger.info(f"Loaded sessions for user {self.user_id}: {list(self.chats.keys())}")
-
-            # Ensure UI updates with loaded data
-            self.chats = self.chats
+                    if search_index.rebuild_on_load:
+                        search_index.replace_session(self.user_id, session_id, messages)
+                    if is_archived(item):
+                        self.archived_chats.append(unique_chat_name)
+                    self._summaries[unique_chat_name] = {
+                        "text": item.get("summary", ""),
+                        "turns": int(item.get("summary_turns", 0)),
+                    }
+                    logger.debug("Loaded chat '%s' with %s messages", unique_chat_name, len(messages))
+                self.chat_names = chat_names
+                self.current_chat = chat_names[0]  # Set to first chat
+                if self.current_chat in self.archived_chats:
+                    self._rehydrate_chat(self.current_chat)
+                logger.info("Loaded sessions for user %s: %s", self.user_id, chat_names)
+
+            self._load_window()
         except ClientError as e:
-            logger.error(f"DynamoDB error: {str(e)}")
-            self.chats = DEFAULT_CHATS.copy()
-            self.current_chat = "Intros"
+            logger.error("DynamoDB error: %s", str(e))
+            self._reset_to_default_chat()
             self.session_ids = {"Intros": f"Session#{datetime.utcnow().isoformat()}Z"}
         except Exception as e:
-            logger.error(f"Unexpected error loading sessions: {str(e)}")
-            self.chats = DEFAULT_CHATS.copy()
-            self.current_chat = "Intros"
+            logger.error("Unexpected error loading sessions: %s", str(e))
+            self._reset_to_default_chat()
             self.session_ids = {"Intros": f"Session#{datetime.utcnow().isoformat()}Z"}
 
     async def get_knowledge_base(self) -> str:
         """Retrieve content from all files under the specified S3 prefix."""
-        # Build S3 client honoring endpoint (prefer helper so endpoint handling is consistent)
-        s3_client = make_client('s3', region=os.getenv('AWS_DEFAULT_REGION', aws_region))
-        bucket_name = os.getenv("S3_BUCKET_NAME")
-        prefix = os.getenv("S3_OBJECT_NAME", "")
-
-        if not bucket_name:
-            logger.error("S3_BUCKET_NAME not set in environment variables.")
-            return "No S3 bucket configured."
-
-        if not prefix:
-            logger.debug("S3_OBJECT_NAME not set; fetching from bucket root.")
-
-        knowledge_base = []
-        tried_prefixes = []
-        # Try several prefix variants to handle nested folder keys
-        if prefix:
-            tried_prefixes = [prefix, prefix.rstrip('/') + '/']
-        else:
-            tried_prefixes = ['']
-
-        found_keys = []
-        try:
-            for p in tried_prefixes:
-                if p in found_keys:
-                    continue
-                try:
-                    resp = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=p)
-                except Exception as e:
-                    logger.debug(f"list_objects_v2 failed for prefix '{p}': {e}")
-                    continue
-                contents = resp.get('Contents', [])
-                for obj in contents:
-                    k = obj.get('Key')
-                    if k and k not in found_keys:
-                        found_keys.append(k)
-
-            # As a fallback, if no keys found for the prefixes, list all and filter contains
-            if not found_keys:
-                resp = s3_client.list_objects_v2(Bucket=bucket_name)
-                for obj in resp.get('Contents', []):
-                    k = obj.get('Key')
-                    if k and (not prefix or prefix in k):
-                        found_keys.append(k)
-
-            if not found_keys:
-                return f"No files found under '{prefix}' in S3 bucket {bucket_name}."
-
-            for key in found_keys:
-                try:
-                    file_response = s3_client.get_object(Bucket=bucket_name, Key=key)
-                    content = file_response['Body'].read().decode('utf-8', errors='replace')
-                    knowledge_base.append(f"File: {key}\n{content}")
-                except Exception as e:
-                    logger.error(f"Error fetching {key} from S3: {e}")
-        except Exception as e:
-            logger.error(f"Error accessing S3 bucket {bucket_name} with prefix {prefix}: {e}")
-            return "Error accessing S3 bucket."
-
-        return "\n\n".join(knowledge_base) if knowledge_base else "No knowledge base available."
+        return await asyncio.to_thread(_load_knowledge_base)
 
     async def find_relevant_snippet(self, question: str, max_chars: int = 800) -> str:
-        """Find the most relevant S3 document for the question and return an excerpt.
+        """Excerpt of the best matching document(s); see ``_find_relevant_snippet``."""
+        return await asyncio.to_thread(_find_relevant_snippet, question, max_chars)
 
-        This is a cheap local fallback when Bedrock is disabled. It lists objects in
-        the configured S3 bucket, caches their contents in memory, scores them by
-        simple token overlap with the question, and returns a small excerpt from
-        the best matching document.
-        """
-        bucket_name = os.getenv("S3_BUCKET_NAME")
-        prefix = os.getenv("S3_OBJECT_NAME", "")
-        if not bucket_name:
-            logger.error("S3_BUCKET_NAME not set in environment variables.")
-            return "No S3 bucket configured."
-
-        # Use the consistent client factory (respects AWS_ENDPOINT_URL)
-        s3_client = make_client('s3', region=os.getenv('AWS_DEFAULT_REGION', aws_region))
-
-        # Build candidate key list by trying prefix variants and then a filtered full list
-        candidate_keys = []
-        tried_prefixes = [p for p in ([prefix, prefix.rstrip('/') + '/'] if prefix else ['']) if p]
-
-        try:
-            for p in tried_prefixes:
-                try:
-                    resp = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=p)
-                except Exception as e:
-                    logger.debug(f"list_objects_v2 failed for prefix '{p}': {e}")
-                    continue
-                for obj in resp.get('Contents', []):
-                    k = obj.get('Key')
-                    if k and k not in candidate_keys:
-                        candidate_keys.append(k)
-
-            if not candidate_keys:
-                # Fallback: list all and include keys that contain the prefix as substring
-                resp = s3_client.list_objects_v2(Bucket=bucket_name)
-                for obj in resp.get('Contents', []):
-                    k = obj.get('Key')
-                    if k and (not prefix or prefix in k) and k not in candidate_keys:
-                        candidate_keys.append(k)
-
-            if not candidate_keys:
-                return f"(Local mock) Bedrock is disabled in this environment. No relevant files found in bucket {bucket_name}."
-
-            question_tokens = _tokenize(question)
-            # Detect date-like tokens in the question to boost documents that contain those strings
-            date_matches = re.findall(r"\b(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}[/-]\d{1,2}[/-]\d{1,2})\b", question)
-
-            scored = []
-            for key in candidate_keys:
-                cache_key = f"{bucket_name}/{key}"
-                if cache_key not in _s3_doc_cache:
-                    try:
-                        file_response = s3_client.get_object(Bucket=bucket_name, Key=key)
-                        content = file_response['Body'].read().decode('utf-8', errors='replace')
-                        _s3_doc_cache[cache_key] = content
-                    except Exception as e:
-                        logger.error(f"Error fetching {key} from S3 for local retrieval: {e}")
-                        _s3_doc_cache[cache_key] = ""
-
-                doc_text = _s3_doc_cache.get(cache_key, "")
-                doc_tokens = _tokenize(doc_text)
-                base_score = _score_document(question_tokens, doc_tokens)
-
-                # Boost if any detected date token appears verbatim in the document
-                boost = 0.0
-                for d in date_matches:
-                    if d in doc_text:
-                        boost += 2.0
-
-                final_score = base_score + boost
-                scored.append((final_score, key))
-
-            # Sort descending
-            scored.sort(key=lambda x: x[0], reverse=True)
-
-            best_score, best_key = scored[0]
-
-            # If best score is very small, return top-3 summaries instead of a single tiny match
-            if best_score < 0.05:
-                top_n = [k for s, k in scored[:3] if s > 0]
-                if not top_n:
-                    # No substantive overlap; return a short bucket listing
-                    return f"(Local mock) Bedrock is disabled in this environment. Found files: {', '.join(candidate_keys[:10])}"
-                excerpts = []
-                for k in top_n:
-                    text = _s3_doc_cache.get(f"{bucket_name}/{k}", "").strip()[:max_chars]
-                    excerpts.append(f"File: {k}\n{text}")
-                return "\n\n---\n\n".join(excerpts)
-
-            # Return an excerpt from the best document
-            excerpt_text = _s3_doc_cache.get(f"{bucket_name}/{best_key}", "").strip()
-            excerpt_text = excerpt_text[:max_chars]
-            return f"File: {best_key}\n{excerpt_text}"
-
-        except Exception as e:
-            logger.error(f"Error during local S3 retrieval: {e}")
-            return "Error accessing S3 during local retrieval."
-    
     async def bedrock_process_question(self, question: str):
         """Get the response from AWS Bedrock using uploaded resources as knowledge base."""
         qa = QA(question=question, answer="")
-        self.chats[self.current_chat].append(qa)
+        self._append_visible(qa)
+        position = get_history_store().append(self.user_id, self.current_chat, qa.dict())
         self.processing = True
         yield
 
-        # Fetch knowledge base from uploaded files
-        knowledge_base = await self.get_knowledge_base()
-
-        # Build the prompt with the knowledge base
-        prompt = (
-            "You are a helpful assistant. Use the following information as your knowledge base "
-            "to answer the question. If the information below is insufficient, say so and do not "
-            "rely on pretrained data.\n\n"
-            "Human: Here is the knowledge base:\n"
-            f"{knowledge_base}\n\n"
-            f"Now, please answer this question: {question}\n\n"
-            "Assistant:"
+        context = self._conversation_context(position)
+        plan = _route_question(question, context)
+        flight, _ = get_question_flights().join(
+            _question_key(question, context, plan), lambda f: self._compute_answer(question, f, context, plan)
         )
+        async for queue_position in flight.wait_done():
+            self.queue_position = queue_position
+            yield
+        self.queue_position = 0
+        try:
+            answer = flight.future.result()
+        except Exception as e:
+            logger.error("Error calling AWS Bedrock: %s", e)
+            answer = "Sorry, I encountered an error while processing your request."
 
-        # If Bedrock is disabled (LocalStack/dev), return a mock answer to keep UI responsive
-        if not bedrock_allowed():
-            logger.info("Bedrock disabled or running against LocalStack — returning mock answer from bedrock_process_question")
-            snippet = await self.find_relevant_snippet(question)
-            answer = (
-                "(Local mock) Bedrock is disabled in this environment. "
-                f"Here's the most relevant excerpt I found:\n{snippet}"
-            ).strip()
-        else:
-            # Initialize the Bedrock Runtime client using make_client so endpoint_url is honored
-            client = make_client("bedrock-runtime", region=os.getenv('AWS_DEFAULT_REGION', 'us-east-1'))
-
-            # Define the model ID
-            model_id = "anthropic.claude-v2"  # Replace with your desired model ID
-
-            # Prepare the request body
-            body = json.dumps({
-                "prompt": prompt,
-                "max_tokens_to_sample": 2000,
-                "temperature": 0.7,
-            })
-
-            try:
-                # Invoke the Bedrock model
-                response = client.invoke_model(
-                    modelId=model_id,
-                    body=body,
-                    contentType="application/json",
-                    accept="application/json"
-                )
-                response_body = json.loads(response["body"].read())
-                answer = response_body.get("completion", "").strip()
-            except Exception as e:
-                logger.error(f"Error calling AWS Bedrock: {e}")
-                answer = "Sorry, I encountered an error while processing your request."
-
-        self.chats[self.current_chat][-1].answer = answer
-        self.chats = self.chats
+        qa = QA(question=question, answer=answer)
+        try:
+            get_history_store().set(self.user_id, self.current_chat, position, qa.dict())
+        except Exception as e:
+            logger.error("Failed to store the answer in the chat history: %s", e, exc_info=True)
+        if self.messages:
+            self.messages[-1] = qa
         self.processing = False
         yield
 
     @rx.event
+    @profiled
     async def handle_upload(self, files: List[rx.UploadFile]):
         logger.debug("handle_upload called with files: %s", files)
         if not files:
@@ -712,42 +1283,48 @@ class State(rx.State):
             file = files[0]  # Only one file due to max_files=1
             clean_filename = file.filename.lstrip("./")  # Remove ./ from filename
             object_name = f"{object_prefix}{clean_filename}"
-            logger.debug(f"Uploading to S3 with bucket: {bucket_name}, object_name: {object_name}")
-            
-            # Read file content
-            content = await file.read()
-            logger.debug(f"File content length: {len(content)} bytes")  # Log content length
+            logger.debug("Uploading to S3 with bucket: %s, object_name: %s", bucket_name, object_name)
             
-            if not content:
+            # Hash while reading so identical content is never uploaded twice
+            digest, size, body = await hash_upload(file)
+            logger.debug("File content length: %s bytes, sha256 %s", size, digest)
+
+            if not size:
+                body.close()
                 logger.error("File content is empty after reading")
                 self.upload_error = "File appears to be empty"
                 self.uploading = False
                 return
 
-            # Use boto3 directly to upload the content
             s3_client = boto3.client('s3')
-            s3_client.put_object(
-                Bucket=bucket_name,
-                Key=object_name,
-                Body=content
-            )
-            
-            self.total_bytes += len(content)
-            self.uploaded_files.append(object_name)
-            self.uploaded_files = self.uploaded_files  # Trigger state update
-            logger.info(f"Successfully uploaded {file.filename} to S3 at {object_name} with {len(content)} bytes")
+            try:
+                result = store_upload(s3_client, bucket_name, object_name, body, digest, size)
+            finally:
+                body.close()
+
+            if result["status"] == "stored":
+                # Only new bytes change the corpus; unchanged content keeps the cached documents and ANN index
+                _s3_doc_cache.pop(f"{bucket_name}/{object_name}", None)
+                _ann_state["keys"] = None
+                _dedupe_state["keys"] = None
+                _facet_state["keys"] = None
+                _prefetcher.clear()
+                self.total_bytes += size
+            # Keep only recent uploads: the whole State is serialized to Redis on every event
+            self.uploaded_files = (self.uploaded_files + [object_name])[-MAX_UPLOADED_FILES_IN_STATE:]
+            logger.info("Upload of %s to %s: %s (%s bytes, stored as %s)", file.filename, object_name, result['status'], size, result['key'])
             self.upload_error = ""
             self.uploading = False
             return rx.redirect("/")  # Redirect on success
         except Exception as e:
-            logger.error(f"Upload failed: {str(e)}", exc_info=True)
+            logger.error("Upload failed: %s", str(e), exc_info=True)
             self.upload_error = f"Upload failed: {str(e)}"
             self.uploading = False
             return
 
     def handle_upload_progress(self, progress: dict):
         """Update progress during upload."""
-        logger.debug("Upload progress: %s", progress)
+        logger.debug("Upload progress: %s", progress, extra=sampled(UPLOAD_PROGRESS_LOG_EVERY))
         self.uploading = True
         self.progress = round(progress["progress"] * 100)
         if self.progress >= 100:
@@ -0,0 +1,263 @@
+"""Bulk NDJSON export and import of ``ChatSession`` items.
+
+Each line is one session::
+
+    {"user_id": ..., "session_id": ..., "chat_name": ..., "updated_at": ...,
+     "summary": ..., "summary_turns": ..., "messages": [{"question", "answer"}, ...]}
+
+Messages are always written decoded, so a dump can be loaded into a table that
+uses a different ``CHAT_MESSAGE_CODEC``. Archived sessions either get their
+messages inlined from S3 (when an S3 client is given) or keep their
+``archive`` pointer.
+
+Both directions hold at most a few pages in memory. Export pages through
+``query`` (one user) or ``scan`` (whole table). Import groups sessions into
+``BatchWriteItem`` requests of 25 that run on a thread pool, with a bounded
+number in flight. Unprocessed items and throttling errors are retried with
+exponential backoff. Imported items overwrite sessions with the same key.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from botocore.exceptions import ClientError
+
+from Cloud_Kinetics import metrics
+from Cloud_Kinetics.chat.archive import decode_ndjson, is_archived
+from Cloud_Kinetics.chat.codec import configured_codec, decode_messages, encode_messages
+
+logger = logging.getLogger(__name__)
+
+transfer_sessions = metrics.counter("chat_transfer_sessions_total", "Sessions exported/imported by direction")
+transfer_retries = metrics.counter("chat_transfer_batch_retries_total", "BatchWriteItem retries by reason")
+
+Message = Dict[str, str]
+
+BATCH_SIZE = 25  # BatchWriteItem limit
+MAX_ATTEMPTS = int(os.getenv("CHAT_TRANSFER_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_S = 0.05
+BACKOFF_CAP_S = 5.0
+_RETRYABLE = ("ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded", "InternalServerError")
+_COPIED = ("chat_name", "updated_at", "summary", "summary_turns")
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _iter_items(table, user_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    kwargs: Dict[str, Any] = {}
+    if user_id:
+        kwargs = {"KeyConditionExpression": "user_id = :uid", "ExpressionAttributeValues": {":uid": user_id}}
+    while True:
+        response = table.query(**kwargs) if user_id else table.scan(**kwargs)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def session_record(item: Dict[str, Any], s3_client=None) -> Dict[str, Any]:
+    """Portable form of one ChatSession item."""
+    record: Dict[str, Any] = {"user_id": item["user_id"], "session_id": item["session_id"]}
+    record.update({k: item[k] for k in _COPIED if k in item})
+    messages = decode_messages(item)
+    if is_archived(item):
+        pointer = item["archive"]
+        if s3_client is not None:
+            archived = s3_client.get_object(Bucket=pointer["bucket"], Key=pointer["key"])["Body"].read()
+            messages = decode_ndjson(archived) + messages
+        else:
+            record["archive"] = pointer
+    record["messages"] = messages
+    return record
+
+
+def export_lines(table, user_id: Optional[str] = None, s3_client=None) -> Iterator[str]:
+    """NDJSON lines (with trailing newline) for every session of ``user_id``, or of the whole table."""
+    for item in _iter_items(table, user_id):
+        yield json.dumps(session_record(item, s3_client), ensure_ascii=False, separators=(",", ":"), default=_json_default) + "\n"
+        transfer_sessions.inc(direction="export")
+
+
+def session_item(record: Dict[str, Any], codec: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+    """ChatSession item for an exported record, storing messages with ``codec``."""
+    if not record.get("session_id"):
+        raise ValueError("record has no session_id")
+    item: Dict[str, Any] = {"user_id": user_id or record["user_id"], "session_id": record["session_id"]}
+    item.update({k: record[k] for k in _COPIED if k in record})
+    item.setdefault("chat_name", "")
+    if "archive" in record:
+        item["archive"] = record["archive"]
+    messages = [{"question": m["question"], "answer": m["answer"]} for m in record.get("messages", [])]
+    if messages:
+        if codec == "none":
+            item["messages"] = messages
+        else:
+            item["message_blobs"] = [encode_messages(messages, codec)]
+    return item
+
+
+class BatchImporter:
+    """Parallel BatchWriteItem loader for one table."""
+
+    def __init__(self, dynamodb, table_name: str, workers: int = 8, max_attempts: int = MAX_ATTEMPTS):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.stats = {"batches": 0, "retries": 0, "failed_items": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, **deltas: int) -> None:
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def write_batch(self, items: List[Dict[str, Any]]) -> None:
+        requests = [{"PutRequest": {"Item": item}} for item in items]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = self.dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+                requests = response.get("UnprocessedItems", {}).get(self.table_name, [])
+                reason = "unprocessed"
+            except ClientError as e:
+                reason = e.response.get("Error", {}).get("Code", "")
+                if reason not in _RETRYABLE:
+                    raise
+            if not requests:
+                self._count(batches=1)
+                return
+            if attempt < self.max_attempts:
+                self._count(retries=1)
+                transfer_retries.inc(reason=reason)
+                # Full jitter keeps parallel workers from retrying in lockstep
+                time.sleep(random.uniform(0, min(BACKOFF_CAP_S, BACKOFF_BASE_S * 2 ** (attempt - 1))))
+        self._count(batches=1, failed_items=len(requests))
+        logger.error("Giving up on %s item(s) for %s after %s attempts", len(requests), self.table_name, self.max_attempts)
+
+    def run(self, items: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """Write all items; at most ``2 * workers`` batches are buffered at once."""
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        errors: List[Exception] = []
+
+        def submit(pool: ThreadPoolExecutor, batch: List[Dict[str, Any]]) -> None:
+            slots.acquire()
+            future = pool.submit(self.write_batch, batch)
+
+            def done(f) -> None:
+                slots.release()
+                if f.exception() is not None:
+                    errors.append(f.exception())
+
+            future.add_done_callback(done)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chat-import") as pool:
+            batch: List[Dict[str, Any]] = []
+            keys = set()
+            for item in items:
+                if errors:
+                    break
+                key = (item["user_id"], item["session_id"])
+                # A batch may not contain the same key twice
+                if len(batch) == BATCH_SIZE or key in keys:
+                    submit(pool, batch)
+                    batch, keys = [], set()
+                batch.append(item)
+                keys.add(key)
+            if batch and not errors:
+                submit(pool, batch)
+        if errors:
+            raise errors[0]
+        return dict(self.stats)
+
+
+def import_lines(
+    dynamodb,
+    table_name: str,
+    lines: Iterable[Any],
+    user_id: Optional[str] = None,
+    workers: int = 8,
+    codec: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Load NDJSON sessions into ``table_name``.
+
+    ``user_id`` forces every session into that partition (used by the HTTP
+    endpoint, where callers may only import their own chats). Blank lines are
+    skipped; malformed lines are counted and logged.
+    """
+    codec = codec or configured_codec()
+    stats: Dict[str, Any] = {"sessions": 0, "messages": 0, "invalid_lines": 0}
+    start = time.monotonic()
+
+    def items() -> Iterator[Dict[str, Any]]:
+        for number, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line, parse_float=Decimal)
+                item = session_item(record, codec, user_id)
+            except (ValueError, KeyError, TypeError) as e:
+                stats["invalid_lines"] += 1
+                logger.warning("Skipping invalid NDJSON line %s: %s", number, e)
+                continue
+            stats["sessions"] += 1
+            stats["messages"] += len(record.get("messages", []))
+            transfer_sessions.inc(direction="import")
+            yield item
+
+    stats.update(BatchImporter(dynamodb, table_name, workers=workers).run(items()))
+    stats["seconds"] = round(time.monotonic() - start, 3)
+    stats["messages_per_s"] = round(stats["messages"] / stats["seconds"]) if stats["seconds"] else 0
+    return stats
+
+
+def synthetic_lines(messages: int, per_session: int = 100, seed: int = 7) -> Iterator[str]:
+    """NDJSON sessions with ``messages`` messages in total, generated lazily."""
+    rng = random.Random(seed)
+    topics = ["ECS service", "S3 bucket policy", "DynamoDB capacity", "Bedrock model access", "CloudFormation stack"]
+    for session in range(0, messages, per_session):
+        history = []
+        for i in range(min(per_session, messages - session)):
+            topic = rng.choice(topics)
+            history.append({
+                "question": f"How do I troubleshoot the {topic} issue we saw in step {i}?",
+                "answer": f"To troubleshoot the {topic}, review the configuration and the CloudWatch logs. " * rng.randint(1, 4),
+            })
+        record = {
+            "user_id": f"bench#{session // (per_session * 50)}",
+            "session_id": f"Session#bench-{session // per_session:08d}",
+            "chat_name": f"Bench {session // per_session}",
+            "messages": history,
+        }
+        yield json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def benchmark(dynamodb, table, messages: int, per_session: int = 100, workers: int = 8) -> Dict[str, Any]:
+    """Import then export a synthetic dataset and report throughput of both directions."""
+    imported = import_lines(dynamodb, table.name, synthetic_lines(messages, per_session), workers=workers)
+    start = time.monotonic()
+    exported_sessions = exported_bytes = 0
+    for line in export_lines(table):
+        exported_sessions += 1
+        exported_bytes += len(line)
+    seconds = time.monotonic() - start
+    return {
+        "import": imported,
+        "export": {
+            "sessions": exported_sessions,
+            "bytes": exported_bytes,
+            "seconds": round(seconds, 3),
+            "messages_per_s": round(imported["messages"] / seconds) if seconds else 0,
+        },
+    }
@@ -0,0 +1,192 @@
+"""Content-addressed deduplication for knowledge-base uploads.
+
+Uploads are hashed (sha256) while they are streamed to a spool file. The hash
+is looked up in a small JSON manifest kept in the bucket, and each stored
+object carries it as ``x-amz-meta-sha256``. Then:
+
+* same name, same content - nothing is written (``unchanged``);
+* new name, content already stored under another key - only a filename alias is
+  added to the manifest (``alias``);
+* anything else - the object is uploaded and the manifest updated (``stored``).
+
+Only ``stored`` changes the corpus, so only it should invalidate retrieval
+caches or lead to a reindex. Manifest writes are conditional on its ETag and
+retried on conflict, so concurrent uploads from several tasks don't lose
+entries.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from Cloud_Kinetics import metrics
+
+logger = logging.getLogger(__name__)
+
+uploads_total = metrics.counter("kb_uploads_total", "Knowledge-base uploads by outcome")
+upload_bytes_skipped = metrics.counter("kb_upload_bytes_skipped_total", "Upload bytes not written because the content was already stored")
+
+READ_CHUNK_BYTES = 1024 * 1024
+# Uploads up to this size stay in memory while hashing; larger ones spill to disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+MANIFEST_ATTEMPTS = 5
+HASH_METADATA = "sha256"
+
+
+def manifest_key() -> str:
+    return os.getenv("UPLOAD_MANIFEST_KEY", "_meta/upload-manifest.json")
+
+
+def is_manifest_key(key: str) -> bool:
+    return key == manifest_key()
+
+
+def _reserved_prefixes() -> Tuple[str, ...]:
+    # Archived chats are private to their user, and published snapshots would change the corpus fingerprint
+    # on every publish; older versions wrote both to the corpus bucket by default
+    return tuple(
+        prefix.strip("/") + "/"
+        for prefix in (os.getenv("CHAT_ARCHIVE_PREFIX", "chat-archive"), os.getenv("INDEX_SNAPSHOT_PREFIX", "index"))
+    )
+
+
+def is_corpus_key(key: str) -> bool:
+    """False for objects the app keeps next to the documents: the upload manifest, archived chats and index snapshots."""
+    return not is_manifest_key(key) and not key.startswith(_reserved_prefixes())
+
+
+async def hash_upload(file) -> Tuple[str, int, Any]:
+    """Read an upload in chunks, hashing it as it goes.
+
+    Returns ``(sha256 hex, size, spool)``. The spool is rewound and ready to
+    be used as an upload body; the caller closes it.
+    """
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    size = 0
+    while True:
+        chunk = await file.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        digest.update(chunk)
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return digest.hexdigest(), size, spool
+
+
+def _empty_manifest() -> Dict[str, Any]:
+    return {"version": 1, "objects": {}, "aliases": {}}
+
+
+def load_manifest(s3_client, bucket: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    """The manifest and its ETag; an empty manifest and None if there isn't one yet."""
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=manifest_key())
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return _empty_manifest(), None
+        raise
+    manifest = json.loads(response["Body"].read().decode("utf-8"))
+    manifest.setdefault("objects", {})
+    manifest.setdefault("aliases", {})
+    return manifest, response.get("ETag")
+
+
+def _save_manifest(s3_client, bucket: str, manifest: Dict[str, Any], etag: Optional[str]) -> None:
+    kwargs: Dict[str, Any] = {
+        "Bucket": bucket,
+        "Key": manifest_key(),
+        "Body": json.dumps(manifest, sort_keys=True).encode("utf-8"),
+        "ContentType": "application/json",
+    }
+    # Optimistic concurrency: fail if another task changed (or created) the manifest meanwhile
+    if etag:
+        kwargs["IfMatch"] = etag
+    else:
+        kwargs["IfNoneMatch"] = "*"
+    s3_client.put_object(**kwargs)
+
+
+def _conflict(e: ClientError) -> bool:
+    return e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+
+
+def _object_metadata(s3_client, bucket: str, key: str) -> Optional[Dict[str, str]]:
+    """User metadata of an existing object, or None if there is no such object."""
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key).get("Metadata", {})
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound"):
+            return None
+        raise
+
+
+def _update_manifest(s3_client, bucket: str, change) -> Dict[str, Any]:
+    """Apply ``change(manifest)`` with read-modify-write, retrying on conflicts."""
+    for attempt in range(1, MANIFEST_ATTEMPTS + 1):
+        manifest, etag = load_manifest(s3_client, bucket)
+        change(manifest)
+        try:
+            _save_manifest(s3_client, bucket, manifest, etag)
+            return manifest
+        except ClientError as e:
+            if not _conflict(e) or attempt == MANIFEST_ATTEMPTS:
+                raise
+            logger.info("Upload manifest changed concurrently; retrying (%s/%s)", attempt, MANIFEST_ATTEMPTS)
+    return manifest
+
+
+def store_upload(s3_client, bucket: str, object_name: str, body, digest: str, size: int) -> Dict[str, Any]:
+    """Upload ``body`` to ``object_name`` unless the same bytes are already stored.
+
+    Returns ``{"status": "stored" | "alias" | "unchanged", "key": <canonical key>, ...}``.
+    """
+    now = f"{datetime.utcnow().isoformat()}Z"
+    manifest, _ = load_manifest(s3_client, bucket)
+    target = _object_metadata(s3_client, bucket, object_name)
+    canonical = None
+    if target is not None:
+        # The name is taken: skip only if it already holds these bytes, otherwise replace it
+        if target.get(HASH_METADATA) == digest:
+            canonical = object_name
+    else:
+        entry = manifest["objects"].get(digest)
+        # Trust the manifest only while the object it names still holds those bytes
+        if entry and (_object_metadata(s3_client, bucket, entry["key"]) or {}).get(HASH_METADATA) == digest:
+            canonical = entry["key"]
+
+    if canonical is not None:
+        status = "unchanged" if canonical == object_name or manifest["aliases"].get(object_name) == digest else "alias"
+
+        def record(m: Dict[str, Any]) -> None:
+            m["objects"].setdefault(digest, {"key": canonical, "size": size, "stored_at": now})
+            if canonical != object_name:
+                m["aliases"][object_name] = digest
+
+        if status == "alias" or digest not in manifest["objects"]:
+            _update_manifest(s3_client, bucket, record)
+        uploads_total.inc(outcome=status)
+        upload_bytes_skipped.inc(size)
+        logger.info("Upload of %s (%s bytes) is already stored as %s; not re-uploading (%s)", object_name, size, canonical, status)
+        return {"status": status, "key": canonical, "sha256": digest, "size": size}
+
+    s3_client.put_object(Bucket=bucket, Key=object_name, Body=body, Metadata={HASH_METADATA: digest})
+
+    def record_new(m: Dict[str, Any]) -> None:
+        # The key now holds new bytes: drop entries (and aliases) that pointed at its old content
+        stale = [h for h, e in m["objects"].items() if e["key"] == object_name and h != digest]
+        for h in stale:
+            del m["objects"][h]
+        m["aliases"] = {name: h for name, h in m["aliases"].items() if h not in stale and name != object_name}
+        m["objects"][digest] = {"key": object_name, "size": size, "stored_at": now}
+
+    _update_manifest(s3_client, bucket, record_new)
+    uploads_total.inc(outcome="stored")
+    logger.info("Stored %s (%s bytes, sha256 %s)", object_name, size, digest[:12])
+    return {"status": "stored", "key": object_name, "sha256": digest, "size": size}
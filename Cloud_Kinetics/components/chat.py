@@ -2,20 +2,31 @@ import reflex as rx
 import reflex_chakra as rc
 import logging
 from Cloud_Kinetics.components.loading_icon import loading_icon
+from Cloud_Kinetics.chat.prefetch import DEBOUNCE_MS as PREFETCH_DEBOUNCE_MS, prefetch_enabled
 from Cloud_Kinetics.chat.state import QA, State
 from Cloud_Kinetics.components.navbar import navbar
 
 message_style = dict(display="inline-block", padding="1em", border_radius="8px", max_width=["30em", "30em", "50em", "50em", "50em", "50em"])
 
+# Memoized so finalized messages aren't re-rendered as markdown when the window
+# changes; React only re-renders a bubble whose text actually changed.
+@rx.memo
+def question_bubble(text: rx.Var[str]) -> rx.Component:
+    return rx.markdown(text, background_color=rx.color("mauve", 4), color=rx.color("mauve", 12), **message_style)
+
+@rx.memo
+def answer_bubble(text: rx.Var[str]) -> rx.Component:
+    return rx.markdown(text, background_color=rx.color("accent", 4), color=rx.color("accent", 12), **message_style)
+
 def message(qa: QA) -> rx.Component:
     return rx.box(
         rx.box(
-            rx.markdown(qa.question, background_color=rx.color("mauve", 4), color=rx.color("mauve", 12), **message_style),
+            question_bubble(text=qa.question),
             text_align="right",
             margin_top="1em",
         ),
         rx.box(
-            rx.markdown(qa.answer, background_color=rx.color("accent", 4), color=rx.color("accent", 12), **message_style),
+            answer_bubble(text=qa.answer),
             text_align="left",
             padding_top="1em",
         ),
@@ -24,17 +35,43 @@ def message(qa: QA) -> rx.Component:
 
 def chat() -> rx.Component:
     return rx.vstack(
-        rx.box(rx.foreach(State.chats[State.current_chat], message), width="100%"),
+        rx.cond(
+            State.has_older,
+            rx.button("Load older messages", on_click=State.load_older, variant="ghost", size="1", align_self="center"),
+        ),
+        rx.cond(
+            State.message_count == 0,
+            rx.text("Ask a question to start this chat.", color=rx.color("mauve", 10), align_self="center"),
+        ),
+        rx.box(rx.foreach(State.messages, message), width="100%"),
+        rx.cond(
+            ~State.at_latest,
+            rx.button("Jump to latest", on_click=State.jump_to_latest, variant="soft", size="1", align_self="center"),
+        ),
+        id="chat-scroll",
+        # Only the rendered window lives in the DOM; scrolling near the top asks
+        # the backend for the previous page.
+        on_scroll=rx.call_script(
+            "document.getElementById('chat-scroll').scrollTop",
+            callback=State.on_chat_scroll,
+        ).throttle(300),
         py="8",
         flex="1",
         width="100%",
         max_width="50em",
         padding_x="4px",
         align_self="center",
-        overflow="hidden",
+        overflow_y="auto",
+        max_height="calc(100vh - 12em)",
         padding_bottom="5em",
     )
 
+def _prefetch_props() -> dict:
+    """Send the typed question to the server for speculative retrieval (RETRIEVAL_PREFETCH=1)."""
+    if not prefetch_enabled():
+        return {}
+    return {"on_change": State.prefetch_question.debounce(PREFETCH_DEBOUNCE_MS)}
+
 def action_bar() -> rx.Component:
     return rx.center(
         rx.vstack(
@@ -46,6 +83,7 @@ def action_bar() -> rx.Component:
                             placeholder="Type something...",
                             id="question",
                             width=["15em", "20em", "45em", "50em", "50em", "50em"],
+                            **_prefetch_props(),
                         ),
                         rx.button(
                             rx.cond(State.processing, loading_icon(height="1em"), rx.text("Send")),
@@ -58,6 +96,10 @@ def action_bar() -> rx.Component:
                 on_submit=State.process_question,
                 reset_on_submit=True,
             ),
+            rx.cond(
+                State.queue_position > 0,
+                rx.text(f"Waiting for the model: position {State.queue_position} in queue", font_size=".75em", color=rx.color("mauve", 11)),
+            ),
             rx.text("ReflexGPT may return factually incorrect or misleading responses. Use discretion.", text_align="center", font_size=".75em", color=rx.color("mauve", 10)),
             rx.logo(margin_top="-1em", margin_bottom="-1em"),
             align_items="center",
@@ -75,7 +117,6 @@ def action_bar() -> rx.Component:
     )
 
 def chat_page() -> rx.Component:
-    logging.basicConfig(level=logging.DEBUG)
     logger = logging.getLogger(__name__)
     logger.debug("Rendering chat page")
     return rx.vstack(
@@ -125,7 +125,50 @@
 #     )
 
 import reflex as rx
-from Cloud_Kinetics.chat.state import State
+from Cloud_Kinetics.chat.state import SearchHit, State
+
+def search_hit(hit: SearchHit) -> rx.Component:
+    """A chat history search result; opens its chat at the matching message."""
+    return rx.drawer.close(
+        rx.button(
+            rx.vstack(
+                rx.text(hit.snippet, size="2", text_align="left"),
+                rx.text(hit.chat_name, size="1", color=rx.color("mauve", 10)),
+                align_items="start",
+                spacing="0",
+            ),
+            on_click=lambda: State.open_search_hit(hit.chat_name, hit.position),
+            variant="ghost",
+            height="auto",
+            padding_y="0.5em",
+            width="100%",
+            justify_content="start",
+        )
+    )
+
+def chat_search() -> rx.Component:
+    return rx.vstack(
+        rx.form(
+            rx.hstack(
+                rx.input(placeholder="Search chats...", name="query", width="100%"),
+                rx.button(rx.icon(tag="search", size=16), type="submit", variant="surface"),
+                width="100%",
+            ),
+            on_submit=State.search_chats,
+            width="100%",
+        ),
+        rx.cond(
+            State.search_query != "",
+            rx.vstack(
+                rx.foreach(State.search_hits, search_hit),
+                rx.cond(State.search_hits.length() == 0, rx.text("No matching messages", size="1", color=rx.color("mauve", 10))),
+                rx.button("Clear search", on_click=State.clear_search, variant="ghost", size="1"),
+                align_items="stretch",
+                width="100%",
+            ),
+        ),
+        width="100%",
+    )
 
 def sidebar_chat(chat: str) -> rx.Component:
     """A sidebar chat item."""
@@ -160,6 +203,7 @@ def sidebar(trigger) -> rx.Component:
             rx.drawer.content(
                 rx.vstack(
                     rx.heading("Chats", color=rx.color("mauve", 11)),
+                    chat_search(),
                     rx.divider(),
                     rx.foreach(State.chat_titles, lambda chat: sidebar_chat(chat)),
                     align_items="stretch",
@@ -0,0 +1,132 @@
+"""Command line entry point: ``python -m Cloud_Kinetics.index <command>``."""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+
+def _bench(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.index.ann import benchmark
+
+    rows = benchmark(
+        n=args.n,
+        dim=args.dim,
+        queries=args.queries,
+        nlist=args.nlist,
+        nprobes=[int(p) for p in args.nprobe.split(",")],
+        rerank=args.rerank,
+    )
+    for row in rows:
+        print(json.dumps(row))
+    return 0
+
+
+def _build(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.aws import make_client
+    from Cloud_Kinetics.aws import list_objects
+    from Cloud_Kinetics.index.build import corpus_fingerprint, iter_documents
+    from Cloud_Kinetics.index.minhash import dedupe_documents
+    from Cloud_Kinetics.index.snapshot import SnapshotStore, publish_snapshot, write_snapshot
+
+    if not args.bucket:
+        logging.error("No bucket given; pass --bucket or set S3_BUCKET_NAME")
+        return 2
+    if args.publish and not args.publish_bucket:
+        # Not the corpus bucket by default: the snapshot would be listed as documents on the next build
+        logging.error("No snapshot bucket given; pass --publish-bucket or set INDEX_SNAPSHOT_BUCKET")
+        return 2
+    s3_client = make_client('s3')
+    fingerprint = corpus_fingerprint(s3_client, args.bucket, args.prefix)
+    current = SnapshotStore(args.out).current()
+    if not args.force and current is not None and current.meta.get("corpus") == fingerprint:
+        # Re-uploads of identical files leave every ETag as it was, so there is nothing to reindex
+        logging.info("Corpus unchanged since %s; skipping build (use --force to rebuild)", os.path.basename(current.path))
+        print(current.path)
+        return 0
+    documents, aliases = iter_documents(s3_client, args.bucket, args.prefix), {}
+    if not args.no_dedupe:
+        # Revised copies (v1/v2/final) collapse onto the most recently modified one
+        modified = {obj['Key']: obj.get('LastModified') for obj in list_objects(s3_client, args.bucket, args.prefix)}
+        documents, aliases = dedupe_documents(documents, modified, threshold=args.dedupe_threshold)
+    path = write_snapshot(
+        documents,
+        args.out,
+        with_vectors=not args.no_vectors,
+        meta={"bucket": args.bucket, "prefix": args.prefix, "corpus": fingerprint},
+        aliases=aliases,
+        dedupe_chunks=not args.no_dedupe,
+        external_text=args.external_text,
+    )
+    if args.publish:
+        publish_snapshot(s3_client, args.publish_bucket, args.publish_prefix, path)
+    print(path)
+    return 0
+
+
+def _facets(args: argparse.Namespace) -> int:
+    from Cloud_Kinetics.index.snapshot import SnapshotStore
+
+    snapshot = SnapshotStore(args.dir).current()
+    if snapshot is None or snapshot.facets is None:
+        logging.error("No snapshot with facet tables in %s", args.dir)
+        return 1
+    if args.question:
+        docs = snapshot.facets.match(args.question)
+        print(json.dumps({"filtered": docs is not None, "keys": [snapshot.docs[d]["key"] for d in sorted(docs or [])]}))
+    elif args.kind and args.value:
+        print(json.dumps([snapshot.docs[d]["key"] for d in snapshot.facets.docs(args.kind, args.value)]))
+    elif args.kind:
+        table = snapshot.facets.tables.get(args.kind, {})
+        print(json.dumps({value: len(ids) for value, ids in sorted(table.items())}))
+    else:
+        print(json.dumps(snapshot.facets.stats()))
+    return 0
+
+
+def main(argv=None) -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(prog="python -m Cloud_Kinetics.index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Build a versioned index snapshot from the S3 corpus")
+    build.add_argument("--bucket", default=os.getenv("S3_BUCKET_NAME"))
+    build.add_argument("--prefix", default=os.getenv("S3_OBJECT_NAME", ""))
+    build.add_argument("--out", default=os.getenv("INDEX_SNAPSHOT_DIR", ".index"), help="Snapshot directory")
+    build.add_argument("--no-vectors", action="store_true", help="Skip the int8 IVF vector sections")
+    build.add_argument("--no-dedupe", action="store_true", help="Index near-duplicate documents and chunks too")
+    build.add_argument("--dedupe-threshold", type=float, default=float(os.getenv("INDEX_DEDUPE_THRESHOLD", "0.85")),
+                       help="Estimated Jaccard similarity at which documents count as near-duplicates")
+    build.add_argument("--external-text", action="store_true", default=os.getenv("INDEX_EXTERNAL_TEXT", "0") == "1",
+                       help="Keep document text in a separate artifact that workers read by byte range")
+    build.add_argument("--force", action="store_true", help="Rebuild even if the corpus is unchanged")
+    build.add_argument("--publish", action="store_true", help="Upload the snapshot and CURRENT pointer to S3")
+    build.add_argument("--publish-bucket", default=os.getenv("INDEX_SNAPSHOT_BUCKET"))
+    build.add_argument("--publish-prefix", default=os.getenv("INDEX_SNAPSHOT_PREFIX", "index"))
+    build.set_defaults(func=_build)
+
+    bench = sub.add_parser("bench", help="Benchmark ANN recall@10 and memory per chunk on synthetic vectors")
+    bench.add_argument("--n", type=int, default=100000, help="Number of synthetic chunks")
+    bench.add_argument("--dim", type=int, default=256)
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--nlist", type=int, default=None, help="Number of IVF lists (default 4*sqrt(n))")
+    bench.add_argument("--nprobe", default="1,4,8,16,32", help="Comma-separated nprobe values to sweep")
+    bench.add_argument("--rerank", type=int, default=64, help="Candidates re-scored after the int8 scan")
+    bench.set_defaults(func=_bench)
+
+    facets = sub.add_parser("facets", help="Inspect the metadata facet tables of the current snapshot")
+    facets.add_argument("--dir", default=os.getenv("INDEX_SNAPSHOT_DIR", ".index"), help="Snapshot directory")
+    facets.add_argument("--kind", choices=["date", "path", "heading", "type"], help="List this kind's values and document counts")
+    facets.add_argument("--value", help="With --kind: the documents that have this value")
+    facets.add_argument("--question", help="Show which documents a question's date/path filters select")
+    facets.set_defaults(func=_facets)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
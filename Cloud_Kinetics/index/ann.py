@@ -0,0 +1,237 @@
+import logging
+import time
+from math import sqrt
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 quantization. Returns (codes, scales)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def exact_search(vectors: np.ndarray, query: np.ndarray, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+    """Brute-force inner-product search, used as the recall baseline."""
+    scores = np.asarray(vectors, dtype=np.float32) @ np.asarray(query, dtype=np.float32)
+    k = min(k, len(scores))
+    if k == 0:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return scores[top], top
+
+
+class IVFInt8Index:
+    """Inverted-file ANN index over int8-quantized vectors.
+
+    Vectors are clustered with spherical k-means into ``nlist`` lists. A query
+    scans the ``nprobe`` closest lists using the int8 codes, keeps the best
+    ``rerank`` candidates and, when the original float vectors are supplied
+    (typically a read-only memmap), re-scores them exactly. Vectors are expected
+    to be L2-normalised so inner product is cosine similarity.
+    """
+
+    def __init__(self, dim: int, nlist: int = 256, nprobe: int = 16, rerank: int = 64):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.centroids = np.zeros((0, dim), dtype=np.float32)
+        # Codes, scales and ids are stored grouped by list; list_offsets[i]:list_offsets[i+1]
+        # is the slice belonging to list i.
+        self.codes = np.zeros((0, dim), dtype=np.int8)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.uint32)
+        self.list_offsets = np.zeros(1, dtype=np.int64)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        codes: np.ndarray,
+        scales: np.ndarray,
+        ids: np.ndarray,
+        nprobe: int = 16,
+        rerank: int = 64,
+    ) -> "IVFInt8Index":
+        """Wrap prebuilt arrays (e.g. read-only views into a snapshot) without copying."""
+        index = cls(centroids.shape[1], nlist=len(centroids), nprobe=nprobe, rerank=rerank)
+        index.centroids = centroids
+        index.list_offsets = list_offsets
+        index.codes = codes
+        index.scales = scales
+        index.ids = ids
+        return index
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.ids.shape[0])
+
+    def memory_bytes(self) -> int:
+        return int(
+            self.centroids.nbytes + self.codes.nbytes + self.scales.nbytes
+            + self.ids.nbytes + self.list_offsets.nbytes
+        )
+
+    def _assign(self, vectors: np.ndarray, batch: int = 8192) -> np.ndarray:
+        out = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), batch):
+            block = np.asarray(vectors[start:start + batch], dtype=np.float32)
+            out[start:start + batch] = np.argmax(block @ self.centroids.T, axis=1)
+        return out
+
+    def train(self, vectors: np.ndarray, iters: int = 12, sample: int = 20000, seed: int = 0) -> None:
+        """Fit the coarse quantizer on (a sample of) the vectors."""
+        n = len(vectors)
+        if n == 0:
+            raise ValueError("Cannot train an index on zero vectors")
+        # Keep roughly 32+ points per list so small corpora don't get empty lists
+        nlist = max(1, min(self.nlist, n // 32 or 1))
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(n, size=min(sample, n), replace=False))
+        data = np.asarray(vectors[rows], dtype=np.float32)
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Reseed empty lists from random points rather than dropping them
+                sums[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        self.centroids = centroids
+        self.nlist = nlist
+        logger.debug("Trained IVF coarse quantizer with %d lists on %d vectors", nlist, len(data))
+
+    def build(self, vectors: np.ndarray, ids: Optional[Sequence[int]] = None) -> None:
+        """Assign, quantize and lay out all vectors. Trains first if needed."""
+        if len(self.centroids) == 0:
+            self.train(vectors)
+        n = len(vectors)
+        ids_arr = np.arange(n, dtype=np.uint32) if ids is None else np.asarray(ids, dtype=np.uint32)
+        assign = self._assign(vectors)
+        order = np.argsort(assign, kind="stable")
+        codes = np.empty((n, self.dim), dtype=np.int8)
+        scales = np.empty(n, dtype=np.float32)
+        # Quantize in blocks so a memmapped input never has to be fully materialised
+        for start in range(0, n, 8192):
+            block_rows = order[start:start + 8192]
+            c, s = quantize_int8(vectors[block_rows])
+            codes[start:start + len(block_rows)] = c
+            scales[start:start + len(block_rows)] = s
+        self.codes = codes
+        self.scales = scales
+        self.ids = ids_arr[order]
+        counts = np.bincount(assign, minlength=len(self.centroids))
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        nprobe: Optional[int] = None,
+        rerank: Optional[int] = None,
+        vectors: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (scores, ids) of the k best matches for a single query.
+
+        ``vectors`` are the original float vectors indexed by id; when given,
+        the top ``rerank`` approximate candidates are re-scored exactly.
+        """
+        if self.ntotal == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        q = np.asarray(query, dtype=np.float32)
+        nprobe = max(1, min(nprobe or self.nprobe, len(self.centroids)))
+        coarse = self.centroids @ q
+        probe = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+        cand = np.concatenate([
+            np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in probe
+        ])
+        if cand.size == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        approx = (self.codes[cand].astype(np.float32) @ q) * self.scales[cand]
+        r = min(max(k, rerank or self.rerank), cand.size)
+        best = np.argpartition(-approx, r - 1)[:r]
+        top_ids = self.ids[cand[best]].astype(np.int64)
+        if vectors is not None:
+            # Sorted ids keep memmap reads close to sequential
+            sort = np.argsort(top_ids)
+            top_ids = top_ids[sort]
+            scores = np.asarray(vectors[top_ids], dtype=np.float32) @ q
+        else:
+            scores = approx[best]
+        k = min(k, len(scores))
+        order = np.argsort(-scores)[:k]
+        return scores[order], top_ids[order]
+
+
+def _synthetic_vectors(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    # Clustered data is closer to real chunk embeddings than uniform noise
+    n_topics = max(16, n // 500)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    data = topics[rng.integers(0, n_topics, size=n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data
+
+
+def benchmark(
+    n: int = 100000,
+    dim: int = 256,
+    queries: int = 200,
+    nlist: Optional[int] = None,
+    nprobes: Sequence[int] = (1, 4, 8, 16, 32),
+    rerank: int = 64,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """Measure recall@10 against exact search and memory per chunk on synthetic data."""
+    rng = np.random.default_rng(seed)
+    data = _synthetic_vectors(n, dim, rng)
+    qs = data[rng.choice(n, size=queries, replace=False)] + 0.3 * rng.standard_normal((queries, dim)).astype(np.float32)
+    qs /= np.linalg.norm(qs, axis=1, keepdims=True)
+
+    t0 = time.perf_counter()
+    truth = [set(exact_search(data, q, 10)[1].tolist()) for q in qs]
+    exact_ms = (time.perf_counter() - t0) * 1000 / queries
+
+    index = IVFInt8Index(dim, nlist=nlist or int(4 * sqrt(n)), rerank=rerank)
+    t0 = time.perf_counter()
+    index.build(data)
+    build_s = time.perf_counter() - t0
+
+    rows = []
+    for nprobe in nprobes:
+        for exact_rerank in (False, True):
+            hits = 0
+            t0 = time.perf_counter()
+            for q, expected in zip(qs, truth):
+                _, ids = index.search(q, 10, nprobe=nprobe, vectors=data if exact_rerank else None)
+                hits += len(expected & set(ids.tolist()))
+            rows.append({
+                "nprobe": nprobe,
+                "rerank": "exact" if exact_rerank else "int8",
+                "recall@10": hits / (10 * queries),
+                "ms/query": (time.perf_counter() - t0) * 1000 / queries,
+            })
+    summary = {
+        "n": n,
+        "dim": dim,
+        "nlist": len(index.centroids),
+        "build_s": round(build_s, 2),
+        "exact_ms/query": round(exact_ms, 3),
+        "index_bytes/chunk": round(index.memory_bytes() / n, 1),
+        "float32_bytes/chunk": dim * 4,
+    }
+    return [summary] + rows
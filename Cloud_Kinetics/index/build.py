@@ -0,0 +1,30 @@
+import hashlib
+import logging
+from typing import Iterator, Tuple
+
+from Cloud_Kinetics.aws import list_keys, list_objects
+from Cloud_Kinetics.chat.uploads import is_corpus_key
+
+logger = logging.getLogger(__name__)
+
+
+def iter_documents(s3_client, bucket_name: str, prefix: str = "") -> Iterator[Tuple[str, str]]:
+    """Yield (key, text) for every object under the prefix, one at a time."""
+    for key in list_keys(s3_client, bucket_name, prefix):
+        if not is_corpus_key(key):
+            continue
+        try:
+            body = s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+        except Exception as e:
+            logger.error("Error fetching %s from S3 for indexing: %s", key, e)
+            continue
+        yield key, body.decode('utf-8', errors='replace')
+
+
+def corpus_fingerprint(s3_client, bucket_name: str, prefix: str = "") -> str:
+    """Digest of the (key, ETag) listing; unchanged when no document was added, removed or replaced."""
+    digest = hashlib.sha256()
+    for obj in sorted(list_objects(s3_client, bucket_name, prefix), key=lambda o: o['Key']):
+        if is_corpus_key(obj['Key']):
+            digest.update(f"{obj['Key']}\0{obj.get('ETag', '')}\n".encode("utf-8"))
+    return digest.hexdigest()
@@ -0,0 +1,63 @@
+import zlib
+from collections import Counter
+from math import log
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from Cloud_Kinetics.index.text import tokenize
+
+# Default dimensionality of the hashed embeddings. 256 dims keeps an int8 code at
+# 256 bytes per chunk while leaving enough buckets to avoid most collisions.
+DEFAULT_DIM = 256
+
+
+def hash_embed(text: str, dim: int = DEFAULT_DIM) -> np.ndarray:
+    """Embed text with signed feature hashing over its tokens.
+
+    This needs no model call, is deterministic across workers, and produces
+    L2-normalised float32 vectors, so inner product equals cosine similarity.
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    for token, tf in Counter(tokenize(text)).items():
+        h = zlib.crc32(token.encode("utf-8"))
+        sign = 1.0 if (h >> 31) & 1 else -1.0
+        vec[h % dim] += sign * (1.0 + log(tf))
+    norm = float(np.linalg.norm(vec))
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+def hash_embed_many(texts: List[str], dim: int = DEFAULT_DIM) -> np.ndarray:
+    """Embed a batch of texts into an (n, dim) float32 matrix."""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        out[i] = hash_embed(text, dim)
+    return out
+
+
+class LazyEmbeddings:
+    """Array-like view that embeds rows on demand, for the exact ANN re-rank.
+
+    Only the int8 codes need to stay resident; the handful of re-ranked
+    candidates are embedded again from their text instead of keeping float32
+    copies of every vector around.
+    """
+
+    def __init__(
+        self,
+        text_for: Callable[[int], str],
+        dim: int = DEFAULT_DIM,
+        texts_for: Optional[Callable[[List[int]], List[str]]] = None,
+    ):
+        self.text_for = text_for
+        self.texts_for = texts_for
+        self.dim = dim
+
+    def __getitem__(self, ids) -> np.ndarray:
+        ids = [int(i) for i in ids]
+        if self.texts_for is not None:
+            # One batched lookup, so remote text is fetched with coalesced reads
+            return hash_embed_many(self.texts_for(ids), self.dim)
+        return hash_embed_many([self.text_for(i) for i in ids], self.dim)
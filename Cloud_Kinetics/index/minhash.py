@@ -0,0 +1,155 @@
+"""Near-duplicate detection with MinHash signatures and LSH banding.
+
+Each text becomes a set of word shingles; its MinHash signature estimates the
+Jaccard similarity between two such sets as the fraction of equal positions.
+Signatures are split into bands and hashed into buckets, so only texts that
+share a bucket are compared instead of every pair. Candidate pairs are kept
+when the estimated similarity reaches the threshold and grouped transitively.
+"""
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from Cloud_Kinetics.index.text import tokenize
+
+NUM_PERM = 128
+BANDS = 16  # 16 bands x 8 rows: pairs above ~0.7 similarity almost always become candidates
+SHINGLE_WORDS = 5
+DEFAULT_THRESHOLD = 0.85
+_PRIME = (1 << 61) - 1
+_BLOCK = 4096
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> np.ndarray:
+    """32-bit hashes of the distinct word n-grams of a text."""
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        grams = {" ".join(tokens)} if tokens else set()
+    else:
+        grams = {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+class MinHasher:
+    """Deterministic MinHash over ``num_perm`` universal hash functions."""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        # a < 2^31 and x < 2^32 keep a*x + b inside uint64
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingles(text)
+        sig = np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        for start in range(0, len(hashes), _BLOCK):
+            block = hashes[start:start + _BLOCK]
+            values = (self.a[:, None] * block[None, :] + self.b[:, None]) % _PRIME
+            np.minimum(sig, values.min(axis=1), out=sig)
+        return sig
+
+
+def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(sig_a == sig_b))
+
+
+class LSHIndex:
+    """Banded LSH buckets for finding candidate near-duplicates of a signature."""
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets: List[Dict[bytes, List[int]]] = [defaultdict(list) for _ in range(bands)]
+
+    def _keys(self, sig: np.ndarray) -> List[bytes]:
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def candidates(self, sig: np.ndarray) -> List[int]:
+        found = set()
+        for band, key in enumerate(self._keys(sig)):
+            found.update(self.buckets[band].get(key, ()))
+        return sorted(found)
+
+    def add(self, item: int, sig: np.ndarray) -> None:
+        for band, key in enumerate(self._keys(sig)):
+            self.buckets[band][key].append(item)
+
+
+def _is_empty(sig: np.ndarray) -> bool:
+    # Texts without tokens keep the initial max value and would all "match" each other
+    return bool(sig[0] == np.iinfo(np.uint64).max)
+
+
+class NearDuplicateFilter:
+    """Streaming check: is this text a near-duplicate of one seen before?"""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.hasher = MinHasher()
+        self.lsh = LSHIndex()
+        self.signatures: List[np.ndarray] = []
+
+    def is_duplicate(self, text: str) -> bool:
+        """True if a near-identical text was already added; otherwise remember this one."""
+        sig = self.hasher.signature(text)
+        if _is_empty(sig):
+            return False
+        if any(similarity(sig, self.signatures[j]) >= self.threshold for j in self.lsh.candidates(sig)):
+            return True
+        self.lsh.add(len(self.signatures), sig)
+        self.signatures.append(sig)
+        return False
+
+
+def group_near_duplicates(signatures: Sequence[np.ndarray], threshold: float = DEFAULT_THRESHOLD) -> List[List[int]]:
+    """Indices grouped by near-duplication (union-find over verified LSH candidates)."""
+    parent = list(range(len(signatures)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    lsh = LSHIndex(len(signatures[0]) if signatures else NUM_PERM)
+    for i, sig in enumerate(signatures):
+        if _is_empty(sig):
+            continue
+        for j in lsh.candidates(sig):
+            if similarity(sig, signatures[j]) >= threshold:
+                parent[find(i)] = find(j)
+        lsh.add(i, sig)
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i in range(len(signatures)):
+        groups[find(i)].append(i)
+    return list(groups.values())
+
+
+def dedupe_documents(
+    documents: Iterable[Tuple[str, str]],
+    modified: Optional[Mapping[str, Any]] = None,
+    threshold: float = DEFAULT_THRESHOLD,
+) -> Tuple[List[Tuple[str, str]], Dict[str, List[str]]]:
+    """Keep one (key, text) per near-duplicate group and map it to the keys it replaced.
+
+    The representative is the most recently modified document according to
+    ``modified`` (key -> sortable timestamp), falling back to the last key in
+    sort order, which favours names like ``v2`` or ``final`` over ``v1``.
+    """
+    docs = list(documents)
+    hasher = MinHasher()
+    groups = group_near_duplicates([hasher.signature(text) for _, text in docs], threshold)
+    modified = modified or {}
+    keep: Dict[int, List[str]] = {}
+    for group in groups:
+        newest = max(group, key=lambda i: (modified.get(docs[i][0]) is not None, modified.get(docs[i][0]) or 0, docs[i][0]))
+        keep[newest] = sorted(docs[i][0] for i in group if i != newest)
+    kept = [docs[i] for i in sorted(keep)]
+    aliases = {docs[i][0]: keep[i] for i in sorted(keep) if keep[i]}
+    return kept, aliases
@@ -0,0 +1,130 @@
+"""Byte-range access to a snapshot's normalised text artifact.
+
+With ``write_snapshot(..., external_text=True)`` the concatenated document
+text is written as a separate artifact and the snapshot only keeps chunk byte
+offsets into it. Retrieval then reads just the winning passages: requested
+ranges are sorted, merged when they overlap or sit within ``gap`` bytes of
+each other, and each merged span is fetched with one read (``pread`` locally,
+a ranged ``GetObject`` on S3). Fetched spans are kept in a small LRU so
+follow-up reads of the same passage cost nothing.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+from Cloud_Kinetics import metrics
+
+logger = logging.getLogger(__name__)
+
+range_requests = metrics.counter("index_text_range_requests_total", "Ranged reads of the text artifact by source")
+range_bytes = metrics.counter("index_text_range_bytes_total", "Bytes fetched from the text artifact by source")
+
+Range = Tuple[int, int]
+
+COALESCE_GAP_BYTES = int(os.getenv("INDEX_RANGE_COALESCE_GAP", "4096"))
+CACHE_BYTES = int(os.getenv("INDEX_RANGE_CACHE_BYTES", str(8 * 1024 * 1024)))
+
+
+def coalesce(ranges: Sequence[Range], gap: int = COALESCE_GAP_BYTES) -> List[Range]:
+    """Merge ``[start, end)`` ranges that overlap or are at most ``gap`` bytes apart."""
+    merged: List[Range] = []
+    for start, end in sorted(r for r in ranges if r[1] > r[0]):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeReader:
+    """Coalescing, caching reader; subclasses implement ``_fetch``."""
+
+    source = "unknown"
+
+    def __init__(self, gap: int = COALESCE_GAP_BYTES, cache_bytes: int = CACHE_BYTES):
+        self.gap = gap
+        self.cache_bytes = cache_bytes
+        self._cache: "OrderedDict[Range, bytes]" = OrderedDict()
+        self._cached = 0
+        self._lock = threading.Lock()
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        raise NotImplementedError
+
+    def _lookup(self, start: int, end: int):
+        for (s, e), data in self._cache.items():
+            if s <= start and end <= e:
+                self._cache.move_to_end((s, e))
+                return data[start - s:end - s]
+        return None
+
+    def _remember(self, span: Range, data: bytes) -> None:
+        if len(data) > self.cache_bytes:
+            return
+        self._cache[span] = data
+        self._cached += len(data)
+        while self._cached > self.cache_bytes:
+            _, old = self._cache.popitem(last=False)
+            self._cached -= len(old)
+
+    def read_ranges(self, ranges: Sequence[Range]) -> Dict[Range, bytes]:
+        """Bytes for each requested range, using as few reads as possible."""
+        out: Dict[Range, bytes] = {}
+        with self._lock:
+            missing = []
+            for r in set(ranges):
+                if r[1] <= r[0]:
+                    out[r] = b""  # an empty document; coalesce() drops these, so never fetch them
+                    continue
+                hit = self._lookup(*r)
+                if hit is None:
+                    missing.append(r)
+                else:
+                    out[r] = hit
+        for start, end in coalesce(missing, self.gap):
+            data = self._fetch(start, end)
+            range_requests.inc(source=self.source)
+            range_bytes.inc(len(data), source=self.source)
+            with self._lock:
+                self._remember((start, end), data)
+            for s, e in missing:
+                if start <= s and e <= end:
+                    out[(s, e)] = data[s - start:e - start]
+        return out
+
+    def read(self, start: int, end: int) -> bytes:
+        return self.read_ranges([(start, end)])[(start, end)]
+
+
+class FileRangeReader(RangeReader):
+    source = "file"
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        return os.pread(self._fd, end - start, start)
+
+    def __del__(self):
+        try:
+            os.close(self._fd)
+        except (AttributeError, OSError):
+            pass
+
+
+class S3RangeReader(RangeReader):
+    source = "s3"
+
+    def __init__(self, s3_client, bucket: str, key: str, **kwargs):
+        super().__init__(**kwargs)
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end - 1}")
+        return response["Body"].read()
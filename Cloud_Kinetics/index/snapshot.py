@@ -0,0 +1,534 @@
+"""Versioned binary index snapshots that app workers memory-map read-only.
+
+A snapshot is a single file::
+
+    header   magic "CKIX", format version, build version, section count
+    table    (name, offset, length) per section
+    sections 64-byte aligned blobs / little-endian arrays
+
+Sections hold the document list, the normalised text of every document, chunk
+byte offsets into that text, a sorted vocabulary with BM25 posting lists, the
+metadata facet tables (``facets.py``) and, optionally, the int8 IVF vectors. For large corpora the text can instead live
+in a separate ``text-<version>.bin`` artifact (format 2); passages are then
+read from it by byte range, locally or from S3 (see ``ranges.py``). Workers open the file with ``mmap`` so every
+process on a host shares the same page-cache copy instead of holding its own
+corpus in memory. Writers publish a new file and then atomically replace the
+``CURRENT`` pointer; readers notice the change and swap to the new snapshot.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from math import log
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from Cloud_Kinetics.index.ann import IVFInt8Index
+from Cloud_Kinetics.index.embed import DEFAULT_DIM, LazyEmbeddings, hash_embed, hash_embed_many
+from Cloud_Kinetics.index.facets import FacetIndex, extract_facets
+from Cloud_Kinetics.index.minhash import NearDuplicateFilter
+from Cloud_Kinetics.index.ranges import FileRangeReader, RangeReader, S3RangeReader
+from Cloud_Kinetics.index.text import chunk_text, tokenize
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CKIX"
+FORMAT_VERSION = 2  # 2: the "text" section may be an external artifact; optional sections (facets) don't bump it
+CURRENT_POINTER = "CURRENT"
+_HEADER = struct.Struct("<4sIQI")  # magic, format version, build version, section count
+_ENTRY = struct.Struct("<16sQQ")  # section name, offset, length
+_ALIGN = 64
+
+CHUNK_DTYPE = np.dtype([("doc", "<u4"), ("start", "<u8"), ("end", "<u8"), ("ntok", "<u4")])
+
+
+def _write_file(path: str, version: int, sections: Dict[str, bytes]) -> None:
+    names = list(sections)
+    offset = _HEADER.size + _ENTRY.size * len(names)
+    table = []
+    for name in names:
+        offset += -offset % _ALIGN
+        table.append((name, offset, len(sections[name])))
+        offset += len(sections[name])
+
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, version, len(names)))
+        for name, off, length in table:
+            f.write(_ENTRY.pack(name.encode("ascii"), off, length))
+        for name, off, _ in table:
+            f.write(b"\0" * (off - f.tell()))
+            f.write(sections[name])
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _byte_spans(text: str, spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    # Convert character offsets to utf-8 byte offsets in one forward pass
+    mapping: Dict[int, int] = {}
+    prev_char, prev_byte = 0, 0
+    for c in sorted({p for span in spans for p in span}):
+        prev_byte += len(text[prev_char:c].encode("utf-8"))
+        prev_char = c
+        mapping[c] = prev_byte
+    return [(mapping[start], mapping[end]) for start, end in spans]
+
+
+def write_snapshot(
+    documents: Iterable[Tuple[str, str]],
+    out_dir: str,
+    with_vectors: bool = True,
+    meta: Optional[Dict[str, Any]] = None,
+    aliases: Optional[Dict[str, List[str]]] = None,
+    dedupe_chunks: bool = False,
+    external_text: bool = False,
+) -> str:
+    """Build a snapshot from (key, text) pairs and publish it in ``out_dir``.
+
+    ``aliases`` maps a document key to the near-duplicate keys it stands for;
+    they are kept on the document entry. With ``dedupe_chunks``, chunks that
+    nearly duplicate an already indexed chunk (shared boilerplate, pasted
+    sections) stay in the document text but get no postings or vectors. With
+    ``external_text`` the text goes to ``text-<version>.bin`` beside the
+    snapshot instead of into it, and is read back by byte range.
+
+    Returns the path of the new snapshot file. The ``CURRENT`` pointer is only
+    replaced once the file is completely written and synced.
+    """
+    version = int(time.time() * 1000)
+    docs: List[Dict[str, Any]] = []
+    text_parts: List[bytes] = []
+    chunk_rows: List[Tuple[int, int, int, int]] = []
+    chunk_texts: List[str] = []
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    base = 0
+    aliases = aliases or {}
+    seen_chunks = NearDuplicateFilter() if dedupe_chunks else None
+    facets = FacetIndex()
+    dup_chunks = 0
+
+    for key, text in documents:
+        data = text.encode("utf-8")
+        doc_id = len(docs)
+        docs.append({"key": key, "start": base, "end": base + len(data)})
+        if aliases.get(key):
+            docs[-1]["aliases"] = aliases[key]
+        facets.add(doc_id, extract_facets(key, text))
+        spans = chunk_text(text)
+        for (start, end), (bstart, bend) in zip(spans, _byte_spans(text, spans)):
+            body = text[start:end]
+            if seen_chunks is not None and seen_chunks.is_duplicate(body):
+                dup_chunks += 1
+                continue
+            counts = Counter(tokenize(body))
+            chunk_id = len(chunk_rows)
+            chunk_rows.append((doc_id, base + bstart, base + bend, sum(counts.values())))
+            for term, tf in counts.items():
+                postings[term].append((chunk_id, tf))
+            if with_vectors:
+                chunk_texts.append(body)
+        text_parts.append(data)
+        base += len(data)
+
+    terms = sorted(postings, key=lambda t: t.encode("utf-8"))
+    vocab_blob = b"".join(t.encode("utf-8") for t in terms)
+    vocab_off = np.zeros(len(terms) + 1, dtype="<u8")
+    post_off = np.zeros(len(terms) + 1, dtype="<u8")
+    for i, term in enumerate(terms):
+        vocab_off[i + 1] = vocab_off[i] + len(term.encode("utf-8"))
+        post_off[i + 1] = post_off[i] + len(postings[term])
+    post_ids = np.fromiter((c for t in terms for c, _ in postings[t]), dtype="<u4", count=int(post_off[-1]))
+    post_tf = np.fromiter((min(tf, 65535) for t in terms for _, tf in postings[t]), dtype="<u2", count=int(post_off[-1]))
+    chunks = np.array(chunk_rows, dtype=CHUNK_DTYPE)
+
+    info = dict(meta or {})
+    info.update({
+        "version": version,
+        "format": FORMAT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "n_docs": len(docs),
+        "n_chunks": len(chunk_rows),
+        "n_terms": len(terms),
+        "n_aliases": sum(len(v) for v in aliases.values()),
+        "n_dup_chunks": dup_chunks,
+        "avgdl": float(chunks["ntok"].mean()) if len(chunks) else 0.0,
+        "facets": facets.stats(),
+    })
+    sections: Dict[str, bytes] = {
+        "docs": json.dumps(docs).encode("utf-8"),
+        "chunks": chunks.tobytes(),
+        "vocab": vocab_blob,
+        "vocab_off": vocab_off.tobytes(),
+        "post_off": post_off.tobytes(),
+        "post_ids": post_ids.tobytes(),
+        "post_tf": post_tf.tobytes(),
+        "facets": facets.to_bytes(),
+    }
+
+    if with_vectors and chunk_texts:
+        index = IVFInt8Index(DEFAULT_DIM, nlist=int(os.getenv("ANN_NLIST", "256")))
+        index.build(hash_embed_many(chunk_texts))
+        info.update({"dim": index.dim, "nlist": len(index.centroids)})
+        sections.update({
+            "ivf_cent": index.centroids.astype("<f4").tobytes(),
+            "ivf_off": index.list_offsets.astype("<i8").tobytes(),
+            "ivf_codes": index.codes.tobytes(),
+            "ivf_scales": index.scales.astype("<f4").tobytes(),
+            "ivf_ids": index.ids.astype("<u4").tobytes(),
+        })
+    os.makedirs(out_dir, exist_ok=True)
+    if external_text:
+        text_name = f"text-{version}.bin"
+        _write_text_artifact(os.path.join(out_dir, text_name), text_parts)
+        info["text_artifact"] = {"name": text_name, "bytes": base}
+    else:
+        sections["text"] = b"".join(text_parts)
+    sections["meta"] = json.dumps(info).encode("utf-8")
+
+    name = f"snapshot-{version}.ckix"
+    path = os.path.join(out_dir, name)
+    tmp = path + ".tmp"
+    _write_file(tmp, version, sections)
+    os.replace(tmp, path)
+    _write_pointer(out_dir, name)
+    _prune(out_dir, keep=int(os.getenv("INDEX_SNAPSHOT_KEEP", "3")))
+    logger.info(
+        "Wrote index snapshot %s: %s docs (%s near-duplicates aliased), %s chunks (%s duplicate chunks skipped), %s terms",
+        path, info['n_docs'], info['n_aliases'], info['n_chunks'], dup_chunks, info['n_terms'],
+    )
+    return path
+
+
+def _write_text_artifact(path: str, parts: List[bytes]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for part in parts:
+            f.write(part)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _prune(directory: str, keep: int) -> None:
+    # Unlinking is safe for workers still mapping (or reading) an old file; the
+    # pages stay valid until their last mapping or descriptor is released.
+    for prefix, suffix in (("snapshot-", ".ckix"), ("text-", ".bin")):
+        names = sorted(n for n in os.listdir(directory) if n.startswith(prefix) and n.endswith(suffix))
+        for name in names[:-keep] if keep > 0 else []:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError as e:
+                logger.debug("Could not remove old snapshot file %s: %s", name, e)
+
+
+def _write_pointer(directory: str, name: str) -> None:
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".current-")
+    with os.fdopen(fd, "w") as f:
+        f.write(name)
+    os.replace(tmp, os.path.join(directory, CURRENT_POINTER))
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot file.
+
+    ``remote`` is ``(s3_client, bucket, prefix)`` of the published snapshot,
+    used to read an external text artifact that isn't present locally.
+    """
+
+    def __init__(self, path: str, remote: Optional[Tuple[Any, str, str]] = None):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, self.version, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or fmt > FORMAT_VERSION:
+            raise ValueError(f"{path} is not a supported index snapshot (format {fmt})")
+        self._sections: Dict[str, Tuple[int, int]] = {}
+        for i in range(count):
+            name, off, length = _ENTRY.unpack_from(self._mm, _HEADER.size + i * _ENTRY.size)
+            self._sections[name.rstrip(b"\0").decode("ascii")] = (off, length)
+
+        self.meta: Dict[str, Any] = json.loads(self._bytes("meta"))
+        self.docs: List[Dict[str, Any]] = json.loads(self._bytes("docs"))
+        self.chunks = self._array("chunks", CHUNK_DTYPE)
+        self._vocab_base = self._sections["vocab"][0]
+        self._vocab_off = self._array("vocab_off", "<u8")
+        self._post_off = self._array("post_off", "<u8")
+        self._post_ids = self._array("post_ids", "<u4")
+        self._post_tf = self._array("post_tf", "<u2")
+        self._text_base = 0
+        self._text_reader: Optional[RangeReader] = None
+        if "text" in self._sections:
+            self._text_base = self._sections["text"][0]
+        else:
+            self._text_reader = self._open_text_artifact(self.meta["text_artifact"]["name"], remote)
+        self.avgdl = float(self.meta.get("avgdl") or 1.0)
+        # Snapshots written before facets existed have no table; retrieval then skips facet filters
+        self.facets: Optional[FacetIndex] = FacetIndex.from_bytes(self._bytes("facets")) if "facets" in self._sections else None
+
+        self.ann: Optional[IVFInt8Index] = None
+        if "ivf_codes" in self._sections:
+            dim = int(self.meta["dim"])
+            self.ann = IVFInt8Index.from_arrays(
+                centroids=self._array("ivf_cent", "<f4").reshape(-1, dim),
+                list_offsets=self._array("ivf_off", "<i8"),
+                codes=self._array("ivf_codes", np.int8).reshape(-1, dim),
+                scales=self._array("ivf_scales", "<f4"),
+                ids=self._array("ivf_ids", "<u4"),
+                nprobe=int(os.getenv("ANN_NPROBE", "16")),
+                rerank=int(os.getenv("ANN_RERANK", "64")),
+            )
+
+    def _open_text_artifact(self, name: str, remote: Optional[Tuple[Any, str, str]]) -> RangeReader:
+        local = os.path.join(os.path.dirname(self.path), name)
+        if os.path.exists(local):
+            return FileRangeReader(local)
+        if remote is not None:
+            s3_client, bucket, prefix = remote
+            return S3RangeReader(s3_client, bucket, f"{prefix.rstrip('/')}/{name}")
+        raise ValueError(f"Text artifact {name} of {self.path} is neither local nor published")
+
+    @property
+    def text_is_external(self) -> bool:
+        return self._text_reader is not None
+
+    def _text_ranges(self, spans: List[Tuple[int, int]]) -> List[str]:
+        if self._text_reader is None:
+            base = self._text_base
+            return [self._mm[base + s:base + e].decode("utf-8", errors="replace") for s, e in spans]
+        data = self._text_reader.read_ranges(spans)
+        return [data[span].decode("utf-8", errors="replace") for span in spans]
+
+    def _bytes(self, name: str) -> bytes:
+        off, length = self._sections[name]
+        return self._mm[off:off + length]
+
+    def _array(self, name: str, dtype) -> np.ndarray:
+        off, length = self._sections[name]
+        dtype = np.dtype(dtype)
+        return np.frombuffer(self._mm, dtype=dtype, count=length // dtype.itemsize, offset=off)
+
+    @property
+    def n_chunks(self) -> int:
+        return int(self.chunks.shape[0])
+
+    def _term(self, i: int) -> bytes:
+        start = self._vocab_base + int(self._vocab_off[i])
+        return self._mm[start:self._vocab_base + int(self._vocab_off[i + 1])]
+
+    def term_id(self, term: str) -> int:
+        """Binary-search the mapped vocabulary; returns -1 when absent."""
+        target = term.encode("utf-8")
+        lo, hi = 0, len(self._vocab_off) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._vocab_off) - 1 and self._term(lo) == target:
+            return lo
+        return -1
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        tid = self.term_id(term)
+        if tid < 0:
+            return self._post_ids[:0], self._post_tf[:0]
+        start, end = int(self._post_off[tid]), int(self._post_off[tid + 1])
+        return self._post_ids[start:end], self._post_tf[start:end]
+
+    def bm25(
+        self, tokens: List[str], k: int = 10, k1: float = 1.2, b: float = 0.75, docs: Optional[Iterable[int]] = None
+    ) -> List[Tuple[float, int]]:
+        """Rank chunks with BM25 and return (score, chunk_id) pairs, best first.
+
+        ``docs`` restricts scoring to the chunks of those documents (e.g. a facet match).
+        """
+        n = self.n_chunks
+        if n == 0:
+            return []
+        allowed = None
+        if docs is not None:
+            allowed = np.isin(self.chunks["doc"], np.fromiter(docs, dtype=np.int64))
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokens):
+            ids, tfs = self.postings(term)
+            df = len(ids)
+            if df == 0:
+                continue
+            idf = log(1 + (n - df + 0.5) / (df + 0.5))
+            if allowed is not None:
+                keep = allowed[ids]
+                ids, tfs = ids[keep], tfs[keep]
+            tf = tfs.astype(np.float32)
+            dl = self.chunks["ntok"][ids].astype(np.float32)
+            scores[ids] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / self.avgdl))
+        hit = np.flatnonzero(scores)
+        if hit.size == 0:
+            return []
+        k = min(k, hit.size)
+        top = hit[np.argpartition(-scores[hit], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), int(i)) for i in top]
+
+    def dense_search(self, question: str, k: int = 10) -> List[Tuple[float, int]]:
+        if self.ann is None:
+            return []
+        scores, ids = self.ann.search(hash_embed(question), k, vectors=LazyEmbeddings(self.chunk_text, texts_for=self.chunk_texts))
+        return [(float(s), int(i)) for s, i in zip(scores, ids)]
+
+    def chunk_text(self, chunk_id: int) -> str:
+        return self.chunk_texts([chunk_id])[0]
+
+    def chunk_texts(self, chunk_ids: List[int]) -> List[str]:
+        """Texts of several chunks; with an external artifact, fetched with coalesced range reads."""
+        rows = self.chunks[np.asarray(chunk_ids, dtype=np.int64)]
+        return self._text_ranges([(int(r["start"]), int(r["end"])) for r in rows])
+
+    def chunk_key(self, chunk_id: int) -> str:
+        return self.docs[int(self.chunks[chunk_id]["doc"])]["key"]
+
+    def doc_text(self, doc_id: int) -> str:
+        doc = self.docs[doc_id]
+        return self._text_ranges([(doc["start"], doc["end"])])[0]
+
+
+class SnapshotStore:
+    """Tracks the ``CURRENT`` snapshot in a directory and hot-swaps it.
+
+    ``current()`` re-reads the pointer at most every ``check_interval`` seconds.
+    Swapping is a single reference assignment, so requests that already hold
+    the previous snapshot finish on it and its mapping is released once the
+    last reference goes away.
+    """
+
+    def __init__(self, directory: str, check_interval: float = 30.0, remote: Optional[Tuple[Any, str, str]] = None):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.remote = remote
+        self._snapshot: Optional[Snapshot] = None
+        self._name: Optional[str] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        # Set once the first pull from the remote has been attempted (immediately without a remote)
+        self.synced = threading.Event()
+        if remote is None:
+            self.synced.set()
+
+    def current(self) -> Optional[Snapshot]:
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            self.refresh()
+        return self._snapshot
+
+    def refresh(self) -> bool:
+        """Load the pointed-to snapshot if it changed. Returns True on swap."""
+        try:
+            with open(os.path.join(self.directory, CURRENT_POINTER)) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return False
+        if not name or name == self._name:
+            return False
+        with self._lock:
+            if name == self._name:
+                return False
+            try:
+                snapshot = Snapshot(os.path.join(self.directory, name), remote=self.remote)
+            except Exception as e:
+                logger.error("Failed to open index snapshot %s: %s", name, e)
+                return False
+            self._snapshot, self._name = snapshot, name
+        logger.info("Loaded index snapshot %s (%s chunks)", name, snapshot.meta.get('n_chunks'))
+        return True
+
+
+def publish_snapshot(s3_client, bucket: str, prefix: str, path: str) -> str:
+    """Upload a snapshot and then its pointer, so readers never see a partial file."""
+    name = os.path.basename(path)
+    key = f"{prefix.rstrip('/')}/{name}"
+    artifact = Snapshot(path).meta.get("text_artifact")
+    if artifact:
+        # Workers don't download this; they range-read it from S3 on demand
+        s3_client.upload_file(os.path.join(os.path.dirname(path), artifact["name"]), bucket, f"{prefix.rstrip('/')}/{artifact['name']}")
+    s3_client.upload_file(path, bucket, key)
+    s3_client.put_object(Bucket=bucket, Key=f"{prefix.rstrip('/')}/{CURRENT_POINTER}", Body=name.encode("utf-8"))
+    logger.info("Published index snapshot to s3://%s/%s", bucket, key)
+    return key
+
+
+def pull_snapshot(s3_client, bucket: str, prefix: str, directory: str) -> bool:
+    """Download the snapshot named by the S3 pointer if it isn't present locally."""
+    prefix = prefix.rstrip('/')
+    try:
+        name = s3_client.get_object(Bucket=bucket, Key=f"{prefix}/{CURRENT_POINTER}")["Body"].read().decode("utf-8").strip()
+    except Exception as e:
+        logger.debug("No published index snapshot at s3://%s/%s: %s", bucket, prefix, e)
+        return False
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".download-")
+        os.close(fd)
+        try:
+            s3_client.download_file(bucket, f"{prefix}/{name}", tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    _write_pointer(directory, name)
+    return True
+
+
+def _sync_loop(store: SnapshotStore, s3_client, bucket: str, prefix: str, interval: float) -> None:
+    while True:
+        try:
+            if pull_snapshot(s3_client, bucket, prefix, store.directory):
+                store.refresh()
+        except Exception as e:
+            logger.error("Index snapshot sync failed: %s", e)
+        store.synced.set()
+        time.sleep(interval)
+
+
+_store: Optional[SnapshotStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> SnapshotStore:
+    """Process-wide store for INDEX_SNAPSHOT_DIR, syncing from S3 when configured."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                interval = float(os.getenv("INDEX_SNAPSHOT_CHECK_INTERVAL", "30"))
+                bucket = os.getenv("INDEX_SNAPSHOT_BUCKET")
+                prefix = os.getenv("INDEX_SNAPSHOT_PREFIX", "index")
+                s3_client = None
+                if bucket:
+                    from Cloud_Kinetics.aws import make_client
+
+                    s3_client = make_client('s3')
+                store = SnapshotStore(
+                    os.getenv("INDEX_SNAPSHOT_DIR", ".index"),
+                    check_interval=interval,
+                    remote=(s3_client, bucket, prefix) if bucket else None,
+                )
+                if bucket:
+                    threading.Thread(
+                        target=_sync_loop,
+                        args=(store, s3_client, bucket, prefix, interval),
+                        name="index-snapshot-sync",
+                        daemon=True,
+                    ).start()
+                _store = store
+    return _store
+
+
+def current_snapshot() -> Optional[Snapshot]:
+    return get_store().current()
@@ -0,0 +1,37 @@
+import re
+from typing import List, Tuple
+
+
+def tokenize(text: str) -> List[str]:
+    # Lowercase, remove non-word characters, split on whitespace
+    tokens = re.findall(r"\w+", text.lower())
+    # Remove very short tokens
+    return [t for t in tokens if len(t) > 2]
+
+
+def chunk_text(text: str, size: int = 800, overlap: int = 100) -> List[Tuple[int, int]]:
+    """Split text into overlapping windows and return their (start, end) offsets.
+
+    Windows end on a paragraph or line break when one is close to the size limit
+    so excerpts don't start mid-sentence more often than necessary.
+    """
+    if not text:
+        return []
+    spans = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + size, length)
+        if end < length:
+            # Prefer breaking on a blank line, then a newline, within the last third
+            floor = start + (size * 2) // 3
+            for sep in ("\n\n", "\n", ". "):
+                cut = text.rfind(sep, floor, end)
+                if cut != -1:
+                    end = cut + len(sep)
+                    break
+        spans.append((start, end))
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return spans
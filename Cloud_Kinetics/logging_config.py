@@ -0,0 +1,189 @@
+"""Process-wide logging setup for the app.
+
+``configure_logging()`` replaces the root handlers with a ``QueueHandler``, so
+an event handler only puts the record on a bounded queue. A background
+``QueueListener`` thread does the formatting and the I/O. When the queue is
+full, records are dropped and counted (``log_records_dropped_total``); logging
+never blocks the event loop.
+
+Configuration:
+
+* ``LOG_LEVEL`` - root level (default ``INFO``);
+* ``LOG_LEVELS`` - per-logger levels, e.g.
+  ``Cloud_Kinetics.chat.state=DEBUG,botocore=WARNING``;
+* ``LOG_FORMAT`` - ``text`` (default) or ``json``, one object per line;
+* ``LOG_MAX_ARG_CHARS`` / ``LOG_MAX_MESSAGE_CHARS`` - caps on the repr of each
+  argument and on the final message, so a stray DynamoDB response can't turn
+  into a megabyte of log output;
+* ``LOG_QUEUE_SIZE`` - records buffered before dropping.
+
+Call sites should pass arguments lazily (``logger.debug("x=%s", x)``) so
+nothing is formatted for disabled levels. For high-frequency events, pass
+``extra=sampled(n)`` to keep only every n-th record of that message.
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import reprlib
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from Cloud_Kinetics import metrics
+
+logs_dropped = metrics.counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Attributes every LogRecord has; anything else came from ``extra`` and goes into JSON output
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+_PLAIN = (str, int, float, bool, type(None))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _capped_repr() -> reprlib.Repr:
+    r = reprlib.Repr()
+    limit = _env_int("LOG_MAX_ARG_CHARS", 2000)
+    r.maxstring = r.maxother = r.maxlong = limit
+    r.maxlist = r.maxtuple = r.maxset = r.maxdict = 20
+    r.maxlevel = 4
+    return r
+
+
+def sampled(every: int) -> Dict[str, int]:
+    """``extra`` for a high-frequency log call: keep the first and then every ``every``-th record."""
+    return {"sample_every": every}
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in ``record.sample_every`` records per (logger, message template)."""
+
+    def __init__(self):
+        super().__init__()
+        self._counters: Dict[Any, itertools.count] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample_every", 1)
+        if every <= 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            counter = self._counters.setdefault(key, itertools.count())
+            seen = next(counter)
+        record.sampled_total = seen + 1
+        return seen % every == 0
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops instead of blocking and keeps formatting off the caller."""
+
+    def __init__(self, log_queue: queue.Queue, arg_repr: reprlib.Repr):
+        super().__init__(log_queue)
+        self.arg_repr = arg_repr
+        self.max_arg_chars = arg_repr.maxstring
+
+    def _cap(self, value: Any) -> Any:
+        if isinstance(value, str):
+            return value if len(value) <= self.max_arg_chars else value[:self.max_arg_chars] + "...[truncated]"
+        if isinstance(value, _PLAIN):
+            return value
+        # Containers and objects may change after the call returns; snapshot a bounded repr now
+        return self.arg_repr.repr(value)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.args, dict):
+            record.args = {k: self._cap(v) for k, v in record.args.items()}
+        elif record.args:
+            record.args = tuple(self._cap(a) for a in record.args)
+        if record.exc_info:
+            # Tracebacks hold frames; render them here while they are still valid
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            logs_dropped.inc()
+
+
+class CappedFormatter(logging.Formatter):
+    def __init__(self, fmt: str = TEXT_FORMAT, max_chars: int = 8000):
+        super().__init__(fmt)
+        self.max_chars = max_chars
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        if len(record.message) > self.max_chars:
+            record.message = record.message[:self.max_chars] + "...[truncated]"
+        return super().formatMessage(record)
+
+
+class JsonFormatter(CappedFormatter):
+    """One JSON object per line; ``extra`` fields are included as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.message = record.getMessage()
+        if len(record.message) > self.max_chars:
+            record.message = record.message[:self.max_chars] + "...[truncated]"
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.message,
+            "thread": record.threadName,
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS})
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def _parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for part in spec.split(","):
+        name, _, level = part.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(default_level: Optional[str] = None) -> None:
+    """Install the queue-based root handler once per process; later calls are no-ops."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        max_message = _env_int("LOG_MAX_MESSAGE_CHARS", 8000)
+        if os.getenv("LOG_FORMAT", "text").lower() == "json":
+            formatter: logging.Formatter = JsonFormatter(max_chars=max_message)
+        else:
+            formatter = CappedFormatter(max_chars=max_message)
+        output = logging.StreamHandler()
+        output.setFormatter(formatter)
+
+        log_queue: queue.Queue = queue.Queue(maxsize=_env_int("LOG_QUEUE_SIZE", 10000))
+        handler = NonBlockingQueueHandler(log_queue, _capped_repr())
+        handler.addFilter(SamplingFilter())
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(os.getenv("LOG_LEVEL", default_level or "INFO").upper())
+        for name, level in _parse_levels(os.getenv("LOG_LEVELS", "")).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
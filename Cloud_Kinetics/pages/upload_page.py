@@ -3,7 +3,6 @@ import reflex as rx
 from Cloud_Kinetics.chat.state import State
 import logging
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 color = "rgb(107,99,246)"
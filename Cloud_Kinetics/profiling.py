@@ -0,0 +1,313 @@
+"""On-demand sampling profiler for event handlers.
+
+Handlers decorated with ``@profiled`` can be profiled per event name, per user
+or by sampling rate. Selection comes from the environment and can be changed
+at runtime through ``/admin/profiling``:
+
+* ``PROFILE_EVENTS`` - comma-separated handler names (``*`` for all);
+* ``PROFILE_USERS`` - comma-separated user ids;
+* ``PROFILE_SAMPLE_RATE`` - fraction of matching calls to profile (defaults to
+  1 when events or users are set, otherwise 0 = off).
+
+A selected call is watched by one background thread that reads the handler
+thread's stack every ``PROFILE_INTERVAL_MS`` (``sys._current_frames``; no
+tracing hooks). Samples taken while an async handler is suspended on an
+``await`` are counted as ``<suspended>``, so the profile shows where wall time
+went. Work that the handler hands to another task or thread is not followed.
+Each profile is written in collapsed-stack format (``a;b;c <count>``, the input
+of flamegraph.pl and speedscope) to ``PROFILE_OUTPUT``: a local directory or
+``s3://bucket/prefix``.
+
+When nothing is selected a decorated handler costs one attribute check per call.
+"""
+import functools
+import inspect
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from Cloud_Kinetics import metrics
+
+logger = logging.getLogger(__name__)
+
+profiles_total = metrics.counter("handler_profiles_total", "Handler calls profiled by event")
+
+SUSPENDED = "<suspended>"
+MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "4"))
+MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+MAX_DEPTH = 128
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+class ProfileSettings:
+    """What to profile; replaced wholesale so readers never see a half-updated config."""
+
+    def __init__(
+        self,
+        events: Optional[List[str]] = None,
+        users: Optional[List[str]] = None,
+        sample_rate: Optional[float] = None,
+        interval_ms: float = 5.0,
+        output: str = "profiles",
+        expires_at: Optional[float] = None,
+    ):
+        self.events = set(events or [])
+        self.users = set(users or [])
+        if sample_rate is None:
+            sample_rate = 1.0 if self.events or self.users else 0.0
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.interval_ms = max(1.0, interval_ms)
+        self.output = output
+        self.expires_at = expires_at
+        self.active = self.sample_rate > 0
+
+    @classmethod
+    def from_env(cls) -> "ProfileSettings":
+        rate = os.getenv("PROFILE_SAMPLE_RATE")
+        return cls(
+            events=_split(os.getenv("PROFILE_EVENTS")),
+            users=_split(os.getenv("PROFILE_USERS")),
+            sample_rate=float(rate) if rate else None,
+            interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+            output=os.getenv("PROFILE_OUTPUT", "profiles"),
+        )
+
+    def selects(self, event: str, user_id: str) -> bool:
+        if self.expires_at is not None and time.time() > self.expires_at:
+            return False
+        if self.events and event not in self.events and "*" not in self.events:
+            return False
+        if self.users and user_id not in self.users:
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "events": sorted(self.events),
+            "users": sorted(self.users),
+            "sample_rate": self.sample_rate,
+            "interval_ms": self.interval_ms,
+            "output": self.output,
+            "expires_at": self.expires_at,
+        }
+
+
+_settings = ProfileSettings.from_env()
+_recent: "deque[Dict[str, Any]]" = deque(maxlen=50)
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+
+
+def get_settings() -> ProfileSettings:
+    return _settings
+
+
+def configure(**kwargs) -> ProfileSettings:
+    """Replace the profiling selection of this process (see ``ProfileSettings``)."""
+    global _settings
+    expires_in_s = kwargs.pop("expires_in_s", None)
+    kwargs.setdefault("output", _settings.output)
+    kwargs.setdefault("interval_ms", _settings.interval_ms)
+    if expires_in_s:
+        kwargs["expires_at"] = time.time() + float(expires_in_s)
+    _settings = ProfileSettings(**kwargs)
+    logger.info("Profiling selection changed: %s", _settings.as_dict())
+    return _settings
+
+
+def recent_profiles() -> List[Dict[str, Any]]:
+    return list(_recent)
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class _Profile:
+    def __init__(self, event: str, root: str, user_id: str, thread_id: int, target):
+        self.event = event
+        self.root = root
+        self.user_id = user_id
+        self.thread_id = thread_id
+        # The call's own frame (generator/async handlers) or the handler's code object (plain ones)
+        self.target = target
+        self.started = time.time()
+        self.samples: Counter = Counter()
+
+    def _matches(self, frame) -> bool:
+        return frame is self.target or frame.f_code is self.target
+
+    def sample(self, leaf) -> None:
+        stack = []
+        frame = leaf
+        while frame is not None and len(stack) < MAX_DEPTH:
+            stack.append(_label(frame))
+            if self._matches(frame):
+                stack.reverse()
+                self.samples[";".join(stack)] += 1
+                return
+            frame = frame.f_back
+        self.samples[f"{self.root};{SUSPENDED}"] += 1
+
+
+class _Sampler:
+    """One daemon thread sampling every active profile; idle while there are none."""
+
+    def __init__(self):
+        self._profiles: List[_Profile] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, profile: _Profile) -> bool:
+        with self._cond:
+            if len(self._profiles) >= MAX_CONCURRENT:
+                return False
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return True
+
+    def stop(self, profile: _Profile) -> None:
+        with self._cond:
+            if profile in self._profiles:
+                self._profiles.remove(profile)
+
+    def _run(self) -> None:
+        next_tick = time.monotonic()
+        while True:
+            with self._cond:
+                while not self._profiles:
+                    self._cond.wait()
+                    next_tick = time.monotonic()
+                profiles = list(self._profiles)
+            frames = sys._current_frames()
+            now = time.time()
+            for profile in profiles:
+                leaf = frames.get(profile.thread_id)
+                if leaf is not None and now - profile.started < MAX_SECONDS:
+                    profile.sample(leaf)
+            del frames
+            # Keep a fixed cadence: waiting for the GIL behind a busy handler must not thin out its samples
+            interval = _settings.interval_ms / 1000.0
+            next_tick = max(next_tick + interval, time.monotonic() - interval)
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+_sampler = _Sampler()
+
+
+def _safe(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", value)[:64]
+
+
+def _store(profile: _Profile, duration_s: float, output: str) -> None:
+    body = "".join(f"{stack} {count}\n" for stack, count in profile.samples.most_common())
+    stamp = datetime.utcfromtimestamp(profile.started).strftime("%Y%m%dT%H%M%S%fZ")
+    name = f"{_safe(profile.event)}-{_safe(profile.user_id or 'anonymous')}-{stamp}.collapsed"
+    try:
+        if output.startswith("s3://"):
+            from Cloud_Kinetics.aws import make_client
+
+            bucket, _, prefix = output[len("s3://"):].partition("/")
+            key = f"{prefix.strip('/')}/{name}" if prefix.strip("/") else name
+            make_client("s3").put_object(Bucket=bucket, Key=key, Body=body.encode("utf-8"), ContentType="text/plain")
+            location = f"s3://{bucket}/{key}"
+        else:
+            os.makedirs(output, exist_ok=True)
+            location = os.path.join(output, name)
+            with open(location, "w", encoding="utf-8") as f:
+                f.write(body)
+    except Exception as e:
+        logger.error("Failed to store profile of %s: %s", profile.event, e)
+        return
+    samples = sum(profile.samples.values())
+    _recent.append({
+        "event": profile.event,
+        "user_id": profile.user_id,
+        "started": profile.started,
+        "duration_s": round(duration_s, 3),
+        "samples": samples,
+        "location": location,
+    })
+    logger.info("Profiled %s for %s: %s samples over %.2fs -> %s", profile.event, profile.user_id or 'anonymous', samples, duration_s, location)
+
+
+def _begin(fn, instance, target) -> Optional[_Profile]:
+    event = fn.__name__
+    user_id = str(getattr(instance, "user_id", "") or "")
+    if not _settings.selects(event, user_id):
+        return None
+    profile = _Profile(event, f"{fn.__module__}:{fn.__qualname__}", user_id, threading.get_ident(), target)
+    if not _sampler.start(profile):
+        logger.debug("Skipping profile of %s: %s profiles already running", event, MAX_CONCURRENT)
+        return None
+    profiles_total.inc(event=event)
+    return profile
+
+
+def _end(profile: _Profile) -> None:
+    _sampler.stop(profile)
+    _writer.submit(_store, profile, time.time() - profile.started, _settings.output)
+
+
+def profiled(fn):
+    """Make a State event handler (plain, generator, async or async generator) profilable.
+
+    The wrapper has the same kind and signature as ``fn``, so Reflex
+    dispatches it exactly as before.
+    """
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            agen = fn(self, *args, **kwargs)
+            profile = _begin(fn, self, agen.ag_frame) if _settings.active else None
+            try:
+                async for update in agen:
+                    yield update
+            finally:
+                await agen.aclose()
+                if profile is not None:
+                    _end(profile)
+    elif inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            gen = fn(self, *args, **kwargs)
+            profile = _begin(fn, self, gen.gi_frame) if _settings.active else None
+            try:
+                return (yield from gen)
+            finally:
+                if profile is not None:
+                    _end(profile)
+    elif inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            coro = fn(self, *args, **kwargs)
+            profile = _begin(fn, self, coro.cr_frame) if _settings.active else None
+            try:
+                return await coro
+            finally:
+                if profile is not None:
+                    _end(profile)
+    else:
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            profile = _begin(fn, self, fn.__code__) if _settings.active else None
+            try:
+                return fn(self, *args, **kwargs)
+            finally:
+                if profile is not None:
+                    _end(profile)
+    return wrapper
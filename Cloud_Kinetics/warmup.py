@@ -0,0 +1,160 @@
+"""Startup warm-up and readiness.
+
+At app start a background thread runs the steps the first question would
+otherwise pay for:
+
+* ``clients`` - create the S3, DynamoDB and Bedrock clients and open a
+  connection to each service;
+* ``snapshot`` - wait for the first index snapshot sync and page in its
+  postings with a probe query;
+* ``manifest`` - load the knowledge-base upload manifest;
+* ``corpus`` - without a snapshot, download the corpus into the document
+  cache and build the dedupe/ANN structures.
+
+``/ready`` answers 503 until every step has finished, so ECS and the load
+balancer only route traffic to warm tasks. A failing step is logged and marked
+``failed`` but does not keep the task out of service. Readiness is also
+granted once ``WARMUP_TIMEOUT_S`` has passed, so a slow dependency can't
+block a deploy forever. Progress is reported as ``warmup_*`` metrics.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from Cloud_Kinetics import metrics
+
+logger = logging.getLogger(__name__)
+
+warmup_ready = metrics.gauge("warmup_ready", "1 once startup warm-up has finished")
+warmup_step_seconds = metrics.gauge("warmup_step_seconds", "Duration of each warm-up step")
+warmup_steps = metrics.counter("warmup_steps_total", "Warm-up steps by outcome")
+
+TIMEOUT_S = float(os.getenv("WARMUP_TIMEOUT_S", "300"))
+SNAPSHOT_WAIT_S = float(os.getenv("WARMUP_SNAPSHOT_WAIT_S", "60"))
+PROBE_TERMS = ["aws", "s3", "ecs", "error", "configuration"]
+
+
+def _clients() -> Dict[str, Any]:
+    from Cloud_Kinetics.aws import make_client
+    from Cloud_Kinetics.chat.bedrock import get_bedrock_client
+    from Cloud_Kinetics.chat.persistence import get_chat_writer
+
+    touched = []
+    bucket = os.getenv("S3_BUCKET_NAME")
+    if bucket:
+        # head_bucket opens the TLS connection the first get_object would otherwise pay for
+        make_client("s3").head_bucket(Bucket=bucket)
+        touched.append("s3")
+    writer = get_chat_writer()
+    writer.table.load()  # DescribeTable: connection and table metadata
+    touched.append("dynamodb")
+    from Cloud_Kinetics.chat.state import bedrock_allowed
+
+    if bedrock_allowed():
+        get_bedrock_client()
+        touched.append("bedrock")
+    return {"clients": touched}
+
+
+def _snapshot() -> Dict[str, Any]:
+    from Cloud_Kinetics.index.snapshot import get_store
+
+    store = get_store()
+    if not store.synced.wait(SNAPSHOT_WAIT_S):
+        logger.warning("No index snapshot sync within %.0fs; continuing without waiting", SNAPSHOT_WAIT_S)
+    snapshot = store.current()
+    if snapshot is None:
+        return {"snapshot": None}
+    # Touch the postings and document tables so the first question doesn't page-fault through them
+    snapshot.bm25(PROBE_TERMS, 3)
+    return {"snapshot": os.path.basename(snapshot.path), "chunks": snapshot.n_chunks}
+
+
+def _manifest() -> Dict[str, Any]:
+    from Cloud_Kinetics.aws import make_client
+    from Cloud_Kinetics.chat.uploads import load_manifest
+
+    bucket = os.getenv("S3_BUCKET_NAME")
+    if not bucket:
+        return {"objects": 0}
+    manifest, _ = load_manifest(make_client("s3"), bucket)
+    return {"objects": len(manifest["objects"]), "aliases": len(manifest["aliases"])}
+
+
+def _corpus() -> Dict[str, Any]:
+    from Cloud_Kinetics.chat.state import warm_corpus
+
+    return warm_corpus()
+
+
+STEPS: List[Tuple[str, Callable[[], Dict[str, Any]]]] = [
+    ("clients", _clients),
+    ("snapshot", _snapshot),
+    ("manifest", _manifest),
+    ("corpus", _corpus),
+]
+
+
+class WarmupStatus:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.done = threading.Event()
+        self.steps: Dict[str, Dict[str, Any]] = {name: {"state": "pending"} for name, _ in STEPS}
+
+    def ready(self) -> bool:
+        return self.done.is_set() or time.monotonic() - self.started > TIMEOUT_S
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready(),
+            "elapsed_s": round(time.monotonic() - self.started, 3),
+            "steps": self.steps,
+        }
+
+
+_status = WarmupStatus()
+
+
+def get_status() -> WarmupStatus:
+    return _status
+
+
+def run_warmup(status: WarmupStatus = _status) -> WarmupStatus:
+    """Run every step in order, recording progress in ``status``."""
+    for name, step in STEPS:
+        status.steps[name] = {"state": "running"}
+        start = time.monotonic()
+        try:
+            detail = step()
+            outcome = "done"
+        except Exception as e:
+            logger.error("Warm-up step '%s' failed: %s", name, e, exc_info=True)
+            detail, outcome = {"error": str(e)}, "failed"
+        elapsed = time.monotonic() - start
+        status.steps[name] = {"state": outcome, "seconds": round(elapsed, 3), **detail}
+        warmup_step_seconds.set(elapsed, step=name)
+        warmup_steps.inc(step=name, outcome=outcome)
+        logger.info("Warm-up step '%s' %s in %.2fs", name, outcome, elapsed)
+    status.done.set()
+    warmup_ready.set(1)
+    logger.info("Warm-up finished in %.2fs; task is ready", time.monotonic() - status.started)
+    return status
+
+
+@contextlib.asynccontextmanager
+async def warm_up_on_start():
+    """Lifespan task: warm up in a worker thread without delaying server start."""
+    if os.getenv("WARMUP_ENABLED", "1") != "1":
+        _status.done.set()
+        warmup_ready.set(1)
+        yield
+        return
+    warmup_ready.set(0)
+    task = asyncio.create_task(asyncio.to_thread(run_warmup))
+    yield
+    if not task.done():
+        task.cancel()
@@ -1,3 +1,5 @@
+import os
+
 import reflex as rx
 
 config = rx.Config(
@@ -5,5 +7,11 @@ config = rx.Config(
     pages={
         "/": "Cloud_Kinetics.components.chat_page",
         "/upload": "Cloud_Kinetics.pages.upload_page"
-    }
+    },
+    # With REDIS_URL set, State lives in Redis instead of process memory so any
+    # backend task can serve any session (no sticky sessions needed).
+    redis_url=os.getenv("REDIS_URL") or None,
+    # process_question holds the state lock for the whole model call
+    redis_lock_expiration=int(os.getenv("REDIS_LOCK_EXPIRATION_MS", "120000")),
+    redis_token_expiration=int(os.getenv("REDIS_TOKEN_EXPIRATION_S", str(60 * 60 * 24))),
 )
@@ -0,0 +1,95 @@
+import os
+import sys
+import tempfile
+
+# Importing the chat state looks up the caller identity; point it at a closed port so it fails fast
+os.environ.setdefault("AWS_ENDPOINT_URL", "http://127.0.0.1:9")
+os.environ.setdefault("AWS_MAX_ATTEMPTS", "1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.pop("REDIS_URL", None)
+# Not the working directory's .index: tests that need a snapshot build their own
+os.environ["INDEX_SNAPSHOT_DIR"] = tempfile.mkdtemp(prefix="ck-index-")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+class RecordingWriter:
+    """Stands in for the write-behind DynamoDB writer and records what it was given."""
+
+    def __init__(self):
+        self.messages = []
+        self.summaries = []
+
+    def enqueue(self, user_id, session_id, chat_name, message):
+        self.messages.append((user_id, session_id, chat_name, message))
+
+    def set_summary(self, user_id, session_id, chat_name, text, turns):
+        self.summaries.append((user_id, session_id, chat_name, text, turns))
+
+    def pending_messages(self, user_id, session_id):
+        return []
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    """Record chat writes instead of sending them to DynamoDB, and skip search indexing."""
+    from Cloud_Kinetics.chat import state as chat_state
+
+    recorder = RecordingWriter()
+    monkeypatch.setattr(chat_state, "get_chat_writer", lambda: recorder)
+    monkeypatch.setattr(chat_state, "index_message_later", lambda *args: None)
+    return recorder
+
+
+@pytest.fixture
+def fake_bedrock(monkeypatch):
+    """The throttling fake as the Bedrock client, with model calls allowed and a fixed knowledge base.
+
+    Tests adjust its ``max_rps`` / ``latency_s`` / ``model_latency_s`` as needed.
+    """
+    from Cloud_Kinetics.chat import bedrock
+    from Cloud_Kinetics.chat import state as chat_state
+    from Cloud_Kinetics.chat.fake_bedrock import FakeBedrockClient
+
+    fake = FakeBedrockClient(max_rps=100, latency_s=0.01)
+    monkeypatch.setattr(bedrock, "get_bedrock_client", lambda region=None: fake)
+    monkeypatch.setattr(chat_state, "_load_knowledge_base", lambda: "Fargate runs containers without managing servers.")
+    monkeypatch.setenv("FORCE_BEDROCK", "1")
+    return fake
+
+
+def _create_table(dynamodb, name: str, range_key: str):
+    return dynamodb.create_table(
+        TableName=name,
+        KeySchema=[{"AttributeName": "user_id", "KeyType": "HASH"}, {"AttributeName": range_key, "KeyType": "RANGE"}],
+        AttributeDefinitions=[
+            {"AttributeName": "user_id", "AttributeType": "S"},
+            {"AttributeName": range_key, "AttributeType": "S"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    """Moto DynamoDB with the chat session table wired into the chat state."""
+    moto = pytest.importorskip("moto")
+    import boto3
+
+    from Cloud_Kinetics.chat import state as chat_state
+
+    monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
+    with moto.mock_aws():
+        resource = boto3.resource("dynamodb")
+        monkeypatch.setattr(chat_state, "chat_table", _create_table(resource, "ChatSession", "session_id"))
+        yield resource
+
+
+@pytest.fixture
+def search_table(dynamodb):
+    """Moto table in the layout of CHAT_SEARCH_TABLE."""
+    return _create_table(dynamodb, "ChatSearch", "sk")
@@ -0,0 +1,166 @@
+"""Bedrock calls through the fake client: deadlines, breaker accounting and admission."""
+import asyncio
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+from Cloud_Kinetics.chat import bedrock
+from Cloud_Kinetics.chat.bedrock import AdmissionQueue, QueueFullError, bedrock_calls, invoke_guarded, invoke_text
+from Cloud_Kinetics.chat.state import answer_question
+from Cloud_Kinetics.chat.breaker import CircuitBreaker
+
+MODEL = "anthropic.claude-v2"
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(name="test", latency_slo_s=0.1)
+    monkeypatch.setattr(bedrock, "get_breaker", lambda: breaker)
+    return breaker
+
+
+def outcome_delta(outcome: str, call) -> float:
+    before = bedrock_calls.value(outcome=outcome, model=MODEL)
+    call()
+    return bedrock_calls.value(outcome=outcome, model=MODEL) - before
+
+
+def test_deadline_inside_the_slo_is_not_held_against_the_model(fake_bedrock, breaker):
+    fake_bedrock.latency_s = 0.3
+
+    def call():
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(invoke_guarded("q", MODEL, timeout=0.02))
+
+    assert outcome_delta("deadline", call) == 1
+    assert list(breaker._outcomes) == []
+
+
+def test_timeout_past_the_slo_counts_as_a_bad_call(fake_bedrock, breaker):
+    fake_bedrock.latency_s = 0.4
+
+    def call():
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(invoke_guarded("q", MODEL, timeout=0.2))
+
+    assert outcome_delta("timeout", call) == 1
+    assert list(breaker._outcomes) == [True]
+
+
+def test_model_error_counts_as_an_error(fake_bedrock, breaker, monkeypatch):
+    def invoke_model(**kwargs):
+        raise ClientError({"Error": {"Code": "ValidationException", "Message": "bad prompt"}}, "InvokeModel")
+
+    monkeypatch.setattr(fake_bedrock, "invoke_model", invoke_model)
+
+    def call():
+        with pytest.raises(ClientError):
+            asyncio.run(invoke_guarded("q", MODEL, timeout=1))
+
+    assert outcome_delta("error", call) == 1
+    assert list(breaker._outcomes) == [True]
+
+
+def test_queue_admits_in_fifo_order_and_keeps_the_model_under_its_rate(fake_bedrock):
+    fake_bedrock.max_rps = 5
+
+    async def scenario():
+        queue = AdmissionQueue(rate=4, burst=1, max_concurrency=10, max_queue=10)
+        tickets = [queue.enqueue() for _ in range(8)]
+        # The burst admits the first; the rest wait in arrival order
+        assert [t.position for t in tickets] == list(range(8))
+        admitted = []
+
+        async def call(i, ticket):
+            async for _ in ticket.wait_turn(poll_interval=0.05):
+                pass
+            admitted.append(i)
+            try:
+                return await invoke_text("q", MODEL, client=fake_bedrock, ticket=ticket)
+            finally:
+                ticket.release()
+
+        answers = await asyncio.gather(*[call(i, t) for i, t in enumerate(tickets)])
+        assert admitted == list(range(8))
+        assert all(a.startswith("(fake) answer") for a in answers)
+
+    asyncio.run(scenario())
+    # Eight calls at once against a 5 requests/s model, and none was throttled
+    assert fake_bedrock.calls == 8
+    assert fake_bedrock.throttled == 0
+
+
+def test_queue_caps_concurrent_model_calls(fake_bedrock, monkeypatch):
+    fake_bedrock.latency_s = 0.1
+    lock = threading.Lock()
+    running = {"now": 0, "peak": 0}
+    invoke_model = fake_bedrock.invoke_model
+
+    def counting_invoke_model(**kwargs):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        try:
+            return invoke_model(**kwargs)
+        finally:
+            with lock:
+                running["now"] -= 1
+
+    monkeypatch.setattr(fake_bedrock, "invoke_model", counting_invoke_model)
+
+    async def scenario():
+        queue = AdmissionQueue(rate=1000, burst=1000, max_concurrency=2, max_queue=10)
+
+        async def call():
+            ticket = queue.enqueue()
+            try:
+                async for _ in ticket.wait_turn(poll_interval=0.05):
+                    pass
+                assert queue.active <= 2
+                return await invoke_text("q", MODEL, client=fake_bedrock, ticket=ticket)
+            finally:
+                ticket.release()
+
+        await asyncio.gather(*[call() for _ in range(6)])
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert fake_bedrock.calls == 6
+    assert running["peak"] == 2
+    assert queue.active == 0 and queue.depth == 0
+
+
+def test_full_queue_turns_questions_away_as_busy(fake_bedrock, monkeypatch):
+    monkeypatch.setenv("ROUTER_ENABLED", "0")
+
+    async def scenario():
+        queue = AdmissionQueue(rate=0.5, burst=1, max_concurrency=1, max_queue=2)
+        monkeypatch.setattr(bedrock, "_limiter", queue)
+        held = [queue.enqueue() for _ in range(3)]
+        assert [t.position for t in held] == [0, 1, 2]
+        with pytest.raises(QueueFullError):
+            queue.enqueue()
+        answer = await answer_question("What is Fargate?")
+        for ticket in held:
+            ticket.release()
+        return answer
+
+    assert asyncio.run(scenario()).startswith("The assistant is very busy right now.")
+    assert fake_bedrock.calls == 0
+
+
+def test_throttled_calls_recover_with_jittered_retries(fake_bedrock, monkeypatch):
+    fake_bedrock.max_rps = 2
+    monkeypatch.setenv("BEDROCK_MAX_ATTEMPTS", "20")
+    monkeypatch.setenv("BEDROCK_BACKOFF_BASE_S", "0.1")
+    monkeypatch.setenv("BEDROCK_BACKOFF_CAP_S", "0.5")
+
+    async def scenario():
+        # No admission queue: twice the model's rate at once
+        return await asyncio.gather(*[invoke_text("q", MODEL, client=fake_bedrock) for _ in range(4)])
+
+    answers = asyncio.run(scenario())
+    assert all(a.startswith("(fake) answer") for a in answers)
+    assert fake_bedrock.throttled > 0
+    assert fake_bedrock.calls == 4 + fake_bedrock.throttled
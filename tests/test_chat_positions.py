@@ -0,0 +1,89 @@
+"""Message positions agree between the history store, DynamoDB and the search index."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import reflex as rx
+import reflex.state  # noqa: F401  (import before the manager module to avoid a cycle)
+from reflex.istate.manager import StateManagerMemory
+
+from Cloud_Kinetics.chat import history, search
+from Cloud_Kinetics.chat import state as chat_state
+from Cloud_Kinetics.chat.persistence import WriteBehindWriter
+from Cloud_Kinetics.chat.state import State
+
+TOKEN = "client-1_" + State.get_full_name()
+QUESTIONS = ["What is Fargate?", "How is Fargate billed?", "Which port does the backend use?"]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(history, "_store", history.InMemoryHistoryStore())
+    monkeypatch.setenv("ROUTER_ENABLED", "0")
+    return history.get_history_store()
+
+
+@pytest.fixture
+def persisted(dynamodb, monkeypatch):
+    """Write messages to the moto session table and index them on one thread, so tests can wait for both."""
+    writer = WriteBehindWriter(chat_state.chat_table, flush_interval_s=0.01)
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(chat_state, "get_chat_writer", lambda: writer)
+    monkeypatch.setattr(search, "_executor", executor)
+    monkeypatch.setattr(search, "_index", None)
+    yield writer
+    writer.close()
+    executor.shutdown()
+
+
+def settle(writer):
+    writer.flush()
+    search._executor.submit(lambda: None).result()
+
+
+async def open_hit(state, query: str) -> str:
+    """Search the user's chats and open the top hit; returns the question shown at the hit's position."""
+    State.search_chats.fn(state, {"query": query})
+    hit = state.search_hits[0]
+    State.open_search_hit.fn(state, hit.chat_name, hit.position)
+    return state.messages[hit.position - state.window_start].question
+
+
+async def new_user_asks(questions):
+    """Load the session of a user with no stored chats and ask ``questions``; returns the state."""
+    async with StateManagerMemory(state=rx.State).modify_state(TOKEN) as root:
+        state = await root.get_state(State)
+        state.load_session()
+        for question in questions:
+            async for _ in State.process_question.fn(state, {"question": question}):
+                pass
+        return state
+
+
+def test_new_chat_stores_only_persisted_messages(dynamodb, store, fake_bedrock, writer):
+    state = asyncio.run(new_user_asks([]))
+    assert state.user_id
+    assert store.length(state.user_id, state.current_chat) == 0
+    assert state.message_count == 0 and state.messages == []
+
+    state = asyncio.run(new_user_asks(QUESTIONS))
+    persisted = [message for _, _, _, message in writer.messages]
+    assert store.window(state.user_id, state.current_chat, 0, len(QUESTIONS) + 1) == persisted
+    assert [qa.question for qa in state.messages] == QUESTIONS
+
+
+@pytest.mark.parametrize("index", ["dynamodb", "memory"])
+def test_search_hit_opens_at_the_persisted_position(index, request, store, fake_bedrock, persisted, monkeypatch):
+    if index == "dynamodb":
+        monkeypatch.setattr(search, "_index", search.DynamoSearchIndex(request.getfixturevalue("search_table")))
+
+    async def scenario():
+        state = await new_user_asks(QUESTIONS)
+        settle(persisted)
+        # Another task (or a reload) rebuilds the store from DynamoDB; positions must not move
+        history._store = history.InMemoryHistoryStore()
+        state.load_session()
+        settle(persisted)
+        return await open_hit(state, "billed")
+
+    assert asyncio.run(scenario()) == "How is Fargate billed?"
@@ -0,0 +1,99 @@
+"""Identical in-flight questions share one knowledge-base load and one model call."""
+import asyncio
+
+import reflex as rx
+import reflex.state  # noqa: F401  (import before the manager module to avoid a cycle)
+from reflex.istate.manager import StateManagerMemory
+
+from Cloud_Kinetics.chat.coalesce import SingleFlight, normalize_question, question_key
+from Cloud_Kinetics.chat.state import State
+
+
+def test_question_key_ignores_spelling_but_not_context():
+    key = question_key("What is Fargate?", "kb-1", model="m")
+    assert question_key("  what is   FARGATE ", "kb-1", model="m") == key
+    assert normalize_question("What is Fargate?!") == "what is fargate"
+    assert question_key("What is Fargate?", "kb-2", model="m") != key
+    assert question_key("What is Fargate?", "kb-1", model="other") != key
+
+
+def test_concurrent_callers_share_one_computation():
+    async def scenario():
+        flights = SingleFlight("test")
+        runs = []
+
+        async def compute(flight):
+            runs.append(flight.key)
+            await asyncio.sleep(0.05)
+            return f"result for {flight.key}"
+
+        results = await asyncio.gather(*[flights.do("a" if i % 4 else "b", compute) for i in range(20)])
+        assert sorted(runs) == ["a", "b"]
+        assert set(results) == {"result for a", "result for b"}
+        assert len(flights) == 0
+
+        # Finished flights are forgotten: a later identical question computes again
+        await flights.do("a", compute)
+        assert runs.count("a") == 2
+
+    asyncio.run(scenario())
+
+
+def test_followers_get_the_leaders_error():
+    async def scenario():
+        flights = SingleFlight("test")
+        calls = []
+
+        async def fail(flight):
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            raise RuntimeError("model down")
+
+        results = await asyncio.gather(*[flights.do("k", fail) for _ in range(5)], return_exceptions=True)
+        assert len(calls) == 1
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(scenario())
+
+
+def test_leader_disconnect_does_not_cancel_followers():
+    async def scenario():
+        flights = SingleFlight("test")
+
+        async def compute(flight):
+            await asyncio.sleep(0.1)
+            return "answer"
+
+        leader = asyncio.ensure_future(flights.do("k", compute))
+        follower = asyncio.ensure_future(flights.do("k", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == "answer"
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_questions_across_users_make_one_model_call(fake_bedrock, writer):
+    fake_bedrock.latency_s = 0.3
+
+    async def scenario():
+        manager = StateManagerMemory(state=rx.State)
+        questions = ["What is Fargate?", "what is fargate", "  What is FARGATE?! "] * 8 + ["How is ECS billed?"] * 6
+
+        async def ask(client: int, question: str) -> str:
+            async with manager.modify_state(f"client-{client}_{State.get_full_name()}") as root:
+                state = await root.get_state(State)
+                state.user_id = f"user-{client % 5}"
+                state.current_chat = f"chat-{client % 3}"
+                async for _ in State.process_question.fn(state, {"question": question}):
+                    pass
+                return state.messages[-1].answer
+
+        answers = await asyncio.gather(*[ask(i, q) for i, q in enumerate(questions)])
+        assert fake_bedrock.calls == 2
+        assert len(set(answers[:24])) == 1 and len(set(answers[24:])) == 1
+        assert answers[0] != answers[-1]
+        # Every session still stores its own copy of the answer
+        assert len(writer.messages) == len(questions)
+
+    asyncio.run(scenario())
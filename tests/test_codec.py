@@ -0,0 +1,14 @@
+"""The codec report checks that every stored layout decodes back to what was written."""
+from Cloud_Kinetics.chat import codec
+
+
+def test_report_round_trips_every_codec():
+    rows = codec.report(messages=20, batch=5)
+    assert [row["codec"] for row in rows][:2] == ["none", "gzip"]
+    assert all(row["round_trip_ok"] for row in rows)
+
+
+def test_report_records_a_broken_round_trip(monkeypatch):
+    monkeypatch.setattr(codec, "decode_messages", lambda item: [])
+    rows = codec.report(messages=5, codecs=("none", "gzip"))
+    assert [row["round_trip_ok"] for row in rows] == [False, False]
@@ -0,0 +1,59 @@
+"""A deleted session's messages must not be written back by the write-behind writer."""
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from Cloud_Kinetics.chat.persistence import WriteBehindWriter
+
+MESSAGE = {"question": "What is Fargate?", "answer": "A serverless compute engine."}
+
+
+class SlowTable:
+    """Records update_item calls; each one takes ``latency_s`` and may fail."""
+
+    def __init__(self, latency_s: float = 0.2, fail: bool = False):
+        self.latency_s = latency_s
+        self.fail = fail
+        self.started = threading.Event()
+        self.written = []
+
+    def update_item(self, Key, **kwargs):
+        self.started.set()
+        time.sleep(self.latency_s)
+        if self.fail:
+            raise ClientError({"Error": {"Code": "ProvisionedThroughputExceededException", "Message": "slow down"}}, "UpdateItem")
+        self.written.append(Key["session_id"])
+
+
+def discard_while_writing(table: SlowTable) -> WriteBehindWriter:
+    writer = WriteBehindWriter(table, flush_interval_s=0.01, backoff_base_s=0.01)
+    writer.enqueue("user-1", "Chat#1", "Chat", MESSAGE)
+    assert table.started.wait(2)
+    writer.discard("user-1", "Chat#1")
+    return writer
+
+
+def test_discard_waits_for_the_write_in_flight_and_drops_later_ones():
+    table = SlowTable()
+    writer = discard_while_writing(table)
+    # The write in flight finished before discard returned, so a delete after it sticks
+    assert table.written == ["Chat#1"]
+
+    # A late answer or summary for the deleted session is not written back
+    writer.enqueue("user-1", "Chat#1", "Chat", MESSAGE)
+    writer.set_summary("user-1", "Chat#1", "Chat", "summary", 1)
+    writer.enqueue("user-1", "Chat#2", "Chat", MESSAGE)
+    assert writer.flush(2)
+    assert table.written == ["Chat#1", "Chat#2"]
+    writer.close()
+
+
+def test_failed_write_of_a_discarded_session_is_not_retried():
+    table = SlowTable(fail=True)
+    writer = discard_while_writing(table)
+    table.fail = False
+    assert writer.flush(2)
+    assert table.written == []
+    assert writer.depth == 0
+    writer.close()
@@ -0,0 +1,87 @@
+"""Model routing against a small index snapshot and a stubbed multi-model Bedrock."""
+import asyncio
+
+import pytest
+
+from Cloud_Kinetics.chat import routing
+from Cloud_Kinetics.chat import state as chat_state
+from Cloud_Kinetics.chat.routing import FAST_MAX_TOKENS, FAST_MODEL, STRONG_MODEL, record_generation, route, routes_total
+from Cloud_Kinetics.chat.state import answer_question
+from Cloud_Kinetics.index import snapshot as snapshot_module
+from Cloud_Kinetics.index.snapshot import SnapshotStore, write_snapshot
+
+DOCUMENTS = [
+    ("fargate.txt", "Fargate pricing is billed per vCPU second and per gigabyte of memory used by the task."),
+    ("ecs.txt", "ECS clusters group container instances. Services keep a desired count of tasks running behind a load balancer."),
+    ("s3.txt", "S3 stores objects in buckets. Lifecycle rules move old objects to Glacier storage classes."),
+    ("iam.txt", "IAM roles grant temporary credentials. Task roles let containers call AWS APIs without static keys."),
+    ("vpc.txt", "A VPC has public and private subnets. NAT gateways give private subnets outbound internet access."),
+    ("ports.txt", "Port 8000 is the backend port. The backend port serves the API."),
+]
+COMPLEX = "Explain why task roles are better than static keys and compare them with instance profiles"
+
+
+@pytest.fixture
+def models(fake_bedrock, tmp_path, monkeypatch):
+    """A snapshot of DOCUMENTS and a fake Bedrock whose strong model is slower than the fast one."""
+    write_snapshot(DOCUMENTS, str(tmp_path), with_vectors=False)
+    monkeypatch.setattr(snapshot_module, "_store", SnapshotStore(str(tmp_path)))
+    monkeypatch.setattr(routing, "_throughput", {})
+    fake_bedrock.model_latency_s = {FAST_MODEL: 0.01, STRONG_MODEL: 0.05}
+    return fake_bedrock
+
+
+def ask(question: str, context: str = "") -> str:
+    return asyncio.run(answer_question(question, context))
+
+
+def test_short_lookup_is_answered_from_the_passage(models):
+    before = routes_total.value(route="direct", model="none")
+    answer = ask("Which port is the backend port?")
+    assert answer.startswith("From ports.txt:")
+    assert models.calls == 0
+    assert routes_total.value(route="direct", model="none") == before + 1
+
+
+def test_confident_match_goes_to_the_fast_model(models):
+    ask("fargate pricing billed")
+    assert models.calls_by_model == {FAST_MODEL: 1}
+
+
+def test_complex_and_unmatched_questions_go_to_the_strong_model(models):
+    ask(COMPLEX)
+    ask("quantum chromodynamics")
+    assert models.calls_by_model == {STRONG_MODEL: 2}
+
+
+def test_follow_up_is_never_answered_directly(models):
+    answer = ask("Which port is the backend port?", context="Human: What does the backend run?\nAssistant: The API.")
+    assert FAST_MODEL in answer
+    assert models.calls_by_model == {FAST_MODEL: 1}
+
+
+def test_short_latency_budget_forces_the_fast_model(models, monkeypatch):
+    monkeypatch.setattr(chat_state, "BEDROCK_DEADLINE_S", routing.STRONG_MIN_BUDGET_S - 1)
+    ask(COMPLEX)
+    assert models.calls_by_model == {FAST_MODEL: 1}
+
+
+def test_routing_disabled_uses_the_default_model(models, monkeypatch):
+    monkeypatch.setenv("ROUTER_ENABLED", "0")
+    ask("Which port is the backend port?")
+    assert models.calls_by_model == {chat_state.MODEL_ID: 1}
+
+
+def test_max_tokens_follow_measured_throughput(models):
+    # No measurement yet: the configured limit stands
+    assert route(COMPLEX, None, budget_s=3).max_tokens == FAST_MAX_TOKENS
+
+    # Short answers say more about request overhead than speed and are ignored
+    record_generation(FAST_MODEL, answer_chars=40, seconds=2.0)
+    assert route(COMPLEX, None, budget_s=3).max_tokens == FAST_MAX_TOKENS
+
+    # 1000 tokens in 10s: 3s of budget fits 300 tokens
+    record_generation(FAST_MODEL, answer_chars=4000, seconds=10.0)
+    assert route(COMPLEX, None, budget_s=3).max_tokens == 300
+    # A budget that fits the whole limit isn't capped
+    assert route(COMPLEX, None, budget_s=7).max_tokens == FAST_MAX_TOKENS
@@ -0,0 +1,133 @@
+"""State written by one backend task must be readable and continuable by another.
+
+Two ``StateManagerRedis`` instances stand in for two backend tasks; they share
+one fakeredis server, as the tasks would share ElastiCache, and so does the
+chat history store.
+"""
+import asyncio
+import contextlib
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import redis  # noqa: E402
+import reflex as rx  # noqa: E402
+import reflex.state  # noqa: E402,F401  (import before the manager module to avoid a cycle)
+from reflex.istate.manager import StateManagerRedis  # noqa: E402
+
+from Cloud_Kinetics.chat import history  # noqa: E402
+from Cloud_Kinetics.chat import state as chat_state  # noqa: E402
+from Cloud_Kinetics.chat.state import HISTORY_WINDOW, State  # noqa: E402
+
+TOKEN = "client-1_" + State.get_full_name()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url", classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server)))
+    monkeypatch.setattr(history, "_store", None)
+    return server
+
+
+@pytest.fixture
+def answers(writer, monkeypatch):
+    """Stub the model; record the context each answer saw."""
+    contexts = []
+
+    async def answer_question(question, context="", plan=None, retrieval=None, on_queue=None):
+        contexts.append(context)
+        return f"answer to {question}"
+
+    monkeypatch.setattr(chat_state, "answer_question", answer_question)
+    monkeypatch.setenv("ROUTER_ENABLED", "0")
+    return contexts
+
+
+class Task:
+    """One backend task: its own state manager and history store, over the shared Redis."""
+
+    def __init__(self, server):
+        self.manager = StateManagerRedis(state=rx.State, redis=fakeredis.FakeAsyncRedis(server=server))
+        self.store = history.RedisHistoryStore("redis://shared")
+
+    @contextlib.asynccontextmanager
+    async def state(self):
+        history._store = self.store
+        async with self.manager.modify_state(TOKEN) as root:
+            yield await root.get_state(State)
+
+    async def ask(self, question: str) -> None:
+        async with self.state() as state:
+            async for _ in State.process_question.fn(state, {"question": question}):
+                pass
+
+
+def test_session_continues_on_another_task(server, answers, writer):
+    async def scenario():
+        task_a, task_b = Task(server), Task(server)
+        async with task_a.state() as state:
+            state.user_id = "user-1"
+        await task_a.ask("What is Fargate?")
+
+        # Task A goes away; the next event for the same client lands on task B
+        await task_b.ask("And how is it billed?")
+        async with task_b.state() as state:
+            assert state.user_id == "user-1"
+            assert state.message_count == 2
+            assert [qa.answer for qa in state.messages] == ["answer to What is Fargate?", "answer to And how is it billed?"]
+            session_id = state.session_ids[state.current_chat]
+
+        # B's follow-up was answered with A's turn as context
+        assert "What is Fargate?" in answers[1]
+        # Both turns went to the same DynamoDB session
+        assert {message[1] for message in writer.messages} == {session_id}
+
+        # And task A sees what task B wrote rather than a stale in-process copy
+        async with task_a.state() as state:
+            assert state.message_count == 2
+            assert state.messages[-1].question == "And how is it billed?"
+
+    asyncio.run(scenario())
+
+
+def test_history_stays_out_of_the_state_snapshot(server, answers):
+    async def scenario():
+        task_a, task_b = Task(server), Task(server)
+        for i in range(HISTORY_WINDOW + 10):
+            task_a.store.append("user-1", chat_state.DEFAULT_CHAT, {"question": f"old question {i}.", "answer": "old answer"})
+        async with task_a.state() as state:
+            state.user_id = "user-1"
+            state._load_window()
+
+        snapshot = await fakeredis.FakeAsyncRedis(server=server).get(TOKEN)
+        assert b"old question 0." not in snapshot
+        assert f"old question {HISTORY_WINDOW + 9}.".encode() in snapshot
+
+        # The older pages are still there for the other task
+        async with task_b.state() as state:
+            assert state.has_older
+            State.load_older.fn(state)
+            assert state.messages[0].question == "old question 0."
+
+    asyncio.run(scenario())
+
+
+def test_state_lock_is_shared_between_tasks(server):
+    async def scenario():
+        task_a, task_b = Task(server), Task(server)
+        entered = asyncio.Event()
+
+        async def modify_on_b():
+            async with task_b.state():
+                entered.set()
+
+        async with task_a.state():
+            waiter = asyncio.ensure_future(modify_on_b())
+            await asyncio.sleep(0.3)
+            assert not entered.is_set()
+        await asyncio.wait_for(waiter, timeout=5)
+        assert entered.is_set()
+
+    asyncio.run(scenario())
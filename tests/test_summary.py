@@ -0,0 +1,75 @@
+"""Rolling summaries are updated by a background event, not inside the answer handler."""
+import asyncio
+
+import pytest
+import reflex as rx
+import reflex.state  # noqa: F401  (import before the manager module to avoid a cycle)
+from reflex.event import EventSpec
+from reflex.istate.manager import StateManagerMemory
+
+from Cloud_Kinetics.chat import history
+from Cloud_Kinetics.chat.memory import CONTEXT_TURNS
+from Cloud_Kinetics.chat.state import DEFAULT_CHAT, State
+
+TOKEN = "client-1_" + State.get_full_name()
+EARLIER_TURNS = 6
+
+
+class Unlocked:
+    """Stands in for the StateProxy a background event receives."""
+
+    def __init__(self, state):
+        object.__setattr__(self, "_state", state)
+
+    def __getattr__(self, name):
+        return getattr(self._state, name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+@pytest.fixture
+def chat(fake_bedrock, writer, monkeypatch):
+    """A chat with enough earlier turns that the next answer folds some into the summary."""
+    monkeypatch.setattr(history, "_store", history.InMemoryHistoryStore())
+    monkeypatch.setenv("CHAT_SUMMARY_MODE", "model")
+    monkeypatch.setenv("ROUTER_ENABLED", "0")
+    for i in range(EARLIER_TURNS):
+        history.get_history_store().append("user-1", DEFAULT_CHAT, {"question": f"question {i}", "answer": f"answer {i}"})
+    return fake_bedrock
+
+
+def test_answer_handler_leaves_the_summary_to_a_background_event(chat, writer):
+    async def scenario():
+        async with StateManagerMemory(state=rx.State).modify_state(TOKEN) as root:
+            state = await root.get_state(State)
+            state.user_id = "user-1"
+            state._load_window()
+            return [update async for update in State.process_question.fn(state, {"question": "What is Fargate?"})]
+
+    updates = asyncio.run(scenario())
+    follow_up = updates[-1]
+    assert isinstance(follow_up, EventSpec)
+    assert follow_up.handler.fn.__name__ == "update_summary"
+    # Only the answer reached the model while the handler held the state lock
+    assert chat.calls == 1
+    assert writer.summaries == []
+
+
+def test_summary_event_folds_old_turns(chat, writer):
+    async def scenario():
+        async with StateManagerMemory(state=rx.State).modify_state(TOKEN) as root:
+            state = await root.get_state(State)
+            state.user_id = "user-1"
+            await State.update_summary.fn(Unlocked(state), DEFAULT_CHAT, "Session#1", EARLIER_TURNS)
+            return state._summaries[DEFAULT_CHAT]
+
+    summary = asyncio.run(scenario())
+    assert chat.calls == 1
+    # Everything but the last CONTEXT_TURNS turns is folded, and the summary is persisted
+    assert summary["turns"] == EARLIER_TURNS - CONTEXT_TURNS
+    assert [s[1:3] + s[4:] for s in writer.summaries] == [("Session#1", DEFAULT_CHAT, summary["turns"])]
+    assert summary["text"].startswith("(fake) answer")